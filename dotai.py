@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+#the AI strategies selectable by name
+from dotengine import GreedyStrategy
+from dotsearch import AlphaBetaStrategy
+from dotmcts import MCTSStrategy
+from dotchains import ChainStrategy
+from dotnimber import NimberStrategy
+from dottablebase import TablebaseStrategy
+
+#the tablebase player needs a strategy for the positions not in the tables.
+#every fallback but greedy reads the cache of solved positions shared by
+#the strategies unless shared_cache is off
+def tablebase_strategy(paths = (), fallback = 'greedy', fallback_options = None, shared_cache = True):
+    options = dict(fallback_options or {})
+    if fallback != 'greedy':
+        options.setdefault('shared_cache', shared_cache)
+    return TablebaseStrategy(paths, strategy_get(fallback, **options))
+
+strategies = {
+    'greedy' : GreedyStrategy,
+    'alphabeta' : AlphaBetaStrategy,
+    'mcts' : MCTSStrategy,
+    'chains' : ChainStrategy,
+    'nimber' : NimberStrategy,
+    'tablebase' : tablebase_strategy,
+}
+
+def strategy_get(name, **options):
+    if name not in strategies:
+        raise ValueError('Unknown AI strategy %s. Choose from %s' %(name, ', '.join(sorted(strategies.keys()))))
+    return strategies[name](**options)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#best move and evaluation of every position of a file, on all the cores.
+#the positions are JSON lines of the board size in boxes and the drawn
+#edges as the (r1, c1, r2, c2) dots mark_move takes:
+#  {"id": "a", "rows": 5, "cols": 5, "edges": [[0, 0, 0, 1], [2, 3, 3, 3]]}
+#or a game archive of dotrecord.py with the moves of each record drawn.
+#the answers are JSON lines in the order of the positions. only a window
+#of positions is out at the workers at once, so the memory does not grow
+#with the input however big it is.
+#./dotanalyze.py positions.jsonl --output answers.jsonl --time-per-position 0.5
+#./dotanalyze.py games.dotr --ai chains
+import io
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from collections import deque
+from dotgraph import *
+from dotengine import GameEngine
+from dotai import strategies
+from dotrecord import HEADER, GameRecord, record_stream
+from dottournament import getargspec, strategy_make
+
+timer = getattr(time, 'perf_counter', time.time)
+
+#the engine of a JSON line or an archive record
+def position_engine(kind, data):
+    if kind == 'record':
+        record = GameRecord(data)
+        engine = GameEngine(record.rows, record.cols)
+        grids = record.grids()
+        key = None
+    else:
+        position = json.loads(data)
+        engine = GameEngine(int(position['rows']) + 1, int(position['cols']) + 1)
+        grids = position.get('edges', [])
+        key = position.get('id')
+    for grid in grids:
+        grid = tuple(int(x) for x in grid)
+        if not engine.mark_grid(*grid):
+            raise ValueError('Edge %d:%d<->%d:%d drawn twice' %grid)
+        for taken in engine.mark_move(*grid):
+            engine.take_grid(engine.PLAYER1)
+    return engine, key
+
+#the strategy of a worker process kept across the positions it analyzes
+strategy_map = {}
+
+#runs on the pool. returns the answer for the position as a dict
+def analyze(job):
+    index, kind, data, name, options = job
+    answer = { 'index' : index }
+    try:
+        engine, key = position_engine(kind, data)
+        if key is not None:
+            answer['id'] = key
+        strategy = strategy_map.get(name)
+        if strategy is None:
+            strategy = strategy_map[name] = strategy_make(name, options, 0)
+        start = timer()
+        grid = None
+        if engine.game_finished():
+            #nothing is left to make, the strategy has not searched it
+            answer['move'] = None
+            answer['value'] = 0
+        else:
+            if hasattr(strategy, 'best_move'):
+                #searched even when the move is forced so that it has a value
+                edge = strategy.best_move(engine.position(), evaluate = True)
+                if edge is not None:
+                    grid = engine.geometry.edge_coords(edge)
+            else:
+                grid = strategy.make_move(engine)
+            answer['move'] = list(grid) if grid is not None else None
+            #the net boxes the side to move makes from here on, from the
+            #searches that got through an iteration of this position
+            if getattr(strategy, 'depth', 0) > 0:
+                answer['value'] = strategy.value
+                answer['depth'] = strategy.depth
+            if hasattr(strategy, 'nodes'):
+                answer['nodes'] = strategy.nodes
+        answer['seconds'] = round(timer() - start, 6)
+    except (KeyError, TypeError, ValueError) as e:
+        answer['error'] = '%s: %s' %(e.__class__.__name__, e)
+    return answer
+
+#the (kind, data) of every position of the input, read as they are needed
+def read_positions(f):
+    head = f.peek(len(HEADER))[:len(HEADER)] if hasattr(f, 'peek') else b''
+    if bytearray(head) == HEADER:
+        for record in record_stream(f):
+            yield 'record', record.data
+    else:
+        for line in f:
+            if line.strip():
+                yield 'json', line
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Stream the best move and evaluation of dots and boxes positions')
+    parser.add_argument('input', help = 'JSON lines of positions or a game archive, - for stdin')
+    parser.add_argument('--output', help = 'file for the JSON answers, stdout by default')
+    parser.add_argument('--ai', default = 'alphabeta', choices = sorted(strategies.keys()))
+    parser.add_argument('--ai-options', default = '{}', help = 'JSON options for the AI')
+    parser.add_argument('--time-per-position', type = float, help = 'seconds of thinking per position')
+    parser.add_argument('--workers', type = int, default = multiprocessing.cpu_count())
+    parser.add_argument('--window', type = int, help = 'positions out at the workers at most, 4 per worker by default')
+    args = parser.parse_args(argv)
+
+    options = json.loads(args.ai_options)
+    if args.time_per_position is not None:
+        if 'time_budget' not in getargspec(strategies[args.ai].__init__).args:
+            parser.error('the %s AI has no time budget' %args.ai)
+        options['time_budget'] = args.time_per_position
+    window = args.window or args.workers * 4
+    if args.input == '-':
+        source = getattr(sys.stdin, 'buffer', sys.stdin)
+    else:
+        source = io.open(args.input, 'rb')
+    output = open(args.output, 'w') if args.output else sys.stdout
+
+    def write(answer):
+        output.write(json.dumps(answer, sort_keys = True) + '\n')
+
+    pool = None
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers)
+    #the answers in the order of the positions, the oldest waited for
+    #before another position goes out once the window is full
+    pending = deque()
+    count = errors = 0
+    start = timer()
+    try:
+        for index, (kind, data) in enumerate(read_positions(source)):
+            job = (index, kind, data, args.ai, options)
+            if pool is None:
+                answer = analyze(job)
+                errors += 'error' in answer
+                write(answer)
+            else:
+                if len(pending) >= window:
+                    answer = pending.popleft().get()
+                    errors += 'error' in answer
+                    write(answer)
+                pending.append(pool.apply_async(analyze, (job,)))
+            count += 1
+        while pending:
+            answer = pending.popleft().get()
+            errors += 'error' in answer
+            write(answer)
+    finally:
+        if pool:
+            pool.terminate()
+        if args.input != '-':
+            source.close()
+        if args.output:
+            output.close()
+    elapsed = timer() - start
+    sys.stderr.write('%d positions, %d errors in %.2fs, %.1f positions/s on %d workers\n'
+                     %(count, errors, elapsed, count / max(elapsed, 1e-9), args.workers))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+#batched evaluation of many boards of the same size with numpy.
+#the K boards are one K x edges array of drawn edges next to a K x boxes
+#array of box side counts, and the moves, captures and scores of all the
+#boards come out of a few whole array operations through the edge and box
+#tables of the geometry instead of a python loop per board and edge.
+#./dotbatch.py 5 5 --boards 4096
+import sys
+import time
+import random
+import argparse
+import numpy as np
+from collections import OrderedDict
+from dotgraph import *
+from dotengine import GameEngine
+
+timer = getattr(time, 'perf_counter', time.time)
+
+#the incidence of the edges and boxes of a geometry as arrays.
+#the border is an extra ground box past the last one whose side count is
+#kept at 0 and whose sides are an extra edge past the last one that is
+#always drawn, so the boxes and the edges around a move can be looked up
+#without testing for the border
+class BatchTables(object):
+
+    def __init__(self, geometry):
+        num_edges, num_boxes = geometry.num_edges, geometry.num_boxes
+        self.ground = num_boxes
+        self.ground_edge = num_edges
+        self.edge_box = np.full((num_edges + 1, 2), self.ground, dtype = np.intp)
+        self.edge_box[:-1] = np.array(geometry.edge_box, dtype = np.intp).reshape(num_edges, 2)
+        self.edge_box[self.edge_box < 0] = self.ground
+        self.box_edge = np.full((num_boxes + 1, 4), self.ground_edge, dtype = np.intp)
+        self.box_edge[:-1] = np.array(geometry.box_edge, dtype = np.intp).reshape(num_boxes, 4)
+        self.first_box = self.edge_box[:, 0].copy()
+        self.second_box = self.edge_box[:, 1].copy()
+
+DRAWN = 3
+
+#the bucket of an edge indexed by the side counts of its 2 boxes and
+#whether it is drawn, (first * 5 + second) * 2 + drawn
+def bucket_table():
+    buckets = np.zeros(50, dtype = np.int8)
+    for first in xrange(5):
+        for second in xrange(5):
+            code = (first * 5 + second) * 2
+            if 3 in (first, second):
+                buckets[code] = GameEngine.CAPTURE
+            elif max(first, second) < 2:
+                buckets[code] = GameEngine.SAFE
+            else:
+                buckets[code] = GameEngine.GIVEAWAY
+            buckets[code + 1] = DRAWN
+    return buckets
+
+BUCKETS = bucket_table()
+
+tables_map = OrderedDict()
+
+def batch_tables(geometry):
+    return cache_get(tables_map, (geometry.rows, geometry.cols), lambda: BatchTables(geometry))
+
+#the K boards keep the side counts of their boxes and the GameEngine bucket
+#of every edge, updated for just the edges around the boxes of each move
+class BoardBatch(object):
+    CAPTURE = GameEngine.CAPTURE
+    SAFE = GameEngine.SAFE
+    GIVEAWAY = GameEngine.GIVEAWAY
+    DRAWN = DRAWN
+
+    #rows and cols are the number of dots like GameEngine, count the number of boards
+    def __init__(self, rows, cols, count):
+        self.geometry = geometry_get(rows, cols)
+        self.tables = batch_tables(self.geometry)
+        self.count = count
+        num_edges = self.geometry.num_edges
+        #the ground edge is the last column
+        self.edges = np.zeros((count, num_edges + 1), dtype = np.uint8)
+        self.edges[:, -1] = 1
+        self.drawn = self.edges[:, :-1]
+        self.sides = np.zeros((count, self.geometry.num_boxes + 1), dtype = np.int8)
+        self.classes = np.full((count, num_edges + 1), self.SAFE, dtype = np.int8)
+        self.classes[:, -1] = self.DRAWN
+        #the order edges of the same bucket are played in and the key choose
+        #takes the largest of, the bucket first and the rank next
+        #half the memory for argmax to go through when the keys fit in 16 bits
+        key_type = np.int16 if 4 * num_edges < 1 << 15 else np.int32
+        self.rank = np.zeros((count, num_edges + 1), dtype = key_type)
+        self.bucket_keys = np.array([ 3 * num_edges, 2 * num_edges, num_edges, -num_edges ], dtype = key_type)
+        self.priority = self.bucket_keys[self.classes] + self.rank
+        self.flat_edges = self.edges.reshape(-1)
+        self.flat_sides = self.sides.reshape(-1)
+        self.flat_classes = self.classes.reshape(-1)
+        self.flat_rank = self.rank.reshape(-1)
+        self.flat_priority = self.priority.reshape(-1)
+        self.edges_left = np.full(count, num_edges, dtype = np.int32)
+        self.scores = np.zeros((count, 2), dtype = np.int32)
+        #the player to move on every board
+        self.turn = np.zeros(count, dtype = np.int8)
+
+    #a batch of copies of the engines, each one copies times in a row
+    @classmethod
+    def from_engines(cls, engines, players = None, copies = 1):
+        engine = engines[0]
+        batch = cls(engine.rows, engine.cols, len(engines) * copies)
+        for i, engine in enumerate(engines):
+            player = GameEngine.PLAYER1 if players is None else players[i]
+            batch.load(slice(i * copies, (i+1) * copies), engine, player)
+        batch.classify()
+        return batch
+
+    #copy the engine to the boards of the index, classify has to be called
+    #once all of them are loaded
+    def load(self, index, engine, player = GameEngine.PLAYER1):
+        self.drawn[index] = [ engine.is_drawn(edge) for edge in xrange(self.geometry.num_edges) ]
+        self.sides[index, :-1] = np.frombuffer(bytes(engine.box_sides), dtype = np.uint8)
+        self.edges_left[index] = engine.edges_left
+        self.scores[index] = engine.scores
+        self.turn[index] = player
+
+    #the bucket of the edges from the side counts of their boxes and the
+    #drawn edges, for any shape of rows and edges indices
+    def edge_classes(self, rows, edges):
+        first = self.sides[rows, self.tables.first_box[edges]]
+        second = self.sides[rows, self.tables.second_box[edges]]
+        return BUCKETS[(first * 5 + second) * 2 + self.edges[rows, edges]]
+
+    def classify(self):
+        rows = np.arange(self.count)[:, None]
+        self.classes[:] = self.edge_classes(rows, np.arange(self.geometry.num_edges + 1)[None, :])
+        self.priority[:] = self.bucket_keys[self.classes] + self.rank
+
+    #play the edges of a bucket in a random order on every board
+    def shuffle(self, rand):
+        self.rank[:, :-1] = rand.random_sample(self.drawn.shape).argsort(axis = 1)
+        self.priority[:] = self.bucket_keys[self.classes] + self.rank
+
+    #the box side counts recomputed from the drawn edges, K x boxes,
+    #gathered through the 4 sides of every box
+    def box_sides(self):
+        return self.drawn[:, self.tables.box_edge[:-1]].sum(axis = -1, dtype = np.int16)
+
+    def capture_mask(self):
+        return self.classes[:, :-1] == self.CAPTURE
+
+    def safe_mask(self):
+        return self.classes[:, :-1] == self.SAFE
+
+    def giveaway_mask(self):
+        return self.classes[:, :-1] == self.GIVEAWAY
+
+    #player 1 boxes less player 2 boxes
+    def score_diff(self):
+        return self.scores[:, 0] - self.scores[:, 1]
+
+    def finished(self):
+        return self.edges_left == 0
+
+    #draw an edge on every board, -1 for none, and credit the boxes it
+    #completes to the player to move, who moves again then.
+    #returns the boxes completed on every board
+    def play(self, edges):
+        index = np.nonzero(edges >= 0)[0]
+        edge = edges[index]
+        #flat indices into the arrays, which is quicker than indexing by row and column
+        edge_row = index[:, None] * self.edges.shape[1]
+        box_row = index[:, None] * self.sides.shape[1]
+        self.flat_edges[index * self.edges.shape[1] + edge] = 1
+        self.edges_left[index] -= 1
+        boxes = self.tables.edge_box[edge]
+        sides_at = box_row + boxes
+        sides = self.flat_sides[sides_at] + 1
+        #the ground box may be one of the 2 and stays at 0
+        sides[boxes == self.tables.ground] = 0
+        self.flat_sides[sides_at] = sides
+        completed = np.zeros(self.count, dtype = np.int32)
+        taken = (sides == 4).sum(axis = 1)
+        completed[index] = taken
+        self.scores[index, self.turn[index]] += taken
+        self.turn[index] ^= (taken == 0).astype(np.int8)
+        #only the sides of the 2 boxes change bucket
+        around = self.tables.box_edge[boxes].reshape(len(index), 8)
+        first = self.flat_sides[box_row + self.tables.first_box[around]]
+        second = self.flat_sides[box_row + self.tables.second_box[around]]
+        around_at = edge_row + around
+        classes = BUCKETS[(first * 5 + second) * 2 + self.flat_edges[around_at]]
+        self.flat_classes[around_at] = classes
+        self.flat_priority[around_at] = self.bucket_keys[classes] + self.flat_rank[around_at]
+        return completed
+
+    #a capture if there is one, else a safe edge, else any edge, the edges
+    #of a bucket in the order of rank. -1 on the finished boards
+    def choose(self):
+        edges = self.priority[:, :-1].argmax(axis = 1)
+        edges[self.finished()] = -1
+        return edges
+
+    #play every board to the end in a random order, returns score_diff
+    def rollout(self, seed = None):
+        self.shuffle(np.random.RandomState(seed))
+        while self.edges_left.any():
+            self.play(self.choose())
+        return self.score_diff()
+
+#the average number of boxes the player to move makes from here on in
+#random rollouts of every engine, all of them played as one batch
+def score_positions(engines, players = None, rollouts = 64, seed = None):
+    batch = BoardBatch.from_engines(engines, players, copies = rollouts)
+    start = batch.score_diff()
+    turn = batch.turn.copy()
+    net = (batch.rollout(seed) - start).astype(np.float64)
+    net[turn == GameEngine.PLAYER2] *= -1
+    return net.reshape(len(engines), rollouts).mean(axis = 1)
+
+#the same rollout one engine at a time for comparison
+def engine_rollout(engine, rand):
+    player = GameEngine.PLAYER1
+    while engine.edges_left > 0:
+        for bucket in engine.buckets:
+            if bucket:
+                edge = bucket.members[rand.randrange(len(bucket))]
+                break
+        if engine.mark_edge(edge):
+            taken = engine.mark_edge_move(edge)
+            for grid in taken:
+                engine.take_grid(player)
+            if not taken:
+                player ^= 1
+    return engine.scores[0] - engine.scores[1]
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Time batched random rollouts against one engine at a time')
+    parser.add_argument('rows', type = int, nargs = '?', default = 5, help = 'boxes')
+    parser.add_argument('cols', type = int, nargs = '?', default = 5, help = 'boxes')
+    parser.add_argument('--boards', type = int, default = 4096)
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args(argv)
+    rows, cols = args.rows + 1, args.cols + 1
+
+    start = timer()
+    batch = BoardBatch(rows, cols, args.boards)
+    diff = batch.rollout(args.seed)
+    batch_time = timer() - start
+    print('batch:  %d games in %.3fs, %.1f us per game, mean score diff %+.2f'
+          %(args.boards, batch_time, batch_time * 1e6 / args.boards, diff.mean()))
+    #a sample of the engine rollouts is enough for the rate
+    games = min(args.boards, 256)
+    rand = random.Random(args.seed)
+    start = timer()
+    total = 0
+    for i in xrange(games):
+        total += engine_rollout(GameEngine(rows, cols), rand)
+    engine_time = timer() - start
+    print('engine: %d games in %.3fs, %.1f us per game, mean score diff %+.2f'
+          %(games, engine_time, engine_time * 1e6 / games, float(total) / games))
+    print('%.1fx faster' %((engine_time / games) / (batch_time / args.boards)))
+
+if __name__ == '__main__':
+    main()
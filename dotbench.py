@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+#benchmarks of the engine hot paths and of complete games, headless.
+#./dotbench.py --output baseline.json
+#./dotbench.py --compare baseline.json --threshold 0.1
+import gc
+import sys
+import json
+import time
+import random
+import platform
+import multiprocessing
+import argparse
+from dotgraph import *
+from dotengine import GameEngine
+from dottournament import play_game
+from dotsearch import AlphaBetaStrategy
+
+try:
+    import tracemalloc
+except ImportError:
+    #python2, only the peak of the whole process is known
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import dotbatch
+except ImportError:
+    #numpy is not installed
+    dotbatch = None
+
+timer = getattr(time, 'perf_counter', time.time)
+
+DEFAULT_SIZES = '3x3,5x5,10x10,20x20,50x50,100x100'
+#the startup benchmark also runs on a board of a million boxes
+STARTUP_SIZES = '1000x1000'
+#shortest time of one sample, the quick benchmarks are run several times per sample
+MIN_SAMPLE = 0.05
+
+#each benchmark takes the board size in boxes and a seed and returns the
+#function to time and the number of operations it does in one call
+
+def bench_get_all_edges(rows, cols, seed):
+    def run():
+        get_all_edges(rows, cols)
+    return run, 1
+
+def bench_neighbors_get(rows, cols, seed):
+    edges = get_all_edges(rows, cols)
+    max_vertex = Vertex(rows, cols)
+    def run():
+        for edge in edges:
+            edge.neighbors_get(max_vertex)
+    return run, len(edges)
+
+def bench_graph_add(rows, cols, seed):
+    edges = get_all_edges(rows, cols)
+    def run():
+        Graph(edges)
+    return run, len(edges)
+
+def bench_graph_is_connected(rows, cols, seed):
+    edges = get_all_edges(rows, cols)
+    graph = Graph(edges[::2])
+    def run():
+        for edge in edges:
+            graph.is_connected(edge)
+    return run, len(edges)
+
+def bench_graph_remove(rows, cols, seed):
+    edges = get_all_edges(rows, cols)
+    vertices = [ Vertex(r, c) for r in xrange(rows+1) for c in xrange(cols+1) ]
+    random.Random(seed).shuffle(vertices)
+    def run():
+        graph = Graph(edges)
+        for vertex in vertices:
+            graph.remove(vertex)
+    return run, len(vertices)
+
+def bench_graph_find_shortest_path(rows, cols, seed):
+    graph = Graph(get_all_edges(rows, cols))
+    start, end = Vertex(0, 0), Vertex(rows, cols)
+    def run():
+        graph.find_shortest_path(start, end)
+    return run, 1
+
+def bench_mark_move(rows, cols, seed):
+    grids = [ edge for edge in get_all_edges(rows, cols) ]
+    grids = [ (e.v1.row, e.v1.col, e.v2.row, e.v2.col) for e in grids ]
+    random.Random(seed).shuffle(grids)
+    def run():
+        engine = GameEngine(rows+1, cols+1)
+        for grid in grids:
+            engine.mark_grid(*grid)
+            engine.mark_move(*grid)
+    return run, len(grids)
+
+#a new engine with a geometry not in the cache, what a huge board costs
+#before the first move
+def bench_startup(rows, cols, seed):
+    def run():
+        geometry_cache.clear()
+        GameEngine(rows+1, cols+1)
+    return run, rows * (cols+1) + cols * (rows+1)
+
+#a whole game of make_move against itself, the marking is included
+def bench_make_move(rows, cols, seed):
+    def run():
+        engine = GameEngine(rows+1, cols+1)
+        engine.self_play()
+    return run, rows * (cols+1) + cols * (rows+1)
+
+def bench_game(strategy_a, strategy_b):
+    def bench(rows, cols, seed):
+        job = (0, rows, cols, seed, True, (strategy_a, strategy_b), ({}, {}), 2)
+        def run():
+            play_game(job)
+        return run, 1
+    return bench
+
+#random rollouts of a batch of boards, the boards shrinking with the size
+#since every move looks at all the edges of all of them
+def bench_batch_rollout(rows, cols, seed):
+    edges = rows * (cols+1) + cols * (rows+1)
+    count = max(4, (1 << 16) // edges)
+    def run():
+        dotbatch.BoardBatch(rows+1, cols+1, count).rollout(seed)
+    return run, count * edges
+
+benchmarks = [
+    ('get_all_edges', bench_get_all_edges),
+    ('neighbors_get', bench_neighbors_get),
+    ('graph_add', bench_graph_add),
+    ('graph_is_connected', bench_graph_is_connected),
+    ('graph_remove', bench_graph_remove),
+    ('graph_find_shortest_path', bench_graph_find_shortest_path),
+    ('startup', bench_startup),
+    ('mark_move', bench_mark_move),
+    ('make_move', bench_make_move),
+    ('game_greedy_greedy', bench_game('greedy', 'greedy')),
+    ('game_chains_greedy', bench_game('chains', 'greedy')),
+]
+if dotbatch is not None:
+    benchmarks.append(('batch_rollout', bench_batch_rollout))
+
+#positions of games opened with random safe edges
+def opened_positions(rows, cols, opening, count, seed):
+    rand = random.Random(seed)
+    positions = []
+    for i in xrange(count):
+        engine = GameEngine(rows+1, cols+1)
+        for j in xrange(opening):
+            bucket = engine.buckets[engine.SAFE]
+            if not bucket:
+                break
+            engine.mark_edge(bucket.members[rand.randrange(len(bucket))])
+        positions.append(engine.position())
+    return positions
+
+#time to depth of the lazy SMP alpha-beta search with each number of
+#workers, the speedup against 1 worker
+def parallel_speedup(workers, rows, cols, depth, opening, count, seed):
+    results = []
+    for number in workers:
+        strategy = AlphaBetaStrategy(time_budget = 0, max_depth = depth, workers = number)
+        #starts the helper processes
+        strategy.best_move(opened_positions(rows, cols, opening, 1, seed + 1)[0])
+        nodes = 0
+        start = timer()
+        for position in opened_positions(rows, cols, opening, count, seed):
+            strategy.best_move(position)
+            nodes += strategy.nodes
+        seconds = timer() - start
+        strategy.close()
+        result = { 'workers' : strategy.workers, 'rows' : rows, 'cols' : cols, 'depth' : depth,
+                   'positions' : count, 'seconds' : seconds, 'nodes' : nodes,
+                   'speedup' : results[0]['seconds'] / seconds if results else 1.0 }
+        results.append(result)
+        sys.stderr.write('%2d workers %4dx%-4d depth %d %10.3fs %10d nodes %6.2fx\n'
+                         %(result['workers'], rows, cols, depth, seconds, nodes, result['speedup']))
+    return results
+
+def measure(bench, rows, cols, seed, repeat):
+    run, ops = bench(rows, cols, seed)
+    start = timer()
+    run()
+    number = max(1, int(MIN_SAMPLE / max(timer() - start, 1e-9)))
+    times = []
+    for i in xrange(repeat):
+        gc.collect()
+        start = timer()
+        for j in xrange(number):
+            run()
+        times.append((timer() - start) / number)
+    max_rss = None
+    if resource is not None:
+        #read before the traced run, which allocates for the traces.
+        #the high water mark of the process in kilobytes on linux, it only
+        #grows so the later sizes dominate
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    peak = None
+    if tracemalloc is not None:
+        #a separate run since tracing slows everything down
+        gc.collect()
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    times.sort()
+    return { 'seconds' : times[0], 'median' : times[len(times) // 2], 'ops' : ops, 'number' : number,
+             'ns_per_op' : times[0] * 1e9 / ops, 'peak_bytes' : peak if peak is not None else max_rss,
+             'bytes_per_op' : float(peak) / ops if peak is not None else None, 'max_rss_bytes' : max_rss }
+
+def parse_sizes(sizes):
+    result = []
+    for size in sizes.split(','):
+        if 'x' in size:
+            rows, cols = size.split('x')
+        else:
+            rows = cols = size
+        result.append( (int(rows), int(cols)) )
+    return result
+
+def run_benchmarks(sizes, names, repeat, seed, startup_sizes = ()):
+    results = []
+    for name, bench in benchmarks:
+        if names and name not in names:
+            continue
+        bench_sizes = sizes
+        if name == 'startup':
+            bench_sizes = sizes + [ size for size in startup_sizes if size not in sizes ]
+        for rows, cols in bench_sizes:
+            result = { 'name' : name, 'rows' : rows, 'cols' : cols }
+            result.update(measure(bench, rows, cols, seed, repeat))
+            results.append(result)
+            sys.stderr.write('%-26s %4dx%-4d %12.6fs %10.0f ns/op %8.1fMB max rss\n'
+                             %(name, rows, cols, result['seconds'], result['ns_per_op'],
+                               (result['max_rss_bytes'] or 0) / float(1 << 20)))
+    return results
+
+#compare the best times against the baseline, returns the regressions
+def compare(results, baseline, threshold):
+    previous = dict( ((r['name'], r['rows'], r['cols']), r) for r in baseline['results'] )
+    regressions = []
+    for result in results:
+        key = (result['name'], result['rows'], result['cols'])
+        if key not in previous or previous[key]['seconds'] <= 0:
+            continue
+        ratio = result['seconds'] / previous[key]['seconds']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'REGRESSION'
+            regressions.append(result)
+        elif ratio < 1 - threshold:
+            flag = 'faster'
+        print('%-26s %4dx%-4d %12.6fs %12.6fs %6.2fx %s' %(result['name'], result['rows'], result['cols'],
+                                                          previous[key]['seconds'], result['seconds'], ratio, flag))
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark the dots and boxes engine')
+    parser.add_argument('--sizes', default = DEFAULT_SIZES, help = 'comma separated board sizes in boxes')
+    parser.add_argument('--only', help = 'comma separated benchmark names')
+    parser.add_argument('--startup-sizes', default = STARTUP_SIZES,
+                        help = 'comma separated board sizes the startup benchmark runs on as well, empty for none')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--output', help = 'file for the JSON results, stdout by default')
+    parser.add_argument('--compare', help = 'baseline JSON results to compare against')
+    parser.add_argument('--threshold', type = float, default = 0.10, help = 'slowdown ratio counted as a regression')
+    parser.add_argument('--list', action = 'store_true', help = 'list the benchmarks')
+    parser.add_argument('--parallel', help = 'comma separated worker counts to time the parallel search with instead')
+    parser.add_argument('--parallel-size', default = '5x5', help = 'board size in boxes of --parallel')
+    parser.add_argument('--depth', type = int, default = 6, help = 'search depth of --parallel')
+    parser.add_argument('--positions', type = int, default = 8, help = 'positions searched by --parallel')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, bench in benchmarks:
+            print(name)
+        return 0
+    if args.parallel:
+        rows, cols = parse_sizes(args.parallel_size)[0]
+        workers = [ int(number) for number in args.parallel.split(',') ]
+        results = parallel_speedup(workers, rows, cols, args.depth, rows * cols // 2, args.positions, args.seed)
+        report = { 'python' : platform.python_version(), 'platform' : platform.platform(),
+                   'cpus' : multiprocessing.cpu_count(), 'seed' : args.seed, 'parallel' : results }
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent = 1, sort_keys = True)
+        else:
+            print(json.dumps(report, indent = 1, sort_keys = True))
+        return 0
+    names = set(args.only.split(',')) if args.only else None
+    startup_sizes = parse_sizes(args.startup_sizes) if args.startup_sizes else []
+    results = run_benchmarks(parse_sizes(args.sizes), names, args.repeat, args.seed, startup_sizes)
+    report = { 'python' : platform.python_version(), 'platform' : platform.platform(),
+               'seed' : args.seed, 'repeat' : args.repeat, 'results' : results }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent = 1, sort_keys = True)
+    elif not args.compare:
+        print(json.dumps(report, indent = 1, sort_keys = True))
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('%d regressions over %.0f%%' %(len(regressions), args.threshold * 100))
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+#chain and loop decomposition of a dots and boxes board for endgame play.
+#boxes with 2 or 3 drawn sides are joined through their undrawn shared edges
+#into components that are either chains or loops. the components are kept
+#in a union-find that is updated as the engine draws edges.
+#the roots are nodes of their own after the boxes, so a chain cut in the
+#middle splits off its shorter side with a new root and the longer side
+#keeps the old one. a cut costs the length of the shorter side and the
+#other updates O(a(n)). the nodes left behind by the cuts are collected
+#by building everything again once there are COMPACT_NODES per box, which
+#amortizes to O(1) a move. an undrawn edge rebuilds its components.
+import sys
+from array import array
+from dotgraph import *
+from dotengine import GameEngine
+from dotsymmetry import evaluation_cache_find
+from dotsearch import solved_move
+
+COMPACT_NODES = 4
+
+class ChainAnalyzer(object):
+    CHAIN = 'chain'
+    LOOP = 'loop'
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.geometry = engine.geometry
+        self.build()
+        engine.listeners.append(self)
+
+    #the components of the board from scratch
+    def build(self):
+        num_boxes = self.geometry.num_boxes
+        #the boxes then the roots
+        self.parent = array('i', xrange(num_boxes))
+        #counters kept on the root of each component: boxes, undrawn edges
+        #between two boxes of the component, undrawn sides of its boxes and
+        #boxes with 3 sides that can be taken
+        self.size = array('i', [0]) * num_boxes
+        self.links = array('i', [0]) * num_boxes
+        self.ports = array('i', [0]) * num_boxes
+        self.capturable = array('i', [0]) * num_boxes
+        self.active = bytearray(num_boxes)
+        self.members = {}
+        for box in xrange(num_boxes):
+            if self.is_member(box):
+                self.add_box(box)
+
+    def new_root(self):
+        root = len(self.parent)
+        self.parent.append(root)
+        for counter in (self.size, self.links, self.ports, self.capturable):
+            counter.append(0)
+        return root
+
+    def is_member(self, box):
+        return 2 <= self.engine.box_sides[box] <= 3
+
+    def find(self, box):
+        parent = self.parent
+        while parent[box] != box:
+            parent[box] = parent[parent[box]]
+            box = parent[box]
+        return box
+
+    #the box across the edge from box, -1 for the border
+    def other_box(self, edge, box):
+        box1, box2 = self.geometry.edge_box[edge*2], self.geometry.edge_box[edge*2 + 1]
+        return box2 if box1 == box else box1
+
+    def undrawn_edges(self, box):
+        return [ edge for edge in self.geometry.box_edges(box) if not self.engine.is_drawn(edge) ]
+
+    def join(self, box1, box2):
+        root1, root2 = self.find(box1), self.find(box2)
+        if root1 == root2:
+            #closing a loop
+            self.links[root1] += 1
+            return
+        if self.size[root1] < self.size[root2]:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        self.size[root1] += self.size[root2]
+        self.links[root1] += self.links[root2] + 1
+        self.ports[root1] += self.ports[root2]
+        self.capturable[root1] += self.capturable[root2]
+        self.members[root1].update(self.members.pop(root2))
+
+    def add_box(self, box):
+        sides = self.engine.box_sides[box]
+        root = self.new_root()
+        self.active[box] = 1
+        self.parent[box] = root
+        self.size[root] = 1
+        self.ports[root] = 4 - sides
+        self.capturable[root] = 1 if sides == 3 else 0
+        self.members[root] = set([box])
+        for edge in self.undrawn_edges(box):
+            other = self.other_box(edge, box)
+            if other >= 0 and self.active[other]:
+                self.join(box, other)
+
+    #a taken box leaves its component. the box stays in the parent links
+    #so the finds through it still work until the component is rebuilt
+    def remove_box(self, box, root):
+        self.active[box] = 0
+        self.size[root] -= 1
+        self.members[root].discard(box)
+        if not self.members[root]:
+            del self.members[root]
+
+    #the next box of a chain going away from previous, -1 at its end
+    def next_box(self, box, previous):
+        for edge in self.undrawn_edges(box):
+            other = self.other_box(edge, box)
+            if other >= 0 and other != previous and self.active[other]:
+                return other
+        return -1
+
+    #the chain was cut between box1 and box2. walk away from the cut on
+    #both sides a box at a time and give the side that ends first a root
+    #of its own
+    def split(self, root, box1, box2):
+        sides = [ [ box1 ], [ box2 ] ]
+        previous = [ box2, box1 ]
+        while True:
+            for side, path in enumerate(sides):
+                box = self.next_box(path[-1], previous[side])
+                if box < 0:
+                    break
+                previous[side] = path[-1]
+                path.append(box)
+            if box < 0:
+                break
+        box_sides = self.engine.box_sides
+        new = self.new_root()
+        for box in path:
+            self.parent[box] = new
+        self.size[new] = len(path)
+        self.links[new] = len(path) - 1
+        self.ports[new] = sum(4 - box_sides[box] for box in path)
+        self.capturable[new] = len([ box for box in path if box_sides[box] == 3 ])
+        for counter in (self.size, self.links, self.ports, self.capturable):
+            counter[root] -= counter[new]
+        self.members[root].difference_update(path)
+        self.members[new] = set(path)
+
+    #split a component by adding its remaining boxes back from scratch
+    def rebuild(self, root):
+        boxes = self.members.pop(root)
+        for box in boxes:
+            self.active[box] = 0
+        for box in boxes:
+            if self.is_member(box):
+                self.add_box(box)
+
+    def edge_drawn(self, edge):
+        box1, box2 = self.geometry.edge_box[edge*2], self.geometry.edge_box[edge*2 + 1]
+        box_sides = self.engine.box_sides
+        if box1 >= 0 and box2 >= 0 and self.active[box1] and self.active[box2]:
+            #a link of the component is gone
+            root = self.find(box1)
+            self.links[root] -= 1
+            self.ports[root] -= 2
+            taken = [ box for box in (box1, box2) if box_sides[box] == 4 ]
+            if not taken:
+                #cut in the middle, both boxes have 3 sides now. a loop
+                #becomes a chain and a chain splits in two
+                self.capturable[root] += 2
+                if self.links[root] != self.size[root] - 1:
+                    self.split(root, box1, box2)
+                    if len(self.parent) > COMPACT_NODES * self.geometry.num_boxes:
+                        self.build()
+                return
+            #a taken box was the end of the chain so the rest stays connected
+            for box in (box1, box2):
+                if box_sides[box] == 4:
+                    self.capturable[root] -= 1
+                    self.remove_box(box, root)
+                else:
+                    self.capturable[root] += 1
+            return
+        for box in (box1, box2):
+            if box < 0:
+                continue
+            sides = box_sides[box]
+            if self.active[box]:
+                root = self.find(box)
+                self.ports[root] -= 1
+                if sides == 3:
+                    self.capturable[root] += 1
+                else:
+                    #its only undrawn side was not a link, so it was alone
+                    self.capturable[root] -= 1
+                    self.remove_box(box, root)
+            elif sides == 2:
+                self.add_box(box)
+
+    #the components of the 2 boxes are built again, the edge may join them,
+    #and the boxes that have 2 or 3 sides again are added back
+    def edge_undrawn(self, edge):
+        boxes = [ box for box in self.geometry.edge_boxes(edge) if box >= 0 ]
+        for box in boxes:
+            if self.active[box]:
+                self.rebuild(self.find(box))
+        for box in boxes:
+            if not self.active[box] and self.is_member(box):
+                self.add_box(box)
+        if len(self.parent) > COMPACT_NODES * self.geometry.num_boxes:
+            self.build()
+
+    def kind(self, root):
+        if self.capturable[root] == 0 and self.links[root] == self.size[root]:
+            return self.LOOP
+        return self.CHAIN
+
+    #the components as (root, kind, length) tuples
+    def components(self):
+        return [ (root, self.kind(root), self.size[root]) for root in self.members ]
+
+    #the boxes of the component in order from box to the other end
+    def walk(self, box):
+        path = [ box ]
+        previous = -1
+        while True:
+            next_box = -1
+            for edge in self.undrawn_edges(box):
+                other = self.other_box(edge, box)
+                if other >= 0 and other != previous and self.active[other] and other != path[0]:
+                    next_box = other
+                    break
+            if next_box < 0:
+                return path
+            previous, box = box, next_box
+            path.append(box)
+
+    def shared_edge(self, box1, box2):
+        for edge in self.geometry.box_edges(box1):
+            if self.other_box(edge, box1) == box2:
+                return edge
+        return None
+
+    #whether a chain of 3 or more or a loop is left outside the component
+    def long_components_left(self, root):
+        for other in self.members:
+            if other != root and self.size[other] >= 3 and self.capturable[other] == 0:
+                return True
+        return False
+
+#with shared_cache the positions solved by a search of another strategy are
+#played from the cache
+class ChainStrategy(object):
+
+    def __init__(self, shared_cache = True):
+        self.shared_cache = shared_cache
+        self.engine = None
+        self.analyzer = None
+
+    def analyzer_get(self, engine):
+        if self.engine is not engine:
+            self.engine = engine
+            self.analyzer = ChainAnalyzer(engine)
+        return self.analyzer
+
+    #take the box unless all but two of the chain have been taken and a
+    #long chain is left, then leave the last two (four for a loop) to the
+    #opponent so that they have to open the next long chain for us
+    def capture(self, engine, analyzer, edge):
+        if engine.buckets[engine.SAFE]:
+            return edge
+        for box in engine.geometry.edge_boxes(edge):
+            if box >= 0 and engine.box_sides[box] == 3:
+                break
+        root = analyzer.find(box)
+        if not analyzer.long_components_left(root):
+            return edge
+        size, capturable = analyzer.size[root], analyzer.capturable[root]
+        if size == 2 and capturable == 1:
+            path = analyzer.walk(box)
+            link = analyzer.shared_edge(path[0], path[1])
+            for far_edge in analyzer.undrawn_edges(path[1]):
+                if far_edge != link:
+                    return far_edge
+        elif size == 4 and capturable == 2:
+            path = analyzer.walk(box)
+            middle = analyzer.shared_edge(path[1], path[2])
+            if middle is not None:
+                return middle
+        return edge
+
+    #with only bad moves left, give away the cheapest component:
+    #single boxes, then pairs, then loops and then the longer chains
+    def sacrifice(self, engine, analyzer):
+        def cost(component):
+            root, kind, length = component
+            if kind == analyzer.CHAIN and length <= 2:
+                return (0, length)
+            if kind == analyzer.LOOP:
+                return (1, length)
+            return (2, length)
+        components = sorted(analyzer.components(), key = cost)
+        if not components:
+            return None
+        root, kind, length = components[0]
+        boxes = analyzer.members[root]
+        if kind == analyzer.CHAIN and length == 2:
+            #the hard hearted handout, draw the middle so the pair cannot be declined
+            box1, box2 = list(boxes)
+            return analyzer.shared_edge(box1, box2)
+        if kind == analyzer.CHAIN:
+            #open the chain from an end
+            for box in boxes:
+                for edge in analyzer.undrawn_edges(box):
+                    other = analyzer.other_box(edge, box)
+                    if other < 0 or not analyzer.active[other]:
+                        return edge
+        return analyzer.undrawn_edges(next(iter(boxes)))[0]
+
+    #the edge of a position solved by a search of another strategy. the
+    #position is only copied out of the engine once a search has solved one
+    #of the size
+    def solved_edge(self, engine):
+        if not self.shared_cache or not evaluation_cache_find(engine.geometry):
+            return None
+        return solved_move(engine.position())
+
+    def make_move(self, engine, last_move = None):
+        analyzer = self.analyzer_get(engine)
+        edge = self.solved_edge(engine)
+        if edge is None:
+            edge = self.choose_edge(engine, analyzer)
+        if edge is None:
+            return None
+        return engine.geometry.edge_coords(edge)
+
+    def choose_edge(self, engine, analyzer):
+        capture = engine.buckets[engine.CAPTURE]
+        if capture:
+            return self.capture(engine, analyzer, capture.pick())
+        if engine.buckets[engine.SAFE]:
+            return engine.buckets[engine.SAFE].pick()
+        if engine.buckets[engine.GIVEAWAY]:
+            edge = self.sacrifice(engine, analyzer)
+            if edge is None:
+                edge = engine.buckets[engine.GIVEAWAY].pick()
+            return edge
+        return None
+
+if __name__ == '__main__':
+    rows, cols = 3, 3
+    if len(sys.argv) == 3:
+        rows, cols = int(sys.argv[1]), int(sys.argv[2])
+    engine = GameEngine(rows+1, cols+1)
+    scores = engine.self_play([ ChainStrategy(), ChainStrategy() ])
+    print('Player 1 took %d grids. Player 2 took %d grids' %(scores[0], scores[1]))
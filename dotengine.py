@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+#headless rules engine for the dots and boxes game.
+#nothing in here should ever import pygame so games can be simulated on servers.
+import sys
+import logging
+from array import array
+from dotgraph import *
+import dotstats
+
+log = logging.getLogger(__name__)
+
+#set of edge indices with O(1) add, remove, membership and pick.
+#buckets no edge is in twice can share the position array
+class EdgeBucket(object):
+
+    def __init__(self, num_edges, position = None):
+        self.members = array('i')
+        self.position = array('i', [-1]) * num_edges if position is None else position
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, edge):
+        index = self.position[edge]
+        return 0 <= index < len(self.members) and self.members[index] == edge
+
+    def add(self, edge):
+        self.position[edge] = len(self.members)
+        self.members.append(edge)
+
+    def remove(self, edge):
+        index = self.position[edge]
+        last = self.members.pop()
+        if last != edge:
+            self.members[index] = last
+            self.position[last] = index
+        self.position[edge] = -1
+
+    def pick(self):
+        return self.members[0]
+
+#the moves of a game as [edge, boxes completed, player] lists, kept in
+#arrays of a few bytes per move
+class MoveHistory(object):
+
+    def __init__(self):
+        self.edges = array('i')
+        self.taken = bytearray()
+        self.players = array('b')
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __getitem__(self, index):
+        return [ self.edges[index], self.taken[index], self.players[index] ]
+
+    def __iter__(self):
+        for index in xrange(len(self.edges)):
+            yield self[index]
+
+    def append(self, move):
+        edge, taken, player = move
+        self.edges.append(edge)
+        self.taken.append(taken)
+        self.players.append(player)
+
+    def pop(self):
+        move = self[-1]
+        self.edges.pop()
+        self.taken.pop()
+        self.players.pop()
+        return move
+
+    def clear(self):
+        del self.edges[:]
+        del self.taken[:]
+        del self.players[:]
+
+    #a box completed by the last move for the player
+    def credit(self, player):
+        self.taken[-1] += 1
+        self.players[-1] = player
+
+#lightweight copy of a board for the search based AI players.
+#drawn keeps one byte per edge which is cheaper to test than the packed bits
+class Position(object):
+
+    def __init__(self, geometry):
+        self.geometry = geometry
+        self.drawn = bytearray(geometry.num_edges)
+        self.box_sides = bytearray(geometry.num_boxes)
+        self.edges_left = geometry.num_edges
+        self.boxes_left = geometry.num_boxes
+
+    def copy(self):
+        position = Position.__new__(Position)
+        position.geometry = self.geometry
+        position.drawn = bytearray(self.drawn)
+        position.box_sides = bytearray(self.box_sides)
+        position.edges_left = self.edges_left
+        position.boxes_left = self.boxes_left
+        return position
+
+    def moves(self):
+        return [ edge for edge in xrange(self.geometry.num_edges) if not self.drawn[edge] ]
+
+    #number of boxes drawing the edge would complete
+    def captures(self, edge):
+        count = 0
+        edge_box = self.geometry.edge_box
+        for slot in xrange(edge*2, edge*2 + 2):
+            box = edge_box[slot]
+            if box >= 0 and self.box_sides[box] == 3:
+                count += 1
+        return count
+
+    #whether drawing the edge leaves a box with 3 sides for the opponent
+    def gives_away(self, edge):
+        edge_box = self.geometry.edge_box
+        for slot in xrange(edge*2, edge*2 + 2):
+            box = edge_box[slot]
+            if box >= 0 and self.box_sides[box] == 2:
+                return True
+        return False
+
+    #a capture is forced when the missing side of the box does not lead into
+    #a box with 2 sides, there is no double dealing to consider then and
+    #taking the box is never worse than any other move
+    def forced_capture(self, edge):
+        edge_box = self.geometry.edge_box
+        for slot in xrange(edge*2, edge*2 + 2):
+            box = edge_box[slot]
+            if box >= 0 and self.box_sides[box] == 2:
+                return False
+        return True
+
+    #draw the edge and return the number of boxes it completed
+    def play(self, edge):
+        self.drawn[edge] = 1
+        self.edges_left -= 1
+        completed = 0
+        edge_box = self.geometry.edge_box
+        for slot in xrange(edge*2, edge*2 + 2):
+            box = edge_box[slot]
+            if box >= 0:
+                sides = self.box_sides[box] + 1
+                self.box_sides[box] = sides
+                if sides == 4:
+                    completed += 1
+        self.boxes_left -= completed
+        return completed
+
+    def undo(self, edge):
+        self.drawn[edge] = 0
+        self.edges_left += 1
+        edge_box = self.geometry.edge_box
+        for slot in xrange(edge*2, edge*2 + 2):
+            box = edge_box[slot]
+            if box >= 0:
+                if self.box_sides[box] == 4:
+                    self.boxes_left += 1
+                self.box_sides[box] -= 1
+
+class GameEngine(object):
+
+    #player indices used for scores and turns
+    PLAYER1 = 0
+    PLAYER2 = 1
+
+    #buckets of undrawn edges by what drawing them does
+    CAPTURE = 0
+    SAFE = 1
+    GIVEAWAY = 2
+    DRAWN = 255
+
+    #rows and cols are the number of dots (vertices) in each direction.
+    #the board is kept as a bitmask of the drawn edges indexed by the
+    #BoardGeometry edge numbering and a count of the drawn sides of each box
+    def __init__(self, rows = 3, cols = 3):
+        self.rows = rows
+        self.cols = cols
+        self.scores = [0, 0]
+        self.grids_taken = 0
+        self.grids_total = (rows-1) * (cols-1)
+        self.geometry = geometry_get(rows, cols)
+        self.drawn = bytearray((self.geometry.num_edges + 7) >> 3)
+        self.box_sides = bytearray(self.geometry.num_boxes)
+        self.edges_left = self.geometry.num_edges
+        #incremental index of the undrawn edges so the AI never scans the board.
+        #every edge starts out safe, the buckets are filled in bulk
+        num_edges = self.geometry.num_edges
+        position = array('i', xrange(num_edges))
+        self.buckets = [ EdgeBucket(num_edges, position) for i in xrange(3) ]
+        self.buckets[self.SAFE].members = array('i', position)
+        self.bucket_of = bytearray([self.SAFE]) * num_edges
+        #objects with edge_drawn(edge) called after each edge is drawn and
+        #edge_undrawn(edge) after it is taken back
+        self.listeners = []
+        #the moves as [edge, boxes completed, player] for undo, -1 for the
+        #player of a move that completed nothing when it was not given, and
+        #the moves taken back for redo
+        self.history = MoveHistory()
+        self.undone = MoveHistory()
+
+    def is_drawn(self, edge):
+        return (self.drawn[edge >> 3] >> (edge & 7)) & 1 == 1
+
+    def position(self):
+        position = Position(self.geometry)
+        for edge in xrange(self.geometry.num_edges):
+            if self.is_drawn(edge):
+                position.drawn[edge] = 1
+        position.box_sides[:] = self.box_sides
+        position.edges_left = self.edges_left
+        position.boxes_left = self.grids_total - self.grids_taken
+        return position
+
+    def classify_edge(self, edge):
+        bucket = self.SAFE
+        edge_box = self.geometry.edge_box
+        for slot in xrange(edge*2, edge*2 + 2):
+            box = edge_box[slot]
+            if box >= 0:
+                sides = self.box_sides[box]
+                if sides == 3:
+                    return self.CAPTURE
+                if sides == 2:
+                    bucket = self.GIVEAWAY
+        return bucket
+
+    def update_bucket(self, edge):
+        bucket = self.classify_edge(edge)
+        current = self.bucket_of[edge]
+        if bucket != current:
+            self.buckets[current].remove(edge)
+            self.buckets[bucket].add(edge)
+            self.bucket_of[edge] = bucket
+
+    def draw_edge(self, edge, player = -1):
+        self.history.append([edge, 0, player])
+        self.drawn[edge >> 3] |= 1 << (edge & 7)
+        self.edges_left -= 1
+        self.buckets[self.bucket_of[edge]].remove(edge)
+        self.bucket_of[edge] = self.DRAWN
+        edge_box, box_edge = self.geometry.edge_box, self.geometry.box_edge
+        for slot in xrange(edge*2, edge*2 + 2):
+            box = edge_box[slot]
+            if box >= 0:
+                self.box_sides[box] += 1
+                for side in xrange(box*4, box*4 + 4):
+                    if self.bucket_of[box_edge[side]] != self.DRAWN:
+                        self.update_bucket(box_edge[side])
+        for listener in self.listeners:
+            listener.edge_drawn(edge)
+
+    #draw_edge backwards, the buckets of the sides of its 2 boxes are
+    #updated so it takes constant time
+    def undraw_edge(self, edge):
+        self.drawn[edge >> 3] &= ~(1 << (edge & 7))
+        self.edges_left += 1
+        bucket = self.classify_edge(edge)
+        self.buckets[bucket].add(edge)
+        self.bucket_of[edge] = bucket
+        edge_box, box_edge = self.geometry.edge_box, self.geometry.box_edge
+        for slot in xrange(edge*2, edge*2 + 2):
+            box = edge_box[slot]
+            if box >= 0:
+                self.box_sides[box] -= 1
+                for side in xrange(box*4, box*4 + 4):
+                    if self.bucket_of[box_edge[side]] != self.DRAWN:
+                        self.update_bucket(box_edge[side])
+        for listener in self.listeners:
+            listener.edge_undrawn(edge)
+
+    #the player is kept in the history for undo
+    def mark_grid(self, r1, c1, r2, c2, player = -1):
+        return self.mark_edge(self.geometry.edge_index(r1, c1, r2, c2), player)
+
+    #mark_grid for the edge index
+    def mark_edge(self, edge, player = -1):
+        if self.is_drawn(edge):
+            return False
+        #a new move ends the redo
+        self.undone.clear()
+        self.draw_edge(edge, player)
+        return True
+
+    #take back the last move and the boxes it completed.
+    #returns its [edge, boxes completed, player] or None with no moves
+    def undo(self):
+        if not self.history:
+            return None
+        move = self.history.pop()
+        edge, taken, player = move
+        if taken:
+            self.scores[player] -= taken
+            self.grids_taken -= taken
+        self.undraw_edge(edge)
+        self.undone.append(move)
+        return move
+
+    #make the last move taken back again, returns it or None
+    def redo(self):
+        if not self.undone:
+            return None
+        edge, taken, player = self.undone.pop()
+        self.draw_edge(edge, player)
+        for i in xrange(taken):
+            self.take_grid(player)
+        return self.history[-1]
+
+    #given an edge, find an undrawn edge that closes one of the boxes next to it
+    def find_unmarked_neighbor_edges(self, edge):
+        for box in self.geometry.edge_boxes(edge):
+            if box >= 0 and self.box_sides[box] == 3:
+                for box_edge in self.geometry.box_edges(box):
+                    if not self.is_drawn(box_edge):
+                        return box_edge
+        return None
+
+    #find unconnected edges that can be closed
+    def find_edges_that_can_be_closed(self):
+        bucket = self.buckets[self.CAPTURE]
+        if bucket:
+            return bucket.pick()
+        return None
+
+    #the capture, safe and fallback phases are timed with dotstats on
+    def make_move(self, last_move = None):
+        stats = dotstats.enabled
+        if stats:
+            start = dotstats.clock()
+        #see if anything can be closed
+        edge = None
+        if last_move is not None:
+            edge = self.find_unmarked_neighbor_edges(self.geometry.edge_index(*last_move))
+        if edge is None:
+            #find an edge that can be closed to make a grid
+            edge = self.find_edges_that_can_be_closed()
+        if stats:
+            dotstats.record('make_move.capture', start)
+        if edge is None:
+            #we try to skip edges with 2 marked edges opening up a grid
+            if stats:
+                phase = dotstats.clock()
+            if self.buckets[self.SAFE]:
+                edge = self.buckets[self.SAFE].pick()
+                if stats:
+                    dotstats.record('make_move.safe', phase)
+            elif self.buckets[self.GIVEAWAY]:
+                edge = self.buckets[self.GIVEAWAY].pick()
+                if stats:
+                    dotstats.record('make_move.fallback', phase)
+        if stats:
+            dotstats.record('make_move', start)
+        if edge is not None:
+            grid = self.geometry.edge_coords(edge)
+            log.debug('Returned edge: %d:%d<->%d:%d', *grid)
+            return grid
+        return None
+
+    #returns the grids closed by the edge, each as the list of its 4 edges
+    def mark_move(self, r1, c1, r2, c2, player = -1):
+        return self.mark_edge_move(self.geometry.edge_index(r1, c1, r2, c2), player)
+
+    #mark_move for the edge index
+    def mark_edge_move(self, edge, player = -1):
+        if dotstats.enabled:
+            start = dotstats.clock()
+        if not self.is_drawn(edge):
+            self.mark_edge(edge, player)
+        grids = []
+        for box in self.geometry.edge_boxes(edge):
+            if box >= 0 and self.box_sides[box] == 4:
+                grids.append([ self.geometry.edge_coords(e) for e in self.geometry.box_edges(box) ])
+        if dotstats.enabled:
+            dotstats.record('mark_move', start)
+        return grids
+
+    #credits a box completed by the last move to the player
+    def take_grid(self, player):
+        self.scores[player] += 1
+        self.grids_taken += 1
+        if self.history:
+            self.history.credit(player)
+
+    def game_finished(self):
+        return self.grids_taken == self.grids_total
+
+    def winner_decided(self):
+        majority = self.grids_total/2 + 1
+        return self.scores[self.PLAYER1] >= majority or self.scores[self.PLAYER2] >= majority
+
+    #draw the edge for the player and credit the grids it closes.
+    #returns the list of grids taken or None if the edge was already marked
+    def play_move(self, player, grid):
+        if self.mark_grid(*grid, player = player) == False:
+            return None
+        marked_grids = self.mark_move(*grid)
+        for marked_grid in marked_grids:
+            self.take_grid(player)
+        return marked_grids
+
+    #play a complete game headless between the two strategies,
+    #make_move for both by default. returns the final scores
+    def self_play(self, strategies = None):
+        if strategies is None:
+            strategies = [ GreedyStrategy(), GreedyStrategy() ]
+        player = self.PLAYER1
+        grid = None
+        while self.game_finished() == False:
+            grid = strategies[player].make_move(self, last_move = grid)
+            if grid is None:
+                break
+            if not self.play_move(player, grid):
+                #no grids taken, so its the other players turn
+                player ^= 1
+        return self.scores
+
+#the AI strategies all provide make_move(engine, last_move) returning the
+#edge to draw as (r1, c1, r2, c2) or None when there are no moves left
+class GreedyStrategy(object):
+
+    def make_move(self, engine, last_move = None):
+        return engine.make_move(last_move = last_move)
+
+if __name__ == '__main__':
+    rows, cols = 3, 3
+    if len(sys.argv) == 3:
+        rows, cols = int(sys.argv[1]), int(sys.argv[2])
+    engine = GameEngine(rows+1, cols+1)
+    scores = engine.self_play()
+    print('Player 1 took %d grids. Player 2 took %d grids' %(scores[0], scores[1]))
@@ -2,216 +2,504 @@
 import pygame
 from pygame.locals import *
 from dotgraph import *
+from dotengine import GameEngine
+from dotai import strategy_get
+from dottablebase import TablebaseStrategy
+from dotworker import AIWorker
+from dotrecord import RecordWriter, GameRecorder
+import dotstats
 import sys
 import time
 import random
 import json
 import os
+import logging
+
+log = logging.getLogger(__name__)
 
 class GameGraphics(object):
     RED = (255, 0, 0)
     BLUE = (0, 0, 255)
     WHITE = (255, 255, 255)
     BLACK = (0, 0, 0)
+    #height of the status bar under the board
+    STATUS_HEIGHT = 40
+    #cells smaller than this are drawn without the box lattice
+    LOW_DETAIL_SIZE = 12
+    ZOOM_STEP = 1.25
+    MIN_ZOOM = 0.1
+    MAX_ZOOM = 4.0
+    #a move from the AI worker is ready
+    AI_EVENT = USEREVENT
+    #animates the thinking indicator
+    TICK_EVENT = USEREVENT + 1
 
     def __init__(self, width = 1024, height = 768, col_width = 50, row_width = 50, spacing = 6):
         pygame.init()
         pygame.font.init()
         self.screen = pygame.display.set_mode( (width, height) )
         self.clock = pygame.time.Clock()
-        self.boxes = []
+        self.boxes = {}
         self.grids = []
         self.grids_taken_list = []
+        #colors of the drawn edges and taken boxes to draw just the visible ones
+        self.grid_colors = {}
+        self.taken_colors = {}
+        self.base_col_width = col_width
+        self.base_row_width = row_width
+        self.base_spacing = spacing
         self.col_width = col_width
         self.row_width = row_width
         self.spacing = spacing
         self.text_font = pygame.font.SysFont(pygame.font.get_default_font(), 30)
-
-    def find_grid(self, c, r):
+        #the part of the board on the screen. view_x, view_y is the board
+        #pixel at the top left of the viewport at the current zoom
+        self.viewport = pygame.Rect(0, 0, width, height - self.STATUS_HEIGHT)
+        self.zoom = 1.0
+        self.view_x = 0
+        self.view_y = 0
+        self.overview = False
+        self.saved_view = None
+        #the white background and box lattice of the view are drawn to this
+        #surface and the edges and taken grids are drawn over the screen as they come
+        self.board = None
+        self.redraw = True
+        self.grids_drawn = 0
+        self.taken_drawn = 0
+        self.status = None
+        self.status_rect = None
+        self.worker = None
+        #counts up while the AI is thinking
+        self.thinking = 0
+        self.ai_side = None
+
+    def set_zoom(self, zoom):
+        self.zoom = zoom
+        self.col_width = max(1, int(round(self.base_col_width * zoom)))
+        self.row_width = max(1, int(round(self.base_row_width * zoom)))
+        self.spacing = max(1, int(round(self.base_spacing * zoom)))
+        self.redraw = True
+
+    def scroll_to(self, x, y):
+        max_x = max(0, (self.cols + 1) * self.col_width - self.viewport.width)
+        max_y = max(0, (self.rows + 1) * self.row_width - self.viewport.height)
+        self.view_x = min(max(0, int(x)), max_x)
+        self.view_y = min(max(0, int(y)), max_y)
+        self.redraw = True
+
+    def scroll_by(self, dx, dy):
+        self.scroll_to(self.view_x + dx, self.view_y + dy)
+
+    #the board point under the screen point, in cells
+    def board_point(self, x, y):
+        return ( float(x + self.view_x) / self.col_width, float(y + self.view_y) / self.row_width )
+
+    #zoom keeping the board point under the screen point x, y in place
+    def zoom_at(self, zoom, x, y):
+        zoom = max(self.MIN_ZOOM, min(self.MAX_ZOOM, zoom))
+        board_c, board_r = self.board_point(x, y)
+        self.set_zoom(zoom)
+        self.scroll_to(board_c * self.col_width - x, board_r * self.row_width - y)
+
+    #the overview fits the whole board to the screen in low detail
+    def toggle_overview(self):
+        if self.overview:
+            self.overview = False
+            zoom, x, y = self.saved_view
+            self.set_zoom(zoom)
+            self.scroll_to(x, y)
+            return
+        self.saved_view = (self.zoom, self.view_x, self.view_y)
+        self.overview = True
+        fit = min(float(self.viewport.width) / ((self.cols + 1) * self.base_col_width),
+                  float(self.viewport.height) / ((self.rows + 1) * self.base_row_width))
+        self.set_zoom(min(fit, 1.0))
+        self.scroll_to(0, 0)
+
+    #leave the overview with the clicked point in the middle of the screen
+    def leave_overview(self, x, y):
+        board_c, board_r = self.board_point(x, y)
+        self.overview = False
+        self.set_zoom(self.saved_view[0])
+        self.scroll_to(board_c * self.col_width - self.viewport.centerx,
+                       board_r * self.row_width - self.viewport.centery)
+
+    #scrolling, zooming and the overview. returns True for the events used here
+    def view_event(self, event):
+        if event.type == KEYDOWN:
+            if event.key == K_o:
+                self.toggle_overview()
+                return True
+            if self.overview:
+                return False
+            step_x, step_y = self.viewport.width // 4, self.viewport.height // 4
+            if event.key in (K_LEFT, K_a):
+                self.scroll_by(-step_x, 0)
+            elif event.key in (K_RIGHT, K_d):
+                self.scroll_by(step_x, 0)
+            elif event.key in (K_UP, K_w):
+                self.scroll_by(0, -step_y)
+            elif event.key in (K_DOWN, K_s):
+                self.scroll_by(0, step_y)
+            elif event.key in (K_PLUS, K_EQUALS, K_KP_PLUS):
+                self.zoom_at(self.zoom * self.ZOOM_STEP, *self.viewport.center)
+            elif event.key in (K_MINUS, K_KP_MINUS):
+                self.zoom_at(self.zoom / self.ZOOM_STEP, *self.viewport.center)
+            elif event.key == K_HOME:
+                self.set_zoom(1.0)
+                self.scroll_to(0, 0)
+            else:
+                return False
+            return True
+        if event.type == MOUSEBUTTONDOWN and event.button in (4, 5):
+            #the mouse wheel zooms around the pointer
+            if not self.overview:
+                step = self.ZOOM_STEP if event.button == 4 else 1 / self.ZOOM_STEP
+                self.zoom_at(self.zoom * step, *event.pos)
+            return True
+        if event.type == MOUSEMOTION and (event.buttons[1] or event.buttons[2]):
+            #dragging with the middle or right button scrolls
+            if not self.overview:
+                self.scroll_by(-event.rel[0], -event.rel[1])
+            return True
+        return False
+
+    def low_detail(self):
+        return self.overview or min(self.col_width, self.row_width) < self.LOW_DETAIL_SIZE
+
+    #the screen position of the dot r, c
+    def to_screen(self, r, c):
+        return ( (c+1)*self.col_width - self.view_x + self.viewport.left,
+                 (r+1)*self.row_width - self.view_y + self.viewport.top )
+
+    #the first and last rows and columns of the dots in the viewport
+    def visible_dots(self):
+        width, height = self.viewport.size
+        r0 = max(0, self.view_y // self.row_width - 2)
+        r1 = min(self.rows - 1, (self.view_y + height) // self.row_width)
+        c0 = max(0, self.view_x // self.col_width - 2)
+        c1 = min(self.cols - 1, (self.view_x + width) // self.col_width)
+        return r0, r1, c0, c1
+
+    @property
+    def geometry(self):
+        return geometry_get(self.rows, self.cols)
+
+    #the edge at the screen point as the engine edge index or None.
+    #the cell comes from dividing the board point by the cell size and the
+    #side from the offset inside the cell, within spacing of a side hits it
+    def find_edge(self, c, r):
+        if not self.viewport.collidepoint(c, r):
+            return None
+        #board coordinates of the click
+        x = c + self.view_x - self.viewport.left
+        y = r + self.view_y - self.viewport.top
         rows, cols = self.rows, self.cols
-        max_width = cols * self.col_width
-        max_height = rows * self.row_width
-        if r > max_height or r < self.row_width:
+        col_width, row_width, spacing = self.col_width, self.row_width, self.spacing
+        if y > rows * row_width or y < row_width:
             return None
-        if c > max_width or c < self.col_width:
+        if x > cols * col_width or x < col_width:
             return None
-        row_index = r/self.row_width - 1
-        col_index = c/self.col_width - 1
-        match_index = None
-        #print('Row index %d, column index %d' %(row_index, col_index))
-        grid_map = [ (row_index, col_index, row_index+1, col_index),
-                     (row_index, col_index, row_index, col_index+1),
-                     (row_index, col_index+1, row_index+1, col_index+1),
-                     (row_index+1, col_index,  row_index+1, col_index+1),
-        ]
-        spacing_map = []
-        spacing = self.spacing
-        for grid in grid_map:
-            r1, c1, r2, c2 = grid
-            spacing_c1, spacing_r1, spacing_c2, spacing_r2 = (c1+1)*self.col_width - spacing, (r1+1)*self.row_width - spacing,\
-                                                             (c2+1)*self.col_width + spacing, (r2+1)*self.row_width + spacing
-            spacing_map.append( (spacing_c1, spacing_r1, spacing_c2, spacing_r2) )
-
-        #print('Spacing map: %s' %spacing_map)
-        #print('Grid map: %s' %grid_map)
-        for i in xrange(len(grid_map)):
-            c1, r1, c2, r2 = spacing_map[i]
-            if c1 <= c and c2 >= c and r1 <= r and r2 >= r:
-                match_index = i
-                break
-
-        if match_index is not None:
-            #print('Matched index: %d %d' %(row_index, col_index))
-            #print('Matched grid: %s' %(str (grid_map[match_index]) ) )
-            #print('Matched spacing: %s' %(str (spacing_map[match_index]) ) )
-            return grid_map[match_index]
+        row_index = y // row_width - 1
+        col_index = x // col_width - 1
+        offset_x = x - (col_index + 1) * col_width
+        offset_y = y - (row_index + 1) * row_width
+        num_h = self.geometry.num_h
+        #the cells on the last row and column of dots only have a left or top side
+        if offset_x <= spacing and row_index < rows - 1:
+            return num_h + row_index * cols + col_index
+        if offset_y <= spacing and col_index < cols - 1:
+            return row_index * (cols - 1) + col_index
+        if offset_x >= col_width - spacing and row_index < rows - 1 and col_index < cols - 1:
+            return num_h + row_index * cols + col_index + 1
+        if offset_y >= row_width - spacing and row_index < rows - 1 and col_index < cols - 1:
+            return (row_index + 1) * (cols - 1) + col_index
 
         #if nothing matched, ask for input again
-        print('No matches for pos: %d/%d' %(c, r))
+        log.debug('No matches for pos: %d/%d', c, r)
         return None
 
-    def take_grid(self, color, grid):
-        self.grids_taken += 1
-        self.grids_taken_list.append((color, grid))
+    def find_grid(self, c, r):
+        edge = self.find_edge(c, r)
+        if edge is None:
+            return None
+        return self.geometry.edge_coords(edge)
 
-    def draw_status(self):
+    def take_grid(self, color, grid):
+        box = self.taken_grid_box(grid)
+        self.grids_taken_list.append((color, box))
+        self.taken_colors[box] = color
+
+    #returns the dirty rects, the status is only drawn again when it changes
+    def draw_status(self, force = False):
+        status = (self.player.grids, self.grids_ai, self.thinking)
+        if status == self.status and not force:
+            return []
+        self.status = status
+        dirty = []
+        if force:
+            self.status_rect = None
+            bar = pygame.Rect(0, self.viewport.bottom, self.screen.get_width(), self.STATUS_HEIGHT)
+            self.screen.fill(self.WHITE, bar)
+        if self.status_rect is not None:
+            self.screen.fill(self.WHITE, self.status_rect)
+            dirty.append(self.status_rect)
         human = 'Human: %d' %self.player.grids
         ai = 'AI: %d' %self.grids_ai
+        if self.thinking:
+            ai += ' thinking' + '.' * (self.thinking % 4)
         text_human = self.text_font.render(human, True, self.player.color)
         text_ai = self.text_font.render(ai, True, GameGraphics.BLACK)
-        width, height = self.col_width, (self.rows + 1) * self.row_width
-        self.screen.blit(text_human, (width, height))
-        self.screen.blit(text_ai, (width + self.col_width*2, height))
-
+        width, height = self.base_col_width, self.viewport.bottom + 8
+        rect_human = self.screen.blit(text_human, (width, height))
+        rect_ai = self.screen.blit(text_ai, (width + self.base_col_width*2, height))
+        self.status_rect = rect_human.union(rect_ai)
+        dirty.append(self.status_rect)
+        return dirty
+
+    def draw_board(self):
+        if self.board is None or self.board.get_size() != self.viewport.size:
+            self.board = pygame.Surface(self.viewport.size)
+        self.board.fill(self.WHITE)
+        self.draw_boxes(self.board)
+
+    #the edges and taken grids in the viewport
+    def draw_visible(self):
+        r0, r1, c0, c1 = self.visible_dots()
+        grid_colors, taken_colors = self.grid_colors, self.taken_colors
+        for r in xrange(r0, r1 + 1):
+            for c in xrange(c0, c1 + 1):
+                for grid in ( (r, c, r, c+1), (r, c, r+1, c) ):
+                    color = grid_colors.get(grid)
+                    if color is not None:
+                        pygame.draw.rect(self.screen, color, self.grid_rect(grid))
+        for r in xrange(r0, r1 + 1):
+            for c in xrange(c0, c1 + 1):
+                color = taken_colors.get((r, c))
+                if color is not None:
+                    pygame.draw.rect(self.screen, color, self.box_rect(r, c))
+
+    #draw what changed since the last frame and update just those rects.
+    #moving the view draws the viewport again, the board size does not matter
     def draw(self):
-        self.screen.fill(self.WHITE)
-        self.draw_boxes()
-        self.draw_grids()
-        self.draw_taken_grids()
-        self.draw_status()
-        pygame.display.update()
-
-    def game_finished(self):
-        return self.grids_taken == self.grids_total
-
-    def winner_decided(self):
-        majority = self.grids_total/2 + 1
-        return self.grids_ai >= majority or self.player.grids >= majority
-        
-    def run_ai(self, player = False, last_move = None):
+        if dotstats.enabled:
+            start = dotstats.clock()
+        full = self.redraw
+        dirty = []
+        self.screen.set_clip(self.viewport)
+        if full:
+            self.draw_board()
+            self.screen.blit(self.board, self.viewport.topleft)
+            self.draw_visible()
+            self.redraw = False
+        else:
+            for color, grid in self.grids[self.grids_drawn:]:
+                dirty.append(pygame.draw.rect(self.screen, color, self.grid_rect(grid)))
+            for color, box in self.grids_taken_list[self.taken_drawn:]:
+                dirty.append(pygame.draw.rect(self.screen, color, self.box_rect(*box)))
+        self.grids_drawn = len(self.grids)
+        self.taken_drawn = len(self.grids_taken_list)
+        self.screen.set_clip(None)
+        dirty.extend(self.draw_status(force = full))
+        if full:
+            pygame.display.update()
+        elif dirty:
+            pygame.display.update(dirty)
+        if dotstats.enabled:
+            dotstats.record('draw.full' if full else 'draw', start)
+
+    def notify_ai(self):
+        #called on the worker thread, posting an event is safe from there
+        pygame.event.post(pygame.event.Event(self.AI_EVENT))
+
+    #the AI moves for its own side or, with player set, for the human once
+    #the winner is decided. the move is made on the worker thread and comes
+    #back as an AI_EVENT while the loop keeps drawing and handling events
+    def request_ai_move(self, player = False, last_move = None):
         if player is False:
-            color = GameGraphics.BLACK
+            self.ai_side = (GameGraphics.BLACK, self.AI)
         else:
-            color = self.player.color
-        while True:
-            self.draw()
-            if self.game_finished() == True:
-                break
-            grid = self.make_move(last_move = last_move)
-            if grid == None:
-                print('No more moves available.')
-                break
-            last_move = Edge(Vertex(grid[0], grid[1]), Vertex(grid[2], grid[3]))
-            self.add_grid(color, grid)
-            marked_grids = self.mark_move(*grid)
-            if marked_grids:
-                for marked_grid in marked_grids:
-                    self.take_grid(color, marked_grid)
-                    if player is False:
-                        self.grids_ai += 1
-                    else:
-                        self.player.mark_grid()
-            elif not self.winner_decided():
-                break
-        
+            self.ai_side = (self.player.color, self.HUMAN)
+        self.thinking = 1
+        pygame.time.set_timer(self.TICK_EVENT, 300)
+        self.worker.request_move(last_move = last_move)
+
+    def ai_moved(self):
+        grid = self.worker.poll()
+        if grid is False:
+            return
+        self.thinking = 0
+        pygame.time.set_timer(self.TICK_EVENT, 0)
+        if grid == None:
+            log.info('No more moves available.')
+            return
+        color, index = self.ai_side
+        edge = self.geometry.edge_index(*grid)
+        self.add_grid(color, grid)
+        self.mark_edge(edge, index)
+        self.worker.play(index, edge)
+        marked_grids = self.mark_edge_move(edge)
+        if marked_grids:
+            for marked_grid in marked_grids:
+                self.take_grid(color, marked_grid, index)
+        elif not self.winner_decided():
+            #the humans turn, think about the reply meanwhile
+            self.worker.ponder()
+            return
+        else:
+            #with the winner decided the AI plays the rest out for both
+            #sides, taking turns by the rules so the scores and records agree
+            index ^= 1
+        if self.game_finished() == False:
+            self.request_ai_move(player = index == self.HUMAN, last_move = grid)
+
     def run(self):
+        self.worker = AIWorker(self.ai, self.rows, self.cols, notify = self.notify_ai)
+        self.worker.ponder()
+        recorder = self.start_record()
         while self.game_finished() == False:
-            grid = None
-            for event in pygame.event.get():
-                if event.type == QUIT:
-                    pygame.quit()
-                    return
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    pos = pygame.mouse.get_pos()
-                    grid = self.find_grid(*pos)
-                    break
-            if grid == None:
-                self.draw()
+            self.draw()
+            #sleep until something happens instead of drawing idle frames
+            event = pygame.event.wait()
+            if event.type == QUIT:
+                self.worker.stop()
+                if recorder is not None:
+                    #the game is not complete so it is not kept
+                    recorder.writer.close()
+                pygame.quit()
+                return
+            if event.type == self.AI_EVENT:
+                self.ai_moved()
+                continue
+            if event.type == self.TICK_EVENT:
+                if self.thinking:
+                    self.thinking += 1
+                continue
+            if event.type == VIDEOEXPOSE:
+                self.redraw = True
                 continue
-            status = self.mark_grid(*grid)
+            if self.view_event(event):
+                continue
+            if event.type == KEYDOWN and event.key == K_u:
+                self.takeback()
+                continue
+            if event.type == KEYDOWN and event.key == K_r:
+                self.replay_turn()
+                continue
+            if self.thinking:
+                #space makes the AI play the best move it has found so far
+                if event.type == KEYDOWN and event.key == K_SPACE:
+                    self.worker.hurry()
+                continue
+            if event.type != pygame.MOUSEBUTTONDOWN or event.button != 1:
+                continue
+            if self.overview:
+                self.leave_overview(*event.pos)
+                continue
+            edge = self.find_edge(*event.pos)
+            if edge == None:
+                continue
+            grid = self.geometry.edge_coords(edge)
+            status = self.mark_edge(edge, self.HUMAN)
             #if grid was already marked, continue
             if status == False:
-                self.draw()
-                print('Grid %s already marked' %str(grid))
+                log.debug('Grid %s already marked', grid)
                 continue
             self.add_grid(self.player.color, grid)
-            marked_grids = self.mark_move(*grid)
+            self.worker.play(self.HUMAN, edge)
+            marked_grids = self.mark_edge_move(edge)
             if marked_grids:
                 for marked_grid in marked_grids:
-                    self.take_grid(self.player.color, marked_grid)
-                    self.player.mark_grid()
-                self.draw()
+                    self.take_grid(self.player.color, marked_grid, self.HUMAN)
                 if self.winner_decided():
-                    self.run_ai(player = True)
-                    break
+                    self.request_ai_move(player = True)
+                else:
+                    self.worker.ponder()
                 continue
             
-            last_move = Edge(Vertex(grid[0], grid[1]), Vertex(grid[2], grid[3]))
             #now make the move for the AI
-            self.run_ai(last_move = last_move)
-            self.draw()
+            self.request_ai_move(last_move = grid)
 
+        self.draw()
+        self.worker.stop()
+        if recorder is not None:
+            recorder.finish()
+            recorder.writer.close()
         print('Player %s took %d grids. AI took %d grids' %(self.player, self.player.grids, self.grids_ai))
         print('Finishing game')
         time.sleep(3)
 
-    def draw_box(self, color, r1, c1, r2, c2, thickness = 3):
-        top_left =  ( (c1+1)*self.col_width, (r1+1) * self.row_width )
-        pygame.draw.rect(self.screen, color, [ top_left[0], top_left[1], self.col_width, self.row_width ], 3)
-        top_left = ( (c1+1)*self.col_width + self.spacing, (r1+1) * self.row_width + self.spacing)
+    #draws to the surface of the viewport
+    def draw_box(self, surface, color, r1, c1, r2, c2, thickness = 3):
+        x, y = self.to_screen(r1, c1)
+        top_left =  ( x - self.viewport.left, y - self.viewport.top )
+        pygame.draw.rect(surface, color, [ top_left[0], top_left[1], self.col_width, self.row_width ], 3)
+        top_left = ( top_left[0] + self.spacing, top_left[1] + self.spacing )
         width = self.col_width - self.spacing*2
         height = self.row_width - self.spacing*2
-        pygame.draw.rect(self.screen, color, [ top_left[0], top_left[1], width, height ], thickness)
-
-    def draw_boxes(self):
-        for box in self.boxes:
-            color, grid, thickness = box
-            self.draw_box(color, *grid, thickness = thickness)
+        pygame.draw.rect(surface, color, [ top_left[0], top_left[1], width, height ], thickness)
+
+    def draw_boxes(self, surface):
+        if self.low_detail():
+            #just the outline of the board
+            x, y = self.to_screen(0, 0)
+            x, y = x - self.viewport.left, y - self.viewport.top
+            pygame.draw.rect(surface, GameGraphics.BLACK,
+                             [ x, y, (self.cols-1)*self.col_width + 1, (self.rows-1)*self.row_width + 1 ], 1)
+            return
+        r0, r1, c0, c1 = self.visible_dots()
+        for r in xrange(r0, r1):
+            for c in xrange(c0, c1):
+                box = self.boxes.get((r, c))
+                if box is not None:
+                    color, grid, thickness = box
+                    self.draw_box(surface, color, *grid, thickness = thickness)
 
     def add_box(self, color, r1, c1, r2, c2, thickness = 3):
         grid = (r1, c1, r2, c2)
-        self.boxes.append((color, grid, thickness))
+        self.boxes[(r1, c1)] = (color, grid, thickness)
 
-    def draw_grids(self):
+    #the rect of the drawn edge on the screen
+    def grid_rect(self, grid):
         rows = self.rows
         cols = self.cols
-        for color, grid in self.grids:
-            r1, c1, r2, c2 = grid
-            #swap r1,c1 if the second vertex is lesser
-            if (r2, c2) < (r1, c1):
-                r1, c1, r2, c2 = r2, c2, r1, c1
-            width = self.col_width
-            height = self.row_width
-            spacing_c1, spacing_r1 = (c1+1)*width, (r1+1)*height
+        r1, c1, r2, c2 = grid
+        #swap r1,c1 if the second vertex is lesser
+        if (r2, c2) < (r1, c1):
+            r1, c1, r2, c2 = r2, c2, r1, c1
+        width = self.col_width
+        height = self.row_width
+        spacing_c1, spacing_r1 = self.to_screen(r1, c1)
+        if self.low_detail():
+            #a one pixel line
             if r1 == r2:
-                if r1 == 0 or r1 >= rows - 1:
-                    height = self.spacing
-                    if r1 >= rows - 1:
-                        spacing_r1 -= self.spacing
-                else:
-                    height = self.spacing * 2
+                return [ spacing_c1, spacing_r1, width, 1 ]
+            return [ spacing_c1, spacing_r1, 1, height ]
+        if r1 == r2:
+            if r1 == 0 or r1 >= rows - 1:
+                height = self.spacing
+                if r1 >= rows - 1:
                     spacing_r1 -= self.spacing
-            if c1 == c2:
-                if c1 == 0 or c1 >= cols - 1:
-                    width = self.spacing
-                    if c1 >= cols - 1:
-                        spacing_c1 -= self.spacing
-                else:
-                    width = self.spacing * 2
+            else:
+                height = self.spacing * 2
+                spacing_r1 -= self.spacing
+        if c1 == c2:
+            if c1 == 0 or c1 >= cols - 1:
+                width = self.spacing
+                if c1 >= cols - 1:
                     spacing_c1 -= self.spacing
-            pygame.draw.rect(self.screen, color, [ spacing_c1, spacing_r1, width, height] )
+            else:
+                width = self.spacing * 2
+                spacing_c1 -= self.spacing
+        return [ spacing_c1, spacing_r1, width, height ]
+
+    #the rect filled in when the box is taken
+    def box_rect(self, r, c):
+        x, y = self.to_screen(r, c)
+        return [ x, y, self.col_width, self.row_width ]
 
-    def draw_taken_grid(self, color, grid_list):
+    #the box of the taken grid, worked out once when it is taken
+    def taken_grid_box(self, grid_list):
         #when the grid is taken, we mark the inside rectangle
         min_p = (65535, 65535)
         max_p = (0, 0)
@@ -223,41 +511,56 @@ class GameGraphics(object):
                 if p > max_p:
                     max_p = p
 
-        grid = min_p + max_p
-        r1, c1, r2, c2 = grid
-        #start_c1, start_r1 = (c1+1)*self.col_width + self.spacing, (r1+1)*self.row_width + self.spacing
-        start_c1, start_r1 = (c1+1)*self.col_width, (r1+1)*self.row_width
-        #width, height = self.col_width - self.spacing*2, self.row_width - self.spacing*2
-        width, height = self.col_width, self.row_width
-        pygame.draw.rect(self.screen, color, [ start_c1, start_r1, width, height ])
-
-    def draw_taken_grids(self):
-        for color, grid_list in self.grids_taken_list:
-            self.draw_taken_grid(color, grid_list)
+        return min_p
 
     def add_grid(self, color, grid):
         self.grids.append((color, grid))
+        r1, c1, r2, c2 = grid
+        if (r2, c2) < (r1, c1):
+            r1, c1, r2, c2 = r2, c2, r1, c1
+        self.grid_colors[(r1, c1, r2, c2)] = color
 
 class Game(GameGraphics):
     coin_flip = 0
-    def __init__(self, player, rows = 3, cols = 3, **kwargs):
+    #engine player indices
+    HUMAN = GameEngine.PLAYER1
+    AI = GameEngine.PLAYER2
+
+    #record is the path of a game archive the game is appended to and
+    #tablebase a list of tablebase files the AI plays from when it can
+    def __init__(self, player, rows = 3, cols = 3, ai = 'greedy', ai_options = None, record = None, tablebase = None,
+                 **kwargs):
         super(Game, self).__init__(**kwargs)
         self.rows = rows
         self.cols = cols
         self.player = player
         self.grid_map = {}
-        self.grids_ai = 0
-        self.grids_taken  = 0
-        self.grids_total = (rows-1) * (cols-1)
-        self.edge_neighbor_map = {}
-        self.edges = get_all_edges(rows-1, cols-1)
-        self.graph = Graph(edges = [])
-        self.max_vertex = Vertex(rows-1, cols-1)
-        #populate the edge neighbors cache
-        for edge in self.edges:
-            edge.neighbors_get(self.max_vertex)
+        self.engine = GameEngine(rows, cols)
+        self.ai_name = ai
+        self.ai = strategy_get(ai, **(ai_options or {}))
+        if tablebase:
+            self.ai = TablebaseStrategy(tablebase, self.ai)
+        self.record = record
         self.make_box()
 
+    def start_record(self):
+        if not self.record:
+            return None
+        return GameRecorder(RecordWriter(self.record), self.engine,
+                            players = (self.player.name, 'AI %s' %self.ai_name), first = self.HUMAN)
+
+    @property
+    def grids_ai(self):
+        return self.engine.scores[self.AI]
+
+    @property
+    def grids_taken(self):
+        return self.engine.grids_taken
+
+    @property
+    def grids_total(self):
+        return self.engine.grids_total
+
     def make_box(self):
         self.box_map = {}
         for r in xrange(self.rows-1):
@@ -271,105 +574,101 @@ class Game(GameGraphics):
             for box in self.box_map[r]:
                 self.add_box(GameGraphics.BLACK, *box)
 
-    def mark_grid(self, r1, c1, r2, c2):
-        edge = Edge( Vertex(r1, c1), Vertex(r2, c2) )
-        if self.graph.is_connected(edge):
-            return False
-        self.graph.add(edge)
-        self.remove_edge(edge)
-        return True
-
-    #given an edge, find the neighbor edges and see if some grid can be closed
-    def find_unmarked_neighbor_edges(self, edge, num_unmarked = 1):
-        neighbors = edge.neighbors_get(self.max_vertex)
-        unmarked = {}
-        neighbor_map = { 'left' : neighbors[:3], 'right' : neighbors[3:] }
-        for k, edges in neighbor_map.iteritems():
-            unmarked[k] = filter(lambda edge: self.graph.is_connected(edge) == False, edges)
-
-        for k, edges in unmarked.iteritems():
-            if len(edges) == num_unmarked:
-                return unmarked[k]
+    def take_grid(self, color, grid, player):
+        super(Game, self).take_grid(color, grid)
+        self.engine.take_grid(player)
+        if player == self.HUMAN:
+            self.player.mark_grid()
 
-        return None
+    @property
+    def geometry(self):
+        return self.engine.geometry
 
-    def find_marked_neighbor_edges(self, edge, num_marked = 4):
-        neighbors = edge.neighbors_get(self.max_vertex)
-        marked = {}
-        start_edge = [edge] if num_marked == 4 else []
-        neighbor_map = { 'left' : start_edge + neighbors[:3], 'right' : start_edge + neighbors[3:] }
-
-        for k, edges in neighbor_map.iteritems():
-            marked[k] = filter(lambda edge: self.graph.is_connected(edge), edges)
-
-        edges_marked = filter(lambda v: len(v) == num_marked, marked.values())
-        return edges_marked
-
-    #find unconnected edges that can be closed
-    def find_edges_that_can_be_closed(self):
-        for edge in self.edges:
-            assert self.graph.is_connected(edge) == False
-            marked = self.find_marked_neighbor_edges(edge, num_marked = 3)
-            if marked:
-                return edge
-        return None
+    def mark_grid(self, r1, c1, r2, c2, player = -1):
+        return self.engine.mark_grid(r1, c1, r2, c2, player)
 
-    def remove_edge(self, edge):
-        try:
-            self.edges.remove(edge)
-        except ValueError: pass
-        connected_edge = Edge(edge.v2, edge.v1)
-        try:
-            self.edges.remove(connected_edge)
-        except ValueError: pass
+    def mark_edge(self, edge, player = -1):
+        return self.engine.mark_edge(edge, player)
 
     def make_move(self, last_move = None):
-        #see if anything can be closed
-        edge = None
-        if last_move is not None:
-            unmarked_edges = self.find_unmarked_neighbor_edges(last_move)
-            if unmarked_edges:
-                edge = unmarked_edges[0]
-                self.remove_edge(edge)
-        if edge is None:
-            #find an edge that can be closed to make a grid
-            edge = self.find_edges_that_can_be_closed()
-            if edge is not None:
-                self.remove_edge(edge)
-        if edge is None and len(self.edges) > 0:
-            #edge = self.edges.pop()
-            #print('Popped edge: %s' %edge)
-            #assert self.graph.is_connected(edge) == False
-            #we try to skip edges with 2 marked edges opening up a grid
-            for edge in self.edges:
-                marked = self.find_marked_neighbor_edges(edge, num_marked=2)
-                if marked:
-                    continue
-                else:
-                    self.remove_edge(edge)
-                    break
-            else:
-                edge = self.edges.pop(0)
-        if edge:
-            assert self.graph.is_connected(edge) == False
-            print('Returned edge: %s' %edge)
-            return (edge.v1.row, edge.v1.col, edge.v2.row, edge.v2.col)
-        return None
+        return self.ai.make_move(self.engine, last_move = last_move)
 
     def mark_move(self, r1, c1, r2, c2):
-        edge = Edge( Vertex(r1, c1), Vertex(r2, c2) )
-        self.graph.add(edge)
-        #print('Adding edge: %s' %edge)
-        edges_list = self.find_marked_neighbor_edges(edge, num_marked = 4)
-        grid_map = {}
-        if edges_list:
-            nr_edges = 0
-            for edges in edges_list:
-                grid_map[nr_edges] = []
-                for edge in edges:
-                    grid_map[nr_edges].append( (edge.v1.row, edge.v1.col, edge.v2.row, edge.v2.col) )
-                nr_edges += 1
-        return grid_map.values()
+        return self.engine.mark_move(r1, c1, r2, c2)
+
+    def mark_edge_move(self, edge):
+        return self.engine.mark_edge_move(edge)
+
+    def game_finished(self):
+        return self.engine.game_finished()
+
+    def winner_decided(self):
+        return self.engine.winner_decided()
+
+    #take back the last move on the board, the engine and the worker
+    def undo_move(self):
+        move = self.engine.undo()
+        if move is None:
+            return None
+        edge, taken, player = move
+        self.worker.undo()
+        self.grids.pop()
+        del self.grid_colors[self.geometry.edge_coords(edge)]
+        for i in xrange(taken):
+            color, box = self.grids_taken_list.pop()
+            del self.taken_colors[box]
+        if player == self.HUMAN:
+            self.player.grids -= taken
+        self.redraw = True
+        return move
+
+    def redo_move(self):
+        move = self.engine.redo()
+        if move is None:
+            return None
+        edge, taken, player = move
+        self.worker.redo()
+        color = self.player.color if player == self.HUMAN else GameGraphics.BLACK
+        self.add_grid(color, self.geometry.edge_coords(edge))
+        #the engine has credited the boxes already
+        for marked_grid in self.mark_edge_move(edge):
+            super(Game, self).take_grid(color, marked_grid)
+        if player == self.HUMAN:
+            self.player.grids += taken
+        return move
+
+    #take back the AI moves since the last turn of the human and that turn,
+    #stopping the AI if it is thinking
+    def takeback(self):
+        if self.thinking:
+            self.worker.cancel()
+            self.thinking = 0
+            pygame.time.set_timer(self.TICK_EVENT, 0)
+        history = self.engine.history
+        while history and history[-1][2] != self.HUMAN:
+            self.undo_move()
+        while history and history[-1][2] == self.HUMAN:
+            self.undo_move()
+        self.worker.ponder()
+
+    #make the turn of the human taken back and the AI moves after it again
+    def replay_turn(self):
+        if self.thinking:
+            return
+        undone = self.engine.undone
+        while undone and undone[-1][2] == self.HUMAN:
+            self.redo_move()
+        while undone and undone[-1][2] != self.HUMAN:
+            self.redo_move()
+        if not self.engine.history or self.game_finished():
+            return
+        edge, taken, player = self.engine.history[-1]
+        turn = player if taken else player ^ 1
+        if turn == self.AI or self.winner_decided():
+            #the AI was stopped by the takeback before it had finished
+            self.request_ai_move(player = turn == self.HUMAN, last_move = self.geometry.edge_coords(edge))
+        else:
+            self.worker.ponder()
 
 class Player(object):
 
@@ -395,15 +694,27 @@ def load_config(config, default_cfg):
     return cfg
 
 if __name__ == '__main__':
-    cfg = { 'rows' : 3, 'cols' : 3, 'width' : 1440, 'height' : 900, 'spacing' : 12, 'col_width' : 100, 'row_width' : 100 }
+    cfg = { 'rows' : 3, 'cols' : 3, 'width' : 1440, 'height' : 900, 'spacing' : 12, 'col_width' : 100, 'row_width' : 100,
+            'ai' : 'greedy', 'ai_options' : {}, 'record' : None,
+            'tablebase' : None, 'log_level' : 'warning', 'stats' : None, 'stats_port' : None }
     if len(sys.argv) == 2 and os.access(sys.argv[1], os.F_OK):
         cfg = load_config(sys.argv[1], cfg)
     if len(sys.argv) == 3:
         cfg['rows'] = int(sys.argv[1])
         cfg['cols'] = int(sys.argv[2])
     print('Playing the %d x %d game\n' %(cfg['rows'], cfg['cols']))
+    logging.basicConfig(level = cfg.pop('log_level').upper(), format = '%(name)s: %(message)s')
+    #stats is the file the instrumentation is dumped to at the end of the
+    #game and stats_port the local port it can be scraped from meanwhile
+    stats, stats_port = cfg.pop('stats'), cfg.pop('stats_port')
+    if stats or stats_port:
+        dotstats.enable()
+    if stats_port:
+        dotstats.serve(stats_port)
     p = Player('Human', GameGraphics.RED)
     cfg['rows'] += 1
     cfg['cols'] += 1
     game = Game(p, **cfg)
     game.run()
+    if stats:
+        dotstats.dump(stats)
@@ -1,43 +1,22 @@
 import sys
-from collections import defaultdict
-
+import heapq
+import logging
+from array import array
+from collections import defaultdict, deque, OrderedDict
+
+try:
+    xrange
+except NameError:
+    #python3
+    xrange = range
+
+log = logging.getLogger(__name__)
+
+#max heap of the list in place, vertices by their weight. the graph no
+#longer keeps heaps, this is left for the callers outside of it.
+#a list sorted from the largest down is a valid max heap
 def heapify(arr):
-
-    def parent(index):
-        if index == 0:
-            return index
-        return (index-1)/2
-
-    def left_child(index):
-        return 2*index + 1
-
-    def right_child(index):
-        return 2*index + 2
-
-    def swap(arr, i, j):
-        arr[i], arr[j] = arr[j], arr[i]
-
-    def sift_down(arr, start, end):
-        root = start
-        while left_child(root) <= end:
-            target = root
-            child = left_child(root)
-            if arr[target] < arr[child]:
-                target = child
-            if child + 1 <= end and arr[target] < arr[child+1]:
-                target = child+1
-            if target == root:
-                return
-            swap(arr, root, target)
-            root = target
-
-    count = len(arr)-1
-    if count < 1:
-        return
-    start = parent(count)
-    while start >= 0:
-        sift_down(arr, start, count)
-        start -= 1
+    arr.sort(key = lambda item: getattr(item, 'weight', item), reverse = True)
 
 class Vertex(object):
     def __init__(self, row, col, weight = 0):
@@ -59,6 +38,12 @@ class Vertex(object):
         assert isinstance(obj, Vertex)
         return self.row == obj.row and self.col == obj.col
 
+    def __ne__(self, obj):
+        return not self.__eq__(obj)
+
+    def __hash__(self):
+        return hash((self.row, self.col))
+
     def __cmp__(self, obj):
         assert isinstance(obj, Vertex)
         diff = self.weight - obj.weight
@@ -70,8 +55,6 @@ class Vertex(object):
 
 class Edge(object):
 
-    neighbor_map = {}
-
     def __init__(self, v1, v2):
         self.v1 = v1
         self.v2 = v2
@@ -79,7 +62,7 @@ class Edge(object):
     def mark(self):
         self.v1.mark()
         self.v2.mark()
-        print('Marked: %s' %str(self))
+        log.debug('Marked: %s', self)
 
     def is_marked(self):
         return self.v1.is_marked() and self.v2.is_marked()
@@ -91,6 +74,12 @@ class Edge(object):
         assert isinstance(obj, Edge)
         return self.v1 == obj.v1 and self.v2 == obj.v2
 
+    def __ne__(self, obj):
+        return not self.__eq__(obj)
+
+    def __hash__(self):
+        return hash((self.v1.row, self.v1.col, self.v2.row, self.v2.col))
+
     def __cmp__(self, obj):
         assert isinstance(obj, Edge)
         if self.v1 < obj.v1:
@@ -103,16 +92,20 @@ class Edge(object):
             return 1
         return 0
 
+    #neighbors from the precomputed table of the board with max_vertex as the
+    #bottom right dot, in the same order as neighbors() but with the top left
+    #dot of each edge first. the table has the other sides of a box in the
+    #top, bottom, left, right order, neighbors() goes around the box
     def neighbors_get(self, max_vertex):
-        key1 = (self.v1.row, self.v1.col, self.v2.row, self.v2.col)
-        key2 = (self.v2.row, self.v2.col, self.v1.row, self.v1.col)
-        if key1 in self.neighbor_map:
-            return self.neighbor_map[key1]
-        if key2 in self.neighbor_map:
-            return self.neighbor_map[key2]
-        neighbors = self.neighbors(max_vertex)
-        self.neighbor_map[key1] = neighbors
-        self.neighbor_map[key2] = neighbors
+        geometry = geometry_get(max_vertex.row + 1, max_vertex.col + 1)
+        index = geometry.edge_index(self.v1.row, self.v1.col, self.v2.row, self.v2.col)
+        order = (1, 0, 2, 4, 3, 5) if index < geometry.num_h else (0, 2, 1, 3, 5, 4)
+        neighbors = []
+        for side in order:
+            neighbor = geometry.neighbors[index * 6 + side]
+            if neighbor >= 0:
+                r1, c1, r2, c2 = geometry.edge_coords(neighbor)
+                neighbors.append(Edge(Vertex(r1, c1), Vertex(r2, c2)))
         return neighbors
 
     #given an edge, find the neighbors that can close the grid
@@ -139,74 +132,115 @@ class Edge(object):
                           Edge(Vertex(r2, c1), Vertex(r2, c1-1)),
             ]
 
-        neighbors = filter(lambda e: e.v1.row >= 0 and e.v1.col >= 0 and e.v2.row >= 0 and e.v2.col >= 0 and \
-                           e.v1.row <= rows and e.v1.col <= cols and e.v2.row <= rows and e.v2.col <= cols, neighbors)
+        neighbors = [ e for e in neighbors if e.v1.row >= 0 and e.v1.col >= 0 and e.v2.row >= 0 and e.v2.col >= 0 and \
+                      e.v1.row <= rows and e.v1.col <= cols and e.v2.row <= rows and e.v2.col <= cols ]
         return neighbors
 
 
 class Graph(object):
 
+    #adjacency is a set of connected vertices per vertex key
     def __init__(self, edges = []):
-        self.graph = defaultdict(list)
+        self.graph = defaultdict(set)
         for edge in edges:
             self.add(edge)
 
     def add(self, edge):
-        key = (edge.v1.row, edge.v1.col)
-        self.graph[key].append(edge.v2)
-        heapify(self.graph[key])
-        key = (edge.v2.row, edge.v2.col)
-        self.graph[key].append(edge.v1)
-        heapify(self.graph[key])
+        self.graph[ (edge.v1.row, edge.v1.col) ].add(edge.v2)
+        self.graph[ (edge.v2.row, edge.v2.col) ].add(edge.v1)
 
     def is_connected(self, edge):
-        key = (edge.v1.row, edge.v1.col)
-        return (edge.v1.row, edge.v1.col) in self.graph and edge.v2 in self.graph[key]
+        connections = self.graph.get( (edge.v1.row, edge.v1.col) )
+        return connections is not None and edge.v2 in connections
 
     def remove(self, vertex):
-        if (vertex.row, vertex.col) not in self.graph:
+        key = (vertex.row, vertex.col)
+        if key not in self.graph:
             return False
-        for v, connections in self.graph.iteritems():
-            try:
-                first_vertex = connections[0]
-                connections.remove(vertex)
-                if first_vertex == vertex:
-                    #we heapify if the first connection is removed
-                    heapify(connections)
-            except: pass
-        del self.graph[ (vertex.row, vertex.col) ]
+        for connection in self.graph.pop(key):
+            connections = self.graph.get( (connection.row, connection.col) )
+            if connections is not None:
+                connections.discard(vertex)
         return True
 
-    def find_path(self, vertex1, vertex2, path = []):
-        path = path + [vertex1]
+    #the searches take the path that led to vertex1 like the recursive ones
+    #used to. its vertices are not entered again and it heads the result
+    def search_parents(self, vertex1, path):
+        parents = dict( ((vertex.row, vertex.col), None) for vertex in path or () )
+        parents[ (vertex1.row, vertex1.col) ] = None
+        return parents
+
+    def build_path(self, parents, vertex):
+        path = []
+        while vertex is not None:
+            path.append(vertex)
+            vertex = parents[ (vertex.row, vertex.col) ]
+        path.reverse()
+        return path
+
+    #depth first search for any path between the vertices
+    def find_path(self, vertex1, vertex2, path = None):
         if (vertex1.row, vertex1.col) not in self.graph:
             return None
-        if vertex1 == vertex2:
-            return path
-        for connection in self.graph[ (vertex1.row, vertex1.col) ]:
-            if connection in path:
-                continue
-            new_path = self.find_path(connection, vertex2, path)
-            if new_path:
-                return new_path
+        parents = self.search_parents(vertex1, path)
+        stack = [ vertex1 ]
+        while stack:
+            vertex = stack.pop()
+            if vertex == vertex2:
+                return list(path or ()) + self.build_path(parents, vertex)
+            for connection in self.graph[ (vertex.row, vertex.col) ]:
+                key = (connection.row, connection.col)
+                if key not in parents:
+                    parents[key] = vertex
+                    stack.append(connection)
         return None
 
-    def find_shortest_path(self, vertex1, vertex2, path = []):
-        path = path + [vertex1]
+    #breadth first search for the path with the fewest edges
+    def find_shortest_path(self, vertex1, vertex2, path = None):
         if (vertex1.row, vertex1.col) not in self.graph:
             return None
-        if vertex1 == vertex2:
-            return path
-        shortest = None
-        for connection in self.graph[ (vertex1.row, vertex1.col) ]:
-            if connection in path:
-                continue
-            new_path = self.find_shortest_path(connection, vertex2, path)
-            if new_path:
-                if not shortest or len(new_path) < len(shortest):
-                    shortest = new_path
+        parents = self.search_parents(vertex1, path)
+        queue = deque([ vertex1 ])
+        while queue:
+            vertex = queue.popleft()
+            if vertex == vertex2:
+                return list(path or ()) + self.build_path(parents, vertex)
+            for connection in self.graph[ (vertex.row, vertex.col) ]:
+                key = (connection.row, connection.col)
+                if key not in parents:
+                    parents[key] = vertex
+                    queue.append(connection)
+        return None
 
-        return shortest
+    #dijkstra over the vertex weights, the cost of a path being the
+    #sum of the weights of the vertices entered along the way
+    def find_lightest_path(self, vertex1, vertex2):
+        if (vertex1.row, vertex1.col) not in self.graph:
+            return None
+        start = (vertex1.row, vertex1.col)
+        costs = { start : 0 }
+        parents = { start : None }
+        done = set()
+        #the counter keeps the heap from ever comparing vertices
+        counter = 0
+        heap = [ (0, counter, vertex1) ]
+        while heap:
+            cost, _, vertex = heapq.heappop(heap)
+            key = (vertex.row, vertex.col)
+            if key in done:
+                continue
+            if vertex == vertex2:
+                return self.build_path(parents, vertex)
+            done.add(key)
+            for connection in self.graph[key]:
+                connection_key = (connection.row, connection.col)
+                new_cost = cost + connection.weight
+                if connection_key not in costs or new_cost < costs[connection_key]:
+                    costs[connection_key] = new_cost
+                    parents[connection_key] = vertex
+                    counter += 1
+                    heapq.heappush(heap, (new_cost, counter, connection))
+        return None
 
 def get_all_edges(rows, cols):
     num_grids = rows * cols * 4
@@ -244,3 +278,184 @@ def get_all_edges(rows, cols):
 
     assert len(connections) == num_grids
     return connections
+
+#fixed numbering of the edges and boxes of a board with rows x cols dots.
+#horizontal edges (r,c)-(r,c+1) come first numbered row by row,
+#followed by the vertical edges (r,c)-(r+1,c).
+#box (r,c) has the top left dot at (r,c).
+#the adjacency is precomputed into flat int arrays indexed by edge or box:
+#edge_box holds the 2 boxes of an edge (-1 on the border), box_edge the
+#top, bottom, left and right edges of a box and neighbors the 6 edges
+#that close a box with an edge, the lower or right box first.
+#lazy boards, the ones over LAZY_EDGES edges by default, work the same
+#sequences out from the index on every lookup instead of keeping them
+class BoardGeometry(object):
+
+    def __init__(self, rows, cols, lazy = None):
+        self.rows = rows
+        self.cols = cols
+        self.num_h = rows * (cols-1)
+        self.num_edges = self.num_h + (rows-1) * cols
+        self.num_boxes = (rows-1) * (cols-1)
+        self.lazy = self.num_edges > LAZY_EDGES if lazy is None else lazy
+        if self.lazy:
+            self.edge_box = LazyEdgeBoxes(self)
+            self.box_edge = LazyBoxEdges(self)
+            self.neighbors = LazyNeighbors(self)
+            return
+        self.edge_box = array('i', [-1]) * (self.num_edges * 2)
+        self.box_edge = array('i', [0]) * (self.num_boxes * 4)
+        self.neighbors = array('i', [-1]) * (self.num_edges * 6)
+        for box in xrange(self.num_boxes):
+            r, c = divmod(box, cols-1)
+            left = self.num_h + r * cols + c
+            edges = (box, box + cols-1, left, left + 1)
+            self.box_edge[box*4 : box*4 + 4] = array('i', edges)
+            #top and left edges see the box as their second (lower, right) box
+            for side, edge in enumerate(edges):
+                slot = edge * 2 + (1 if side in (0, 2) else 0)
+                self.edge_box[slot] = box
+        for edge in xrange(self.num_edges):
+            for side in (1, 0):
+                box = self.edge_box[edge*2 + side]
+                if box < 0:
+                    continue
+                slot = edge * 6 + (1 - side) * 3
+                for box_edge in self.box_edge[box*4 : box*4 + 4]:
+                    if box_edge != edge:
+                        self.neighbors[slot] = box_edge
+                        slot += 1
+
+    def edge_index(self, r1, c1, r2, c2):
+        if (r2, c2) < (r1, c1):
+            r1, c1, r2, c2 = r2, c2, r1, c1
+        if r1 < 0 or c1 < 0 or r2 >= self.rows or c2 >= self.cols:
+            raise ValueError('Edge %d:%d<->%d:%d outside the board' %(r1, c1, r2, c2))
+        if r1 == r2 and c2 == c1 + 1:
+            return r1 * (self.cols-1) + c1
+        if c1 == c2 and r2 == r1 + 1:
+            return self.num_h + r1 * self.cols + c1
+        raise ValueError('Vertices %d:%d and %d:%d are not adjacent' %(r1, c1, r2, c2))
+
+    def edge_coords(self, edge):
+        if edge < self.num_h:
+            r, c = divmod(edge, self.cols-1)
+            return (r, c, r, c+1)
+        r, c = divmod(edge - self.num_h, self.cols)
+        return (r, c, r+1, c)
+
+    #boxes on either side of the edge, -1 when the edge is on the border
+    def edge_boxes(self, edge):
+        return (self.edge_box[edge*2], self.edge_box[edge*2 + 1])
+
+    #top, bottom, left and right edges of the box
+    def box_edges(self, box):
+        return tuple(self.box_edge[box*4 : box*4 + 4])
+
+    def box_coords(self, box):
+        r, c = divmod(box, self.cols-1)
+        return (r, c, r+1, c+1)
+
+#boards with more edges than this have a lazy geometry, which is slower to
+#look up in but takes no memory and no time to set up
+LAZY_EDGES = 1 << 18
+
+#the flat int arrays of a lazy BoardGeometry as read only sequences.
+#an index returns the int of the array and a slice an array of them
+class LazyTable(object):
+
+    def __init__(self, geometry, size):
+        self.rows = geometry.rows
+        self.cols = geometry.cols
+        self.num_h = geometry.num_h
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for slot in xrange(self.size):
+            yield self.lookup(slot)
+
+    def __getitem__(self, slot):
+        if isinstance(slot, slice):
+            return array('i', [ self.lookup(i) for i in xrange(*slot.indices(self.size)) ])
+        if slot < 0:
+            slot += self.size
+        if not 0 <= slot < self.size:
+            raise IndexError('array index out of range')
+        return self.lookup(slot)
+
+#the box above or left of the edge, then the box below or right of it.
+#a horizontal edge has the number of the box below it
+class LazyEdgeBoxes(LazyTable):
+
+    def __init__(self, geometry):
+        LazyTable.__init__(self, geometry, geometry.num_edges * 2)
+
+    def lookup(self, slot):
+        edge, side = slot >> 1, slot & 1
+        cols = self.cols
+        if edge < self.num_h:
+            r = edge // (cols-1)
+            if side:
+                return edge if r < self.rows - 1 else -1
+            return edge - (cols-1) if r > 0 else -1
+        r, c = divmod(edge - self.num_h, cols)
+        if side:
+            return r * (cols-1) + c if c < cols - 1 else -1
+        return r * (cols-1) + c - 1 if c > 0 else -1
+
+#the top, bottom, left and right edges of the box
+class LazyBoxEdges(LazyTable):
+
+    def __init__(self, geometry):
+        LazyTable.__init__(self, geometry, geometry.num_boxes * 4)
+
+    def lookup(self, slot):
+        box, side = slot >> 2, slot & 3
+        if side == 0:
+            return box
+        if side == 1:
+            return box + self.cols - 1
+        r, c = divmod(box, self.cols - 1)
+        return self.num_h + r * self.cols + c + side - 2
+
+#the 3 other sides of the box below or right of the edge, then of the
+#box above or left of it, -1 past the border
+class LazyNeighbors(LazyTable):
+
+    def __init__(self, geometry):
+        LazyTable.__init__(self, geometry, geometry.num_edges * 6)
+        self.edge_box = geometry.edge_box
+        self.box_edge = geometry.box_edge
+
+    def lookup(self, slot):
+        edge, index = divmod(slot, 6)
+        box = self.edge_box.lookup(edge * 2 + (1 if index < 3 else 0))
+        if box < 0:
+            return -1
+        sides = [ self.box_edge.lookup(box * 4 + side) for side in xrange(4) ]
+        sides.remove(edge)
+        return sides[index % 3]
+
+#geometries are shared by all the games of the same size.
+#the cache is bounded so a process hosting games of many sizes keeps
+#only the most recently used ones
+GEOMETRY_CACHE_SIZE = 16
+geometry_cache = OrderedDict()
+
+#the value of key in an OrderedDict cache, made when missing. the least
+#recently used values are dropped past size entries. the other tables
+#kept per board size go through it too
+def cache_get(cache, key, make, size = GEOMETRY_CACHE_SIZE):
+    value = cache.pop(key, None)
+    if value is None:
+        value = make()
+        while len(cache) >= size:
+            cache.popitem(last = False)
+    cache[key] = value
+    return value
+
+def geometry_get(rows, cols):
+    return cache_get(geometry_cache, (rows, cols), lambda: BoardGeometry(rows, cols))
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+#monte carlo tree search AI for the dots and boxes game.
+#UCT over Position copies with cheap rollouts that take a box when they can
+#and otherwise avoid giving one away, the same rules as make_move.
+import sys
+import math
+import time
+import random
+from dotgraph import *
+from dotengine import GameEngine
+from dotsearch import solved_move
+import dotstats
+
+dotstats.rate('mcts.rollouts_per_second', 'mcts.rollouts', 'mcts.ns', 1e9)
+
+timer = getattr(time, 'perf_counter', time.time)
+
+#the nth sacrifice of a node becomes a child once the node has been
+#visited WIDEN_VISITS * n^2 times. the means backed up through a node
+#favour the moves that leave the opponent bad options, so sacrifices only
+#join the nodes searched a lot
+WIDEN_VISITS = 1024
+
+#play the position out and return the net boxes made by the side to move
+def rollout(position, rand):
+    geometry = position.geometry
+    edge_box, box_edge = geometry.edge_box, geometry.box_edge
+    drawn, box_sides = position.drawn, position.box_sides
+    moves = position.moves()
+    rand.shuffle(moves)
+    #boxes with 3 sides, the ones that can be taken
+    capturable = [ box for box in xrange(geometry.num_boxes) if box_sides[box] == 3 ]
+    #edges only ever go from safe to giving away a box, so both scans
+    #just move forward through the shuffled moves
+    safe_index = 0
+    any_index = 0
+    sign = 1
+    net = 0
+    edges_left = position.edges_left
+    while edges_left > 0:
+        edge = -1
+        while capturable:
+            box = capturable.pop()
+            if box_sides[box] == 3:
+                for side in xrange(box*4, box*4 + 4):
+                    if not drawn[box_edge[side]]:
+                        edge = box_edge[side]
+                        break
+                break
+        if edge < 0:
+            while safe_index < len(moves):
+                candidate = moves[safe_index]
+                safe_index += 1
+                if drawn[candidate]:
+                    continue
+                if (edge_box[candidate*2] < 0 or box_sides[edge_box[candidate*2]] < 2) and \
+                   (edge_box[candidate*2+1] < 0 or box_sides[edge_box[candidate*2+1]] < 2):
+                    edge = candidate
+                    break
+        if edge < 0:
+            while drawn[moves[any_index]]:
+                any_index += 1
+            edge = moves[any_index]
+        drawn[edge] = 1
+        edges_left -= 1
+        completed = 0
+        for slot in xrange(edge*2, edge*2 + 2):
+            box = edge_box[slot]
+            if box >= 0:
+                sides = box_sides[box] + 1
+                box_sides[box] = sides
+                if sides == 4:
+                    completed += 1
+                elif sides == 3:
+                    capturable.append(box)
+        if completed:
+            net += sign * completed
+        else:
+            sign = -sign
+    return net
+
+class Node(object):
+
+    #sign is +1 when the player to move at the node is the one the search is for.
+    #gained is the boxes made by the move into the node, signed the same way
+    def __init__(self, parent, edge, sign, gained):
+        self.parent = parent
+        self.edge = edge
+        self.sign = sign
+        self.gained = gained
+        self.children = []
+        self.untried = None
+        #the sacrifices not yet in the children and the number that are
+        self.deferred = None
+        self.widened = 0
+        self.visits = 0
+        self.total = 0.0
+
+    def select(self, exploration):
+        log_visits = math.log(self.visits)
+        best, best_score = None, None
+        for child in self.children:
+            score = self.sign * child.total / child.visits + exploration * math.sqrt(log_visits / child.visits)
+            if best_score is None or score > best_score:
+                best, best_score = child, score
+        return best
+
+class MCTSStrategy(object):
+
+    #stops at whichever of iterations or time_budget (seconds) comes first,
+    #either can be None. the tree is kept between moves when reuse is set.
+    #a ponder runs until stopped or ponder_iterations. with shared_cache the
+    #positions solved by a search of another strategy are played without one
+    def __init__(self, iterations = 10000, time_budget = 1.0, exploration = 1.4, seed = None, reuse = True,
+                 ponder_iterations = 200000, shared_cache = True):
+        if iterations is None and time_budget is None:
+            raise ValueError('MCTS needs an iteration count or a time budget')
+        self.iterations = iterations
+        self.time_budget = time_budget
+        self.exploration = exploration
+        self.rand = random.Random(seed)
+        self.reuse = reuse
+        self.ponder_iterations = ponder_iterations
+        self.shared_cache = shared_cache
+        #set from another thread to stop the search early
+        self.stopped = False
+        self.root = None
+        self.root_drawn = None
+        self.offset = 0
+        self.rollouts = 0
+        self.elapsed = 0.0
+
+    def rollouts_per_second(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return self.rollouts / self.elapsed
+
+    #the moves of a new node and its sacrifices, the other moves giving a
+    #box away. declining a capture by drawing the far side of the box with
+    #2 sides behind it, the double deal, is one of the moves. the other
+    #sacrifices are widened into the tree as the node is visited, so that
+    #it can still give boxes up to keep the control of the long chains
+    #without spreading the search over them. the rollouts never sacrifice
+    def expand_moves(self, position):
+        geometry = position.geometry
+        moves = []
+        giveaways = []
+        declines = set()
+        for edge in position.moves():
+            if position.captures(edge):
+                if position.forced_capture(edge):
+                    return [ edge ], []
+                moves.append(edge)
+                for slot in xrange(edge*2, edge*2 + 2):
+                    box = geometry.edge_box[slot]
+                    if box >= 0 and position.box_sides[box] == 2:
+                        for side in geometry.box_edges(box):
+                            if side != edge and not position.drawn[side]:
+                                declines.add(side)
+            elif position.gives_away(edge):
+                giveaways.append(edge)
+            else:
+                moves.append(edge)
+        if declines:
+            moves += [ edge for edge in giveaways if edge in declines ]
+            giveaways = [ edge for edge in giveaways if edge not in declines ]
+        if not moves:
+            moves, giveaways = giveaways, []
+        self.rand.shuffle(moves)
+        self.rand.shuffle(giveaways)
+        return moves, giveaways
+
+    #descend from the kept root through the moves drawn since the last search.
+    #the tree is dropped when they cannot be followed or the side to move is
+    #not the one of sign
+    def reuse_root(self, position, sign = 1):
+        if not self.reuse or self.root is None or self.root_drawn is None or \
+           len(self.root_drawn) != len(position.drawn):
+            return None
+        played = set()
+        for edge in xrange(len(position.drawn)):
+            if position.drawn[edge] and not self.root_drawn[edge]:
+                played.add(edge)
+            elif self.root_drawn[edge] and not position.drawn[edge]:
+                return None
+        found = self.follow(self.root, played, 0, sign)
+        if found is None:
+            return None
+        node, self.offset = found
+        node.parent = None
+        return node
+
+    #find a path of children drawing exactly the played edges that ends
+    #with sign to move, returns the node and the boxes made along the way
+    def follow(self, node, played, offset, sign):
+        if not played:
+            if node.sign == sign:
+                return (node, offset)
+            return None
+        for child in node.children:
+            if child.edge in played:
+                found = self.follow(child, played - set([child.edge]), offset + child.gained, sign)
+                if found is not None:
+                    return found
+        return None
+
+    #a ponder searches the position with the opponent to move so that the
+    #tree can be reused once they have moved
+    def search(self, position, ponder = False):
+        start = timer()
+        sign = 1
+        iterations = self.iterations
+        deadline = start + self.time_budget if self.time_budget is not None else None
+        if ponder:
+            sign = -1
+            iterations = self.ponder_iterations
+            deadline = None
+        scale = float(max(1, position.geometry.num_boxes))
+        root = self.reuse_root(position, sign)
+        if root is None:
+            root = Node(None, -1, sign, 0)
+            self.offset = 0
+        iteration = 0
+        while iterations is None or iteration < iterations:
+            #a stop still leaves a move to return
+            if iteration & 15 == 0 and root.children and \
+               (self.stopped or (deadline is not None and timer() > deadline)):
+                break
+            iteration += 1
+            node = root
+            state = position.copy()
+            net = self.offset
+            #selection
+            while node.untried is not None and not node.untried and node.children:
+                if node.deferred and node.visits >= WIDEN_VISITS * (node.widened + 1) ** 2:
+                    #progressive widening, the next sacrifice is expanded
+                    node.untried.append(node.deferred.pop())
+                    node.widened += 1
+                    break
+                node = node.select(self.exploration)
+                state.play(node.edge)
+                net += node.gained
+            #expansion
+            if node.untried is None:
+                node.untried, node.deferred = self.expand_moves(state)
+            if node.untried:
+                edge = node.untried.pop()
+                gained = state.play(edge)
+                sign = node.sign if gained else -node.sign
+                child = Node(node, edge, sign, node.sign * gained)
+                node.children.append(child)
+                node = child
+                net += child.gained
+            #simulation
+            if state.edges_left > 0:
+                net += node.sign * rollout(state, self.rand)
+                self.rollouts += 1
+            #backpropagation
+            reward = net / scale
+            while node is not None:
+                node.visits += 1
+                node.total += reward
+                node = node.parent
+        self.elapsed += timer() - start
+        self.root = root
+        self.root_drawn = bytearray(position.drawn)
+        if not root.children:
+            return None
+        return max(root.children, key = lambda child: child.visits).edge
+
+    def ponder(self, engine):
+        self.search(engine.position(), ponder = True)
+
+    def make_move(self, engine, last_move = None):
+        stats = dotstats.enabled
+        if stats:
+            start = dotstats.clock()
+            rollouts, elapsed = self.rollouts, self.elapsed
+        position = engine.position()
+        edge = solved_move(position) if self.shared_cache else None
+        if edge is None:
+            edge = self.search(position)
+        if stats:
+            dotstats.record('mcts.move', start)
+            dotstats.count('mcts.rollouts', self.rollouts - rollouts)
+            dotstats.count('mcts.ns', int((self.elapsed - elapsed) * 1e9))
+        if edge is None:
+            return None
+        return engine.geometry.edge_coords(edge)
+
+if __name__ == '__main__':
+    rows, cols = 3, 3
+    if len(sys.argv) == 3:
+        rows, cols = int(sys.argv[1]), int(sys.argv[2])
+    engine = GameEngine(rows+1, cols+1)
+    strategies = [ MCTSStrategy(), MCTSStrategy() ]
+    scores = engine.self_play(strategies)
+    print('Player 1 took %d grids. Player 2 took %d grids' %(scores[0], scores[1]))
+    for i, strategy in enumerate(strategies):
+        print('Player %d: %d rollouts, %.0f rollouts/s' %(i+1, strategy.rollouts, strategy.rollouts_per_second()))
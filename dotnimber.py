@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+#nimber evaluation of dots and boxes positions as nimstring.
+#in the strings and coins dual every untaken box is a coin and every undrawn
+#edge a string, tying two coins together or a coin to the ground at the
+#border. with the ground left out the coins fall apart into components
+#that are independent games, so the nimber of the position is the xor of
+#the nimbers of its components. a component is kept as its coins and
+#the bits of their undrawn sides, and its nimber is cached by its shape
+#with the position and the rotations and mirrors of the board taken out.
+#a move that offers a loony position, one where the opponent can take
+#everything or decline the last boxes, loses and is left out of the mex.
+import sys
+from collections import OrderedDict
+from dotgraph import *
+from dotengine import GameEngine
+from dotchains import ChainStrategy
+
+#undrawn side bits of a coin in the order of BoardGeometry.box_edges
+TOP = 1
+BOTTOM = 2
+LEFT = 4
+RIGHT = 8
+#side bit, row and col step to the coin across it and the bit back
+SIDES = ((TOP, -1, 0, BOTTOM), (BOTTOM, 1, 0, TOP), (LEFT, 0, -1, RIGHT), (RIGHT, 0, 1, LEFT))
+POPCOUNT = bytearray(bin(mask).count('1') for mask in xrange(16))
+
+#the rotations and mirrors as 2x2 matrices applied to the coordinates
+TRANSFORMS = ((1, 0, 0, 1), (-1, 0, 0, 1), (1, 0, 0, -1), (-1, 0, 0, -1),
+              (0, 1, 1, 0), (0, -1, -1, 0), (0, 1, -1, 0), (0, -1, 1, 0))
+
+def transform_bits(a, b, c, d):
+    steps = dict(((dr, dc), bit) for bit, dr, dc, back in SIDES)
+    bits = bytearray(16)
+    for mask in xrange(16):
+        for bit, dr, dc, back in SIDES:
+            if mask & bit:
+                bits[mask] |= steps[(a*dr + b*dc, c*dr + d*dc)]
+    return bits
+
+TRANSFORM_BITS = [ transform_bits(*transform) for transform in TRANSFORMS ]
+
+#the component under every rotation and mirror moved to the origin,
+#the smallest of them
+def shape_key(coins):
+    key = None
+    for (a, b, c, d), bits in zip(TRANSFORMS, TRANSFORM_BITS):
+        shape = sorted((a*r + b*c2, c*r + d*c2, bits[mask]) for (r, c2), mask in coins.items())
+        top = min(r for r, c2, mask in shape)
+        left = min(c2 for r, c2, mask in shape)
+        shape = tuple((r - top, c2 - left, mask) for r, c2, mask in shape)
+        if key is None or shape < key:
+            key = shape
+    return key
+
+#the coins tied together by strings, each as a dict of coin to mask
+def components(coins):
+    result = []
+    seen = set()
+    for start in coins:
+        if start in seen:
+            continue
+        seen.add(start)
+        component = {}
+        stack = [ start ]
+        while stack:
+            coin = stack.pop()
+            mask = coins[coin]
+            component[coin] = mask
+            for bit, dr, dc, back in SIDES:
+                if mask & bit:
+                    other = (coin[0] + dr, coin[1] + dc)
+                    if other in coins and other not in seen:
+                        seen.add(other)
+                        stack.append(other)
+        result.append(component)
+    return result
+
+#the strings of the coins, each once as (coin, bit)
+def strings(coins):
+    result = []
+    for coin, mask in coins.items():
+        for bit, dr, dc, back in SIDES:
+            if mask & bit:
+                other = (coin[0] + dr, coin[1] + dc)
+                if other not in coins or coin < other:
+                    result.append((coin, bit))
+    return result
+
+#whether the opponent can decline the coins hanging from the capturable
+#coin: a chain of 2 or more ending on the ground or at a coin with 3 or 4
+#strings, or one of 3 or more capturable from both ends
+def loony(coins, start):
+    length = 1
+    previous, coin = None, start
+    while True:
+        mask = coins[coin]
+        for bit, dr, dc, back in SIDES:
+            if mask & bit:
+                other = (coin[0] + dr, coin[1] + dc)
+                if other != previous:
+                    break
+        if other not in coins:
+            return length >= 2
+        degree = POPCOUNT[coins[other]]
+        if degree == 1:
+            return length >= 2
+        if degree >= 3:
+            return length >= 2
+        previous, coin = coin, other
+        length += 1
+
+#cut the string and let the opponent take the coins it leaves capturable.
+#returns the coins left or None when the cut offers a loony position
+def cut(coins, coin, bit):
+    coins = dict(coins)
+    ends = [ coin ]
+    coins[coin] &= ~bit
+    for side, dr, dc, back in SIDES:
+        if side == bit:
+            other = (coin[0] + dr, coin[1] + dc)
+            if other in coins:
+                coins[other] &= ~back
+                ends.append(other)
+            break
+    capturable = [ end for end in ends if POPCOUNT[coins[end]] == 1 ]
+    for end in capturable:
+        if loony(coins, end):
+            return None
+    while capturable:
+        coin = capturable.pop()
+        if coin not in coins:
+            continue
+        mask = coins.pop(coin)
+        for side, dr, dc, back in SIDES:
+            if mask & side:
+                other = (coin[0] + dr, coin[1] + dc)
+                if other in coins:
+                    coins[other] &= ~back
+                    degree = POPCOUNT[coins[other]]
+                    if degree == 0:
+                        del coins[other]
+                    elif degree == 1:
+                        capturable.append(other)
+    return coins
+
+#nimbers of the component shapes seen lately, the shapes are small so
+#many more are kept than the tables of the board sizes
+NIMBER_CACHE_SIZE = 1 << 16
+nimber_map = OrderedDict()
+
+def component_nimber(component):
+    def make():
+        options = set()
+        for coin, bit in strings(component):
+            left = cut(component, coin, bit)
+            if left is not None:
+                options.add(nimber(left))
+        value = 0
+        while value in options:
+            value += 1
+        return value
+    return cache_get(nimber_map, shape_key(component), make, NIMBER_CACHE_SIZE)
+
+#the nimber of coins without a capturable one
+def nimber(coins):
+    value = 0
+    for component in components(coins):
+        value ^= component_nimber(component)
+    return value
+
+#the coins of the engine, the untaken boxes keyed by (row, col)
+def engine_coins(engine):
+    geometry = engine.geometry
+    coins = {}
+    for box in xrange(geometry.num_boxes):
+        if engine.box_sides[box] < 4:
+            mask = 0
+            for side, edge in enumerate(geometry.box_edges(box)):
+                if not engine.is_drawn(edge):
+                    mask |= 1 << side
+            coins[divmod(box, geometry.cols-1)] = mask
+    return coins
+
+def coin_edge(geometry, coin, bit):
+    box = coin[0] * (geometry.cols-1) + coin[1]
+    return geometry.box_edges(box)[(TOP, BOTTOM, LEFT, RIGHT).index(bit)]
+
+#plays to win nimstring, making the nimber of the position zero for the
+#opponent. the chain strategy takes the boxes, plays the positions with a
+#component of more than max_strings strings and the lost positions. with
+#shared_cache the positions solved by a search of another strategy are
+#played from the cache
+class NimberStrategy(object):
+
+    def __init__(self, max_strings = 16, shared_cache = True):
+        self.max_strings = max_strings
+        self.chains = ChainStrategy(shared_cache = shared_cache)
+
+    #the edge that leaves a zero nimber or None
+    def winning_edge(self, engine):
+        parts = components(engine_coins(engine))
+        if any(len(strings(component)) > self.max_strings for component in parts):
+            return None
+        values = [ component_nimber(component) for component in parts ]
+        total = 0
+        for value in values:
+            total ^= value
+        if total == 0:
+            return None
+        for component, value in zip(parts, values):
+            target = value ^ total
+            if target >= value:
+                continue
+            for coin, bit in strings(component):
+                left = cut(component, coin, bit)
+                if left is not None and nimber(left) == target:
+                    return coin_edge(engine.geometry, coin, bit)
+        return None
+
+    def make_move(self, engine, last_move = None):
+        edge = self.chains.solved_edge(engine)
+        if edge is None and not engine.buckets[engine.CAPTURE]:
+            edge = self.winning_edge(engine)
+        if edge is None:
+            edge = self.chains.choose_edge(engine, self.chains.analyzer_get(engine))
+        if edge is None:
+            return None
+        return engine.geometry.edge_coords(edge)
+
+if __name__ == '__main__':
+    rows, cols = 3, 3
+    if len(sys.argv) == 3:
+        rows, cols = int(sys.argv[1]), int(sys.argv[2])
+    engine = GameEngine(rows+1, cols+1)
+    scores = engine.self_play([ NimberStrategy(), ChainStrategy() ])
+    print('Player 1 took %d grids. Player 2 took %d grids' %(scores[0], scores[1]))
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+#compact binary game records.
+#an archive is the magic and version followed by the games, each one the
+#varint length of its record and the record itself:
+#  varint rows, varint cols (dots like GameEngine), byte first player,
+#  the 2 player names as varint length and utf-8 bytes,
+#  varint number of moves and the varint edge index of every move.
+#who made a move is not stored since it follows from the rules, the turn
+#only passes when a move takes no box.
+#./dotrecord.py generate games.dotr --games 10000 --sizes 5x5
+#./dotrecord.py replay games.dotr
+#./dotrecord.py dump games.dotr --limit 10
+import os
+import json
+import mmap
+import time
+import random
+import argparse
+from array import array
+from collections import OrderedDict
+from dotgraph import *
+from dotengine import GameEngine, GreedyStrategy
+
+MAGIC = b'DOTR'
+VERSION = 1
+HEADER = MAGIC + bytearray([VERSION])
+
+timer = getattr(time, 'perf_counter', time.time)
+
+def varint_append(buf, value):
+    while value >= 0x80:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+#returns the value and the offset after it
+def varint_read(buf, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = buf[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+#the record up to the number of moves
+def record_header(rows, cols, players, first):
+    buf = bytearray()
+    varint_append(buf, rows)
+    varint_append(buf, cols)
+    buf.append(first)
+    for name in players:
+        name = name.encode('utf-8')
+        varint_append(buf, len(name))
+        buf.extend(name)
+    return buf
+
+def record_encode(rows, cols, players, first, edges):
+    buf = record_header(rows, cols, players, first)
+    varint_append(buf, len(edges))
+    for edge in edges:
+        varint_append(buf, edge)
+    return buf
+
+#the boxes on either side of every edge as lists for the replay, which
+#index lists faster than the geometry arrays
+replay_map = OrderedDict()
+
+def replay_tables(rows, cols):
+    def make():
+        edge_box = geometry_get(rows, cols).edge_box
+        return (list(edge_box[0::2]), list(edge_box[1::2]))
+    return cache_get(replay_map, (rows, cols), make)
+
+#one game of an archive. the moves are decoded as they are asked for
+class GameRecord(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.rows, offset = varint_read(data, 0)
+        self.cols, offset = varint_read(data, offset)
+        self.first = data[offset]
+        offset += 1
+        players = []
+        for i in xrange(2):
+            length, offset = varint_read(data, offset)
+            players.append(bytes(data[offset:offset+length]).decode('utf-8'))
+            offset += length
+        self.players = tuple(players)
+        self.num_moves, self.moves_offset = varint_read(data, offset)
+
+    def moves(self):
+        data, offset = self.data, self.moves_offset
+        for i in xrange(self.num_moves):
+            edge, offset = varint_read(data, offset)
+            yield edge
+
+    def grids(self):
+        geometry = geometry_get(self.rows, self.cols)
+        for edge in self.moves():
+            yield geometry.edge_coords(edge)
+
+    #the final scores of the players, replayed with just the box side
+    #counts. raises ValueError for an edge drawn twice
+    def replay(self):
+        first_box, second_box = replay_tables(self.rows, self.cols)
+        box_sides = bytearray((self.rows-1) * (self.cols-1))
+        drawn = bytearray(len(first_box))
+        data, offset = self.data, self.moves_offset
+        scores = [0, 0]
+        player = self.first
+        for i in xrange(self.num_moves):
+            edge = data[offset]
+            offset += 1
+            if edge >= 0x80:
+                edge &= 0x7f
+                shift = 7
+                while True:
+                    byte = data[offset]
+                    offset += 1
+                    edge |= (byte & 0x7f) << shift
+                    if byte < 0x80:
+                        break
+                    shift += 7
+            if drawn[edge]:
+                raise ValueError('Edge %d drawn twice' %edge)
+            drawn[edge] = 1
+            taken = 0
+            box = first_box[edge]
+            if box >= 0:
+                box_sides[box] += 1
+                if box_sides[box] == 4:
+                    taken = 1
+            box = second_box[edge]
+            if box >= 0:
+                box_sides[box] += 1
+                if box_sides[box] == 4:
+                    taken += 1
+            if taken:
+                scores[player] += taken
+            else:
+                player ^= 1
+        return scores
+
+#appends games to an archive, each one written as soon as it is complete
+class RecordWriter(object):
+
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(HEADER)
+        else:
+            with open(path, 'rb') as f:
+                if bytearray(f.read(len(HEADER))) != HEADER:
+                    self.file.close()
+                    raise ValueError('%s is not a version %d game archive' %(path, VERSION))
+        self.games = 0
+
+    def write_record(self, record):
+        buf = bytearray()
+        varint_append(buf, len(record))
+        self.file.write(buf)
+        self.file.write(record)
+        self.games += 1
+
+    def write(self, rows, cols, players, first, edges):
+        self.write_record(record_encode(rows, cols, players, first, edges))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+#records the edges drawn on the engine as they are drawn, through mark_grid,
+#mark_move or play_move, less the ones taken back with undo, and writes the
+#game to the writer when finished
+class GameRecorder(object):
+
+    def __init__(self, writer, engine, players = ('player1', 'player2'), first = GameEngine.PLAYER1):
+        self.writer = writer
+        self.engine = engine
+        self.players = players
+        self.first = first
+        self.moves = bytearray()
+        #where every move starts in moves so an undo can drop it
+        self.offsets = array('i')
+        self.num_moves = 0
+        engine.listeners.append(self)
+
+    def edge_drawn(self, edge):
+        self.offsets.append(len(self.moves))
+        varint_append(self.moves, edge)
+        self.num_moves += 1
+
+    def edge_undrawn(self, edge):
+        del self.moves[self.offsets.pop():]
+        self.num_moves -= 1
+
+    def finish(self):
+        if self in self.engine.listeners:
+            self.engine.listeners.remove(self)
+        record = record_header(self.engine.geometry.rows, self.engine.geometry.cols, self.players, self.first)
+        varint_append(record, self.num_moves)
+        record.extend(self.moves)
+        self.writer.write_record(record)
+
+#iterates over the games of an archive, which is memory mapped so that
+#archives bigger than memory can be read
+class RecordReader(object):
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = None
+        if self.size > 0:
+            self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        if self.size < len(HEADER) or bytearray(self.map[:len(HEADER)]) != HEADER:
+            self.close()
+            raise ValueError('%s is not a version %d game archive' %(path, VERSION))
+
+    def __iter__(self):
+        offset = len(HEADER)
+        while offset < self.size:
+            #a length varint is at most 10 bytes
+            length, used = varint_read(bytearray(self.map[offset:offset+10]), 0)
+            offset += used
+            yield GameRecord(bytearray(self.map[offset:offset+length]))
+            offset += length
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+#the records of an archive read from a file object one at a time, for
+#pipes and archives too big to map. raises ValueError for a truncated one
+def record_stream(f):
+    if bytearray(f.read(len(HEADER))) != HEADER:
+        raise ValueError('Not a version %d game archive' %VERSION)
+    while True:
+        length = 0
+        shift = 0
+        while True:
+            byte = f.read(1)
+            if not byte:
+                if shift:
+                    raise ValueError('Truncated game archive')
+                return
+            byte = ord(byte)
+            length |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        data = f.read(length)
+        if len(data) < length:
+            raise ValueError('Truncated game archive')
+        yield GameRecord(bytearray(data))
+
+def parse_sizes(sizes):
+    result = []
+    for size in sizes.split(','):
+        rows, cols = size.lower().split('x')
+        result.append( (int(rows), int(cols)) )
+    return result
+
+#greedy self play games opened with random safe moves
+def generate(path, games, sizes, seed, opening):
+    rand = random.Random(seed)
+    strategy = GreedyStrategy()
+    with RecordWriter(path) as writer:
+        for i in xrange(games):
+            rows, cols = sizes[i % len(sizes)]
+            engine = GameEngine(rows+1, cols+1)
+            recorder = GameRecorder(writer, engine, players = ('greedy', 'greedy'))
+            player = engine.PLAYER1
+            grid = None
+            moves = 0
+            while engine.game_finished() == False:
+                safe = engine.buckets[engine.SAFE]
+                if moves < opening and safe:
+                    grid = engine.geometry.edge_coords(safe.members[rand.randrange(len(safe))])
+                else:
+                    grid = strategy.make_move(engine, last_move = grid)
+                moves += 1
+                if not engine.play_move(player, grid):
+                    player ^= 1
+            recorder.finish()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Write, replay and dump dots and boxes game archives')
+    commands = parser.add_subparsers(dest = 'command')
+    command = commands.add_parser('generate', help = 'append greedy self play games to the archive')
+    command.add_argument('archive')
+    command.add_argument('--games', type = int, default = 1000)
+    command.add_argument('--sizes', default = '5x5', help = 'comma separated board sizes in boxes')
+    command.add_argument('--seed', type = int, default = 0)
+    command.add_argument('--opening', type = int, default = 2, help = 'random safe moves opening each game')
+    command = commands.add_parser('replay', help = 'replay every game and report the speed')
+    command.add_argument('archive')
+    command = commands.add_parser('dump', help = 'print the games as JSON lines')
+    command.add_argument('archive')
+    command.add_argument('--limit', type = int)
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        generate(args.archive, args.games, parse_sizes(args.sizes), args.seed, args.opening)
+    elif args.command == 'replay':
+        games = moves = 0
+        json_size = 0
+        start = timer()
+        with RecordReader(args.archive) as reader:
+            for record in reader:
+                record.replay()
+                games += 1
+                moves += record.num_moves
+            elapsed = timer() - start
+            #the size of the same games as JSON, estimated from the first ones
+            sample = 0
+            for record in reader:
+                json_size += len(json.dumps({ 'rows' : record.rows, 'cols' : record.cols, 'players' : record.players,
+                                              'first' : record.first, 'moves' : list(record.grids()) }))
+                sample += 1
+                if sample == 100:
+                    break
+            size = reader.size
+        print('%d games, %d moves in %.3fs, %.0f moves/s' %(games, moves, elapsed, moves / max(elapsed, 1e-9)))
+        if games:
+            print('%d bytes, %.1f bytes per game, %.1f as JSON' %(size, float(size) / games, float(json_size) / sample))
+    elif args.command == 'dump':
+        with RecordReader(args.archive) as reader:
+            for i, record in enumerate(reader):
+                if args.limit is not None and i >= args.limit:
+                    break
+                print(json.dumps({ 'rows' : record.rows, 'cols' : record.cols, 'players' : record.players,
+                                   'first' : record.first, 'scores' : record.replay(),
+                                   'moves' : list(record.grids()) }, sort_keys = True))
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,550 @@
+#!/usr/bin/env python
+#alpha-beta search AI for the dots and boxes game.
+#negamax over Position with a zobrist hashed transposition table and
+#iterative deepening under a time budget per move.
+#with workers the search runs lazy SMP, helper processes searching the
+#same position at the same time and sharing the table in shared memory.
+import sys
+import time
+import random
+import weakref
+from array import array
+try:
+    import multiprocessing
+    from multiprocessing import shared_memory
+except ImportError:
+    #python2 or before 3.8, the search runs in one process
+    shared_memory = None
+from collections import OrderedDict
+from dotgraph import *
+from dotengine import GameEngine, Position
+from dotsymmetry import symmetry_get, EvaluationCache, evaluation_cache, evaluation_cache_find
+import dotstats
+
+dotstats.rate('search.nodes_per_second', 'search.nodes', 'search.ns', 1e9)
+dotstats.rate('search.tt_hit_rate', 'search.tt_hits', 'search.tt_probes')
+
+timer = getattr(time, 'perf_counter', time.time)
+
+#typecode of an unsigned 64 bit array for the zobrist keys
+KEY_TYPECODE = 'Q' if 'Q' in getattr(array, 'typecodes', '') else 'L'
+
+INFINITY = 1 << 20
+#stored depth of entries searched to the end of the game
+FULL_DEPTH = 0x7fff
+
+class SearchTimeout(Exception):
+    pass
+
+#zobrist keys are shared by all the searches on boards of the same size
+zobrist_map = OrderedDict()
+
+def zobrist_keys(geometry):
+    def make():
+        rand = random.Random(geometry.rows * 65536 + geometry.cols)
+        return array(KEY_TYPECODE, [ rand.getrandbits(64) for i in xrange(geometry.num_edges) ])
+    return cache_get(zobrist_map, (geometry.rows, geometry.cols), make)
+
+def zobrist_hash(keys, position):
+    key = 0
+    for edge in xrange(position.geometry.num_edges):
+        if position.drawn[edge]:
+            key ^= keys[edge]
+    return key
+
+#the edge of a position solved by a search, in any of its mirror images,
+#or None. nothing is hashed before a search has solved a position of the
+#size, so the strategies can ask on every move of a big board
+def solved_move(position):
+    geometry = position.geometry
+    cache = evaluation_cache_find(geometry)
+    if not cache:
+        return None
+    symmetry = symmetry_get(geometry)
+    key, transform = symmetry.canonical(symmetry.hashes(zobrist_keys(geometry), position))
+    entry = cache.get(key)
+    if entry is None or entry[1] != FULL_DEPTH:
+        return None
+    return symmetry.from_canonical(transform, entry[2])
+
+#fixed size transposition table kept in flat arrays.
+#the value of a position is the net number of boxes the side to move makes
+#from there on, which does not depend on who is to move, so the key is
+#just the hash of the drawn edges.
+#replacement is either 'always' or 'depth', the latter keeping the
+#deeper of two entries from the same search
+class TranspositionTable(object):
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+    #bytes per entry across the arrays
+    ENTRY_SIZE = 18
+
+    def __init__(self, max_mb = 16, replacement = 'depth'):
+        if replacement not in ('always', 'depth'):
+            raise ValueError('Unknown replacement policy %s' %replacement)
+        size = 1
+        while size * 2 * self.ENTRY_SIZE <= max_mb * 1024 * 1024:
+            size *= 2
+        self.size = size
+        self.mask = size - 1
+        self.replacement = replacement
+        self.keys = array(KEY_TYPECODE, [0]) * size
+        self.values = array('h', [0]) * size
+        self.depths = array('h', [-1]) * size
+        self.moves = array('i', [-1]) * size
+        self.flags = bytearray(size)
+        self.generations = bytearray(size)
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+
+    def new_search(self):
+        self.generation = (self.generation + 1) & 0xff
+
+    #returns the slot of the entry for the key or -1
+    def probe(self, key):
+        self.probes += 1
+        slot = key & self.mask
+        if self.depths[slot] >= 0 and self.keys[slot] == key:
+            self.hits += 1
+            return slot
+        return -1
+
+    def store(self, key, depth, value, flag, move):
+        slot = key & self.mask
+        if self.replacement == 'depth' and self.keys[slot] != key and \
+           self.generations[slot] == self.generation and self.depths[slot] > depth:
+            return
+        self.keys[slot] = key
+        self.depths[slot] = depth
+        self.values[slot] = value
+        self.flags[slot] = flag
+        self.moves[slot] = move
+        self.generations[slot] = self.generation
+
+    #the (depth, value, flag, move) of the key or None
+    def lookup(self, key):
+        slot = self.probe(key)
+        if slot < 0:
+            return None
+        return self.depths[slot], self.values[slot], self.flags[slot], self.moves[slot]
+
+#the transposition table in shared memory for the searches of several
+#processes on the same position, attached by name in the helpers.
+#an entry is a word of data packing the value, depth, flag, generation and
+#move next to the key xored with it, written without a lock. a lookup only
+#takes an entry whose 2 words agree, so one torn by 2 processes storing to
+#the slot at once reads as a miss
+class SharedTranspositionTable(object):
+    EXACT = TranspositionTable.EXACT
+    LOWER = TranspositionTable.LOWER
+    UPPER = TranspositionTable.UPPER
+    ENTRY_SIZE = 16
+    #moves are kept plus 1 in the top 22 bits
+    MOVE_MASK = (1 << 22) - 1
+
+    def __init__(self, max_mb = 16, replacement = 'depth', name = None):
+        if replacement not in ('always', 'depth'):
+            raise ValueError('Unknown replacement policy %s' %replacement)
+        size = 1
+        while size * 2 * self.ENTRY_SIZE <= max_mb * 1024 * 1024:
+            size *= 2
+        self.size = size
+        self.mask = size - 1
+        self.replacement = replacement
+        #the first word stops the helpers, then the checks and the data
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create = True, size = 8 + size * self.ENTRY_SIZE)
+        else:
+            self.memory = shared_memory.SharedMemory(name = name)
+        self.name = self.memory.name
+        buf = self.memory.buf
+        self.control = buf[:8].cast('Q')
+        self.checks = buf[8:8 + size * 8].cast('Q')
+        self.data = buf[8 + size * 8:8 + size * 16].cast('Q')
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+
+    def new_search(self):
+        self.generation = (self.generation + 1) & 0xff
+
+    def stopped(self):
+        return self.control[0] != 0
+
+    def stop(self, value = True):
+        self.control[0] = 1 if value else 0
+
+    def lookup(self, key):
+        self.probes += 1
+        slot = key & self.mask
+        data = self.data[slot]
+        if data == 0 or self.checks[slot] ^ data != key:
+            return None
+        self.hits += 1
+        value = data & 0xffff
+        if value >= 0x8000:
+            value -= 0x10000
+        return (data >> 16) & 0xffff, value, (data >> 32) & 3, ((data >> 42) & self.MOVE_MASK) - 1
+
+    def store(self, key, depth, value, flag, move):
+        slot = key & self.mask
+        if self.replacement == 'depth':
+            old = self.data[slot]
+            if old and self.checks[slot] ^ old != key and \
+               (old >> 34) & 0xff == self.generation and (old >> 16) & 0xffff > depth:
+                return
+        data = (value & 0xffff) | depth << 16 | flag << 32 | self.generation << 34 | \
+               ((move + 1) & self.MOVE_MASK) << 42
+        self.data[slot] = data
+        self.checks[slot] = key ^ data
+
+    #the views have to go before the memory can be closed
+    def close(self, unlink = False):
+        for view in (self.control, self.checks, self.data):
+            view.release()
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+class AlphaBetaStrategy(object):
+
+    #time_budget is in seconds per move, tt_mb caps the transposition table.
+    #positions with up to solve_edges undrawn edges are searched straight to
+    #the end of the game, the depth limited iterations would only slow it down.
+    #with symmetry the table is keyed by the canonical position so mirror
+    #images are searched once, and solved positions go to the cache shared
+    #by the strategies, or to one of the strategy's own without shared_cache
+    #workers is the number of processes searching each timed move, itself
+    #included, it needs shared memory and stays 1 without
+    def __init__(self, time_budget = 1.0, tt_mb = 16, replacement = 'depth', max_depth = None, solve_edges = 20,
+                 symmetry = True, workers = 1, shared_cache = True):
+        self.time_budget = time_budget
+        self.max_depth = max_depth
+        self.solve_edges = solve_edges
+        self.symmetric = symmetry
+        self.workers = workers if shared_memory is not None else 1
+        self.helpers = []
+        if self.workers > 1:
+            self.table = SharedTranspositionTable(max_mb = tt_mb, replacement = replacement)
+            self.options = (tt_mb, replacement, max_depth, solve_edges, symmetry)
+            #the pool and the shared memory go with the strategy
+            self.closer = weakref.finalize(self, helpers_close, self.helpers, self.table)
+        else:
+            self.table = TranspositionTable(max_mb = tt_mb, replacement = replacement)
+        self.shared_cache = shared_cache
+        self.cache = None
+        self.cache_size = None
+        self.nodes = 0
+        self.depth = 0
+        self.value = 0
+        self.deadline = None
+        #set from another thread to stop the search early
+        self.stopped = False
+
+    #end the helper processes and free the shared table
+    def close(self):
+        if self.workers > 1:
+            self.closer()
+
+    #the evaluation cache of the board. the strategy's own is a new one
+    #when the size changes
+    def cache_get(self, geometry):
+        if self.shared_cache:
+            self.cache = evaluation_cache(geometry)
+            return self.cache
+        size = (geometry.rows, geometry.cols)
+        if self.cache_size != size:
+            self.cache = EvaluationCache()
+            self.cache_size = size
+        return self.cache
+
+    def out_of_time(self):
+        return self.stopped or (self.deadline is not None and timer() > self.deadline)
+
+    #captures first, then the transposition table move and safe moves,
+    #the moves giving away boxes last
+    def order_moves(self, position, tt_move = -1):
+        captures = []
+        safe = []
+        giveaways = []
+        for edge in xrange(position.geometry.num_edges):
+            if position.drawn[edge]:
+                continue
+            if position.captures(edge):
+                if position.forced_capture(edge):
+                    return [ edge ]
+                captures.append(edge)
+            elif edge == tt_move:
+                safe.insert(0, edge)
+            elif position.gives_away(edge):
+                giveaways.append(edge)
+            else:
+                safe.append(edge)
+        if tt_move in captures:
+            captures.remove(tt_move)
+            captures.insert(0, tt_move)
+        return captures + safe + giveaways
+
+    #beyond the horizon the side to move takes whatever is capturable
+    def quiesce(self, position):
+        for edge in xrange(position.geometry.num_edges):
+            if not position.drawn[edge] and position.captures(edge):
+                gained = position.play(edge)
+                value = gained + self.quiesce(position)
+                position.undo(edge)
+                return value
+        return 0
+
+    #hashes has the hash of the position under every symmetry
+    def search(self, position, hashes, depth, alpha, beta):
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and self.out_of_time():
+            raise SearchTimeout()
+        if position.edges_left == 0:
+            return 0
+        #the side to move cannot make more than the boxes left
+        if beta > position.boxes_left:
+            beta = position.boxes_left
+            if alpha >= beta:
+                return beta
+        if alpha < -position.boxes_left:
+            alpha = -position.boxes_left
+            if alpha >= beta:
+                return alpha
+        table = self.table
+        alpha_orig = alpha
+        key = min(hashes)
+        transform = hashes.index(key)
+        tt_move = -1
+        entry = table.lookup(key)
+        if entry is not None:
+            stored_depth, value, flag, tt_move = entry
+            #the stored move is in the canonical frame
+            if tt_move >= 0:
+                tt_move = self.symmetry.inverses[transform][tt_move]
+            if stored_depth >= depth:
+                if flag == table.EXACT:
+                    return value
+                if flag == table.LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+        if depth <= 0:
+            return self.quiesce(position)
+        best, best_move = -INFINITY, -1
+        transformed = self.transformed
+        for edge in self.order_moves(position, tt_move):
+            gained = position.play(edge)
+            child_hashes = [ child_key ^ keys[edge] for child_key, keys in zip(hashes, transformed) ]
+            if gained:
+                #completing a box means we move again
+                value = gained + self.search(position, child_hashes, depth-1, alpha-gained, beta-gained)
+            else:
+                value = -self.search(position, child_hashes, depth-1, -beta, -alpha)
+            position.undo(edge)
+            if value > best:
+                best, best_move = value, edge
+            if best > alpha:
+                alpha = best
+            if alpha >= beta:
+                break
+        if best <= alpha_orig:
+            flag = table.UPPER
+        elif best >= beta:
+            flag = table.LOWER
+        else:
+            flag = table.EXACT
+        #a search to the end of the game is good for any depth
+        if depth >= position.edges_left:
+            depth = FULL_DEPTH
+        table.store(key, depth, best, flag, self.symmetry.perms[transform][best_move])
+        return best
+
+    def search_root(self, position, hashes, depth, moves):
+        best, best_move = -INFINITY, moves[0]
+        alpha, beta = -INFINITY, INFINITY
+        transformed = self.transformed
+        for edge in moves:
+            gained = position.play(edge)
+            child_hashes = [ child_key ^ keys[edge] for child_key, keys in zip(hashes, transformed) ]
+            if gained:
+                value = gained + self.search(position, child_hashes, depth-1, alpha-gained, beta-gained)
+            else:
+                value = -self.search(position, child_hashes, depth-1, -beta, -alpha)
+            position.undo(edge)
+            if value > best:
+                best, best_move = value, edge
+                alpha = max(alpha, best)
+        return best, best_move
+
+    #iterative deepening until the game end is reached, the time runs out or
+    #the search is stopped. returns the best edge index of the last completed
+    #iteration or the first ordered move when not even one could be completed.
+    #a ponder has no time limit and only ends when stopped. a single move is
+    #played without a search unless evaluate asks for the value of the position
+    def best_move(self, position, ponder = False, evaluate = False):
+        geometry = position.geometry
+        self.keys = zobrist_keys(geometry)
+        self.symmetry = symmetry_get(geometry, self.symmetric)
+        self.transformed = self.symmetry.transformed_keys(self.keys)
+        hashes = self.symmetry.hashes(self.keys, position)
+        key, transform = self.symmetry.canonical(hashes)
+        cache = self.cache_get(geometry)
+        self.table.new_search()
+        self.nodes = 0
+        self.depth = 0
+        self.deadline = timer() + self.time_budget if self.time_budget and not ponder else None
+        moves = self.order_moves(position)
+        if not moves:
+            return None
+        if len(moves) == 1 and not evaluate:
+            return moves[0]
+        #solved before, by this or another strategy
+        entry = cache.get(key)
+        if entry is not None and entry[1] == FULL_DEPTH:
+            self.value = entry[0]
+            self.depth = position.edges_left
+            return self.symmetry.from_canonical(transform, entry[2])
+        max_depth = position.edges_left
+        if self.max_depth is not None:
+            max_depth = min(max_depth, self.max_depth)
+        depths = list(xrange(1, max_depth + 1))
+        if max_depth == position.edges_left and max_depth <= self.solve_edges:
+            depths = [ max_depth ]
+        if self.workers > 1 and not ponder:
+            return self.parallel_search(position, hashes, moves, depths)
+        return self.deepen(position, hashes, moves, depths)
+
+    #the iterations of best_move over the depths
+    def deepen(self, position, hashes, moves, depths):
+        best_move = moves[0]
+        for depth in depths:
+            try:
+                self.value, best_move = self.search_root(position.copy(), hashes, depth, moves)
+            except SearchTimeout:
+                break
+            self.depth = depth
+            if depth == position.edges_left:
+                key, transform = self.symmetry.canonical(hashes)
+                self.cache_get(position.geometry).put(key, self.value, FULL_DEPTH,
+                                                      self.symmetry.to_canonical(transform, best_move))
+            #search the previous best move first in the next iteration
+            moves.remove(best_move)
+            moves.insert(0, best_move)
+        return best_move
+
+    #lazy SMP. the helpers search the position with the root moves in
+    #another order, every other one a depth ahead, while this process does
+    #its own search. they all meet in the shared table and are stopped when
+    #this search ends, and the deepest completed iteration wins
+    def parallel_search(self, position, hashes, moves, depths):
+        if not self.helpers:
+            self.helpers.append(multiprocessing.Pool(self.workers - 1))
+        self.table.stop(False)
+        board = (position.geometry.rows, position.geometry.cols, bytes(position.drawn),
+                 bytes(position.box_sides), position.edges_left, position.boxes_left)
+        jobs = [ self.helpers[0].apply_async(helper_search, ((self.table.name, self.options, self.time_budget,
+                                                              self.table.generation, index, board, moves, depths),))
+                 for index in xrange(1, self.workers) ]
+        try:
+            best_move = self.deepen(position, hashes, list(moves), depths)
+        finally:
+            self.table.stop()
+            results = [ job.get() for job in jobs ]
+        for depth, value, move, nodes in results:
+            self.nodes += nodes
+            if depth > self.depth:
+                self.depth, self.value, best_move = depth, value, move
+                if depth == position.edges_left:
+                    key, transform = self.symmetry.canonical(hashes)
+                    self.cache_get(position.geometry).put(key, value, FULL_DEPTH,
+                                                          self.symmetry.to_canonical(transform, move))
+        return best_move
+
+    #search while the opponent is to move, the replies are left in the table
+    def ponder(self, engine):
+        self.best_move(engine.position(), ponder = True)
+
+    #the rates of the search of one move for dotstats
+    def record_stats(self, start, probes, hits):
+        elapsed = dotstats.clock() - start
+        probes, hits = self.table.probes - probes, self.table.hits - hits
+        dotstats.record_value('search.move', elapsed)
+        dotstats.count('search.ns', elapsed)
+        dotstats.count('search.nodes', self.nodes)
+        dotstats.count('search.tt_probes', probes)
+        dotstats.count('search.tt_hits', hits)
+        cache = self.cache
+        if cache.hits + cache.misses:
+            dotstats.gauge('eval_cache.hit_rate', float(cache.hits) / (cache.hits + cache.misses))
+
+    def make_move(self, engine, last_move = None):
+        stats = dotstats.enabled
+        if stats:
+            start = dotstats.clock()
+            probes, hits = self.table.probes, self.table.hits
+        edge = self.best_move(engine.position())
+        if stats:
+            self.record_stats(start, probes, hits)
+        if edge is None:
+            return None
+        return engine.geometry.edge_coords(edge)
+
+#the helper strategies of a pool process by the name of their shared table
+helper_map = {}
+
+class SearchHelper(AlphaBetaStrategy):
+
+    def __init__(self, name, options):
+        tt_mb, replacement, max_depth, solve_edges, symmetry = options
+        AlphaBetaStrategy.__init__(self, tt_mb = 0, max_depth = max_depth, solve_edges = solve_edges,
+                                   symmetry = symmetry)
+        self.table = SharedTranspositionTable(max_mb = tt_mb, replacement = replacement, name = name)
+
+    def out_of_time(self):
+        return self.table.stopped() or AlphaBetaStrategy.out_of_time(self)
+
+#runs on the pool, returns the depth, value and move of the last completed
+#iteration and the nodes searched
+def helper_search(job):
+    name, options, time_budget, generation, index, board, moves, depths = job
+    helper = helper_map.get(name)
+    if helper is None:
+        helper = helper_map[name] = SearchHelper(name, options)
+    rows, cols, drawn, box_sides, edges_left, boxes_left = board
+    position = Position(geometry_get(rows, cols))
+    position.drawn[:] = drawn
+    position.box_sides[:] = box_sides
+    position.edges_left = edges_left
+    position.boxes_left = boxes_left
+    helper.keys = zobrist_keys(position.geometry)
+    helper.symmetry = symmetry_get(position.geometry, helper.symmetric)
+    helper.transformed = helper.symmetry.transformed_keys(helper.keys)
+    helper.table.generation = generation
+    helper.nodes = 0
+    helper.depth = 0
+    helper.deadline = timer() + time_budget if time_budget else None
+    #the first move stays first, the rest are rotated
+    shift = index % max(1, len(moves) - 1)
+    moves = moves[:1] + moves[1 + shift:] + moves[1:1 + shift]
+    if index & 1 and len(depths) > 1:
+        depths = depths[1:]
+    move = helper.deepen(position, helper.symmetry.hashes(helper.keys, position), moves, depths)
+    return helper.depth, helper.value, move, helper.nodes
+
+def helpers_close(helpers, table):
+    for pool in helpers:
+        pool.terminate()
+    table.close(unlink = True)
+
+if __name__ == '__main__':
+    rows, cols = 3, 3
+    if len(sys.argv) == 3:
+        rows, cols = int(sys.argv[1]), int(sys.argv[2])
+    engine = GameEngine(rows+1, cols+1)
+    scores = engine.self_play([ AlphaBetaStrategy(), AlphaBetaStrategy() ])
+    print('Player 1 took %d grids. Player 2 took %d grids' %(scores[0], scores[1]))
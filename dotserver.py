@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+#asyncio server hosting headless dots and boxes games against the AI.
+#the protocol is one JSON object per line each way, every request may carry
+#an id that is sent back with its response:
+#  {"op": "new", "rows": 5, "cols": 5, "ai": "chains", "ai_options": {}, "first": "human"}
+#  {"op": "move", "game": 1, "edge": [r1, c1, r2, c2]}
+#  {"op": "state", "game": 1}
+#  {"op": "close", "game": 1}
+#rows and cols are boxes and edges are dots like the game. the responses
+#have "ok" and either "error" or the game with the moves the AI made.
+#the AI moves are made on a bounded pool of processes so the event loop
+#only ever does the rules. a connection stops being read while max_pending
+#of its requests are in flight and its writes wait for the socket to drain.
+#python 3 only.
+#./dotserver.py serve --port 7878 --workers 4
+#./dotserver.py load --port 7878 --connections 200 --games 5 --size 3x3
+import os
+import stat
+import json
+import time
+import random
+import asyncio
+import argparse
+import concurrent.futures
+from collections import OrderedDict
+from dotgraph import *
+from dotengine import GameEngine
+from dotai import strategy_get
+
+timer = time.perf_counter
+
+HUMAN = GameEngine.PLAYER1
+AI = GameEngine.PLAYER2
+MAX_LINE = 1 << 16
+
+class ProtocolError(Exception):
+    pass
+
+#the AI options a client may set and their bounds, either (low, high) of
+#a number, bool or a list of the values allowed. anything else could open
+#files, allocate big tables, start process pools or search without end
+#on the server. the tablebase AI reads the tables the server was started with
+option_limits = {
+    'greedy' : {},
+    'alphabeta' : { 'time_budget' : (0.01, 5.0), 'tt_mb' : (1, 64), 'replacement' : [ 'depth', 'always' ],
+                    'max_depth' : (1, 40), 'solve_edges' : (0, 20), 'symmetry' : bool },
+    'mcts' : { 'iterations' : (1, 100000), 'time_budget' : (0.01, 5.0), 'exploration' : (0.0, 10.0),
+               'seed' : (0, (1 << 31) - 1), 'reuse' : bool },
+    'chains' : {},
+    'nimber' : { 'max_strings' : (1, 16) },
+    'tablebase' : { 'fallback' : [ 'greedy', 'alphabeta', 'mcts', 'chains', 'nimber' ], 'fallback_options' : dict },
+}
+
+#raises ProtocolError unless every option is allowed for the AI and in its bounds
+def options_check(ai, options):
+    if not isinstance(options, dict):
+        raise ProtocolError('ai_options is not an object')
+    limits = option_limits[ai]
+    for name, value in options.items():
+        if name not in limits:
+            raise ProtocolError('Option %s is not allowed for the %s AI' %(name, ai))
+        limit = limits[name]
+        if limit is bool:
+            valid = isinstance(value, bool)
+        elif limit is dict:
+            valid = isinstance(value, dict)
+        elif isinstance(limit, list):
+            valid = value in limit
+        else:
+            kind = int if isinstance(limit[0], int) else (int, float)
+            valid = isinstance(value, kind) and not isinstance(value, bool) and limit[0] <= value <= limit[1]
+        if not valid:
+            raise ProtocolError('Option %s of the %s AI is out of bounds: %r' %(name, ai, value))
+    if ai == 'tablebase':
+        options_check(options.get('fallback', 'greedy'), options.get('fallback_options', {}))
+
+#the strategies of a pool process kept across the games it plays, the
+#least recently used dropped past STRATEGY_CACHE_SIZE
+STRATEGY_CACHE_SIZE = 16
+strategy_cache = OrderedDict()
+
+def strategy_cached(name, options):
+    key = (name, json.dumps(options, sort_keys = True))
+    strategy = strategy_cache.pop(key, None)
+    if strategy is None:
+        strategy = strategy_get(name, **options)
+        while len(strategy_cache) >= STRATEGY_CACHE_SIZE:
+            strategy_cache.popitem(last = False)
+    strategy_cache[key] = strategy
+    return strategy
+
+#runs on the pool. replays the moves of the game, plays the turn of the AI
+#and returns the edges it drew, the turn ends with the first edge taking no box
+def ai_turn(job):
+    rows, cols, moves, name, options, last_move = job
+    strategy = strategy_cached(name, options)
+    engine = GameEngine(rows, cols)
+    for edge, player in moves:
+        engine.play_move(player, engine.geometry.edge_coords(edge))
+    edges = []
+    grid = last_move
+    while not engine.game_finished():
+        grid = strategy.make_move(engine, last_move = grid)
+        if grid is None:
+            break
+        edge = engine.geometry.edge_index(*grid)
+        taken = engine.play_move(AI, grid)
+        if taken is None:
+            raise ValueError('AI %s drew edge %d twice' %(name, edge))
+        edges.append(edge)
+        if not taken:
+            break
+    return edges
+
+class GameSession(object):
+
+    def __init__(self, game, rows, cols, ai, ai_options):
+        self.game = game
+        self.engine = GameEngine(rows+1, cols+1)
+        self.ai = ai
+        self.ai_options = ai_options
+        self.turn = HUMAN
+        #the moves of a game are made one request at a time
+        self.lock = asyncio.Lock()
+
+    #returns the number of boxes the edge took
+    def play(self, player, edge):
+        if not self.engine.mark_edge(edge, player):
+            raise ProtocolError('Edge %d:%d<->%d:%d already drawn' %self.engine.geometry.edge_coords(edge))
+        taken = len(self.engine.mark_edge_move(edge, player))
+        for i in range(taken):
+            self.engine.take_grid(player)
+        if not taken:
+            self.turn ^= 1
+        return taken
+
+    def state(self):
+        engine = self.engine
+        return { 'game' : self.game, 'rows' : engine.rows - 1, 'cols' : engine.cols - 1,
+                 'scores' : list(engine.scores), 'finished' : engine.game_finished(),
+                 'turn' : 'human' if self.turn == HUMAN else 'ai' }
+
+class GameServer(object):
+
+    #max_jobs AI turns are queued for the pool at most, the others wait
+    #tablebases are the table files the tablebase AI reads
+    def __init__(self, workers = None, max_jobs = None, max_pending = 16, max_games = 100000, tablebases = ()):
+        self.tablebases = list(tablebases)
+        self.workers = workers or os.cpu_count()
+        self.pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        self.jobs = asyncio.Semaphore(max_jobs or self.workers * 4)
+        self.max_pending = max_pending
+        self.max_games = max_games
+        self.sessions = {}
+        self.next_game = 1
+        self.connections = 0
+
+    def close(self):
+        self.pool.shutdown(wait = False)
+
+    def session_get(self, request, owned):
+        game = request.get('game')
+        if game not in owned:
+            raise ProtocolError('No game %r on this connection' %(game,))
+        return self.sessions[game]
+
+    async def play_ai(self, session, last_move):
+        engine = session.engine
+        moves = [ (edge, player) for edge, taken, player in engine.history ]
+        job = (engine.rows, engine.cols, moves, session.ai, session.ai_options, last_move)
+        async with self.jobs:
+            edges = await asyncio.get_running_loop().run_in_executor(self.pool, ai_turn, job)
+        moves = []
+        for edge in edges:
+            session.play(AI, edge)
+            moves.append(engine.geometry.edge_coords(edge))
+        return moves
+
+    #the game is only registered once the AI made its first moves, a failed
+    #AI leaves nothing behind
+    async def op_new(self, request, owned):
+        if len(self.sessions) >= self.max_games:
+            raise ProtocolError('Server full')
+        rows, cols = request.get('rows', 3), request.get('cols', 3)
+        if not all(isinstance(x, int) and not isinstance(x, bool) and 1 <= x <= 100 for x in (rows, cols)):
+            raise ProtocolError('Board sizes go from 1 to 100 boxes')
+        ai = request.get('ai', 'greedy')
+        if ai not in option_limits:
+            raise ProtocolError('Unknown AI strategy %s' %(ai,))
+        ai_options = request.get('ai_options', {})
+        options_check(ai, ai_options)
+        if ai == 'tablebase':
+            if not self.tablebases:
+                raise ProtocolError('No tablebases on this server')
+            ai_options = dict(ai_options, paths = self.tablebases)
+        first = request.get('first', 'human')
+        if first not in ('human', 'ai'):
+            raise ProtocolError('first is human or ai')
+        session = GameSession(self.next_game, rows, cols, ai, ai_options)
+        self.next_game += 1
+        moves = []
+        if first == 'ai':
+            session.turn = AI
+            async with session.lock:
+                moves = await self.play_ai(session, None)
+        self.sessions[session.game] = session
+        owned.add(session.game)
+        response = session.state()
+        response['ai'] = moves
+        return response
+
+    async def op_move(self, request, owned):
+        session = self.session_get(request, owned)
+        async with session.lock:
+            engine = session.engine
+            if engine.game_finished():
+                raise ProtocolError('Game %d is finished' %session.game)
+            if session.turn != HUMAN:
+                raise ProtocolError('Not your turn')
+            try:
+                grid = tuple(int(x) for x in request['edge'])
+                edge = engine.geometry.edge_index(*grid)
+            except (KeyError, TypeError, ValueError) as e:
+                raise ProtocolError('Bad edge: %s' %e)
+            played = len(engine.history)
+            taken = session.play(HUMAN, edge)
+            moves = []
+            if session.turn == AI and not engine.game_finished():
+                try:
+                    moves = await self.play_ai(session, grid)
+                except Exception:
+                    #take the move back so that the human can play again
+                    while len(engine.history) > played:
+                        engine.undo()
+                    session.turn = HUMAN
+                    raise
+            response = session.state()
+            response['taken'] = taken
+            response['ai'] = moves
+            return response
+
+    async def op_state(self, request, owned):
+        session = self.session_get(request, owned)
+        response = session.state()
+        engine = session.engine
+        response['edges'] = [ engine.geometry.edge_coords(edge) for edge in range(engine.geometry.num_edges)
+                              if engine.is_drawn(edge) ]
+        return response
+
+    async def op_close(self, request, owned):
+        session = self.session_get(request, owned)
+        owned.discard(session.game)
+        del self.sessions[session.game]
+        return { 'game' : session.game }
+
+    async def respond(self, line, owned, writer, write_lock, pending):
+        request_id = None
+        try:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('not an object')
+            except ValueError as e:
+                raise ProtocolError('Bad JSON: %s' %e)
+            request_id = request.get('id')
+            handler = getattr(self, 'op_%s' %request.get('op'), None)
+            if handler is None:
+                raise ProtocolError('Unknown op %r' %(request.get('op'),))
+            response = await handler(request, owned)
+            response['ok'] = True
+        except ProtocolError as e:
+            response = { 'ok' : False, 'error' : str(e) }
+        except Exception as e:
+            response = { 'ok' : False, 'error' : 'Internal error: %s' %e }
+        if request_id is not None:
+            response['id'] = request_id
+        try:
+            async with write_lock:
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            pending.release()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        owned = set()
+        write_lock = asyncio.Lock()
+        pending = asyncio.Semaphore(self.max_pending)
+        tasks = set()
+        try:
+            while True:
+                #stop reading while the connection has too many requests in flight
+                await pending.acquire()
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError, ConnectionError):
+                    #a line over MAX_LINE or a reset
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    pending.release()
+                    continue
+                task = asyncio.ensure_future(self.respond(line, owned, writer, write_lock, pending))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        finally:
+            for game in owned:
+                self.sessions.pop(game, None)
+            self.connections -= 1
+            writer.close()
+
+async def serve(args):
+    server = GameServer(args.workers, args.max_jobs, args.max_pending, args.max_games, args.tablebase or ())
+    if args.unix:
+        #a socket left behind by a server that is gone
+        if os.path.exists(args.unix) and stat.S_ISSOCK(os.stat(args.unix).st_mode):
+            os.unlink(args.unix)
+        listener = await asyncio.start_unix_server(server.handle, args.unix, limit = MAX_LINE)
+        where = args.unix
+    else:
+        listener = await asyncio.start_server(server.handle, args.host, args.port, limit = MAX_LINE, backlog = 1024)
+        where = '%s:%d' %(args.host, args.port)
+    print('Serving on %s with %d AI workers' %(where, server.workers))
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+#plays random moves for the human on games over one connection, returns
+#the latencies of the move requests
+async def load_connection(args, rows, cols, seed, latencies, errors):
+    if args.unix:
+        reader, writer = await asyncio.open_unix_connection(args.unix, limit = MAX_LINE)
+    else:
+        reader, writer = await asyncio.open_connection(args.host, args.port, limit = MAX_LINE)
+    rand = random.Random(seed)
+    geometry = geometry_get(rows+1, cols+1)
+
+    async def call(request):
+        writer.write(json.dumps(request).encode('utf-8') + b'\n')
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        if not response['ok']:
+            errors.append(response['error'])
+        return response
+
+    try:
+        for i in range(args.games):
+            first = 'ai' if rand.random() < 0.5 else 'human'
+            response = await call({ 'op' : 'new', 'rows' : rows, 'cols' : cols, 'ai' : args.ai,
+                                    'ai_options' : json.loads(args.ai_options), 'first' : first })
+            if not response['ok']:
+                return
+            game = response['game']
+            undrawn = set(range(geometry.num_edges))
+            for grid in response['ai']:
+                undrawn.discard(geometry.edge_index(*grid))
+            while not response['finished']:
+                edge = rand.choice(sorted(undrawn))
+                undrawn.discard(edge)
+                start = timer()
+                response = await call({ 'op' : 'move', 'game' : game, 'edge' : geometry.edge_coords(edge) })
+                latencies.append(timer() - start)
+                if not response['ok']:
+                    return
+                for grid in response['ai']:
+                    undrawn.discard(geometry.edge_index(*grid))
+            await call({ 'op' : 'close', 'game' : game })
+    finally:
+        writer.close()
+
+async def load(args):
+    rows, cols = [ int(x) for x in args.size.lower().split('x') ]
+    latencies = []
+    errors = []
+    start = timer()
+    await asyncio.gather(*[ load_connection(args, rows, cols, args.seed + i, latencies, errors)
+                            for i in range(args.connections) ])
+    elapsed = timer() - start
+    latencies.sort()
+    print('%d connections, %d games, %d moves in %.2fs, %.0f moves/s'
+          %(args.connections, args.connections * args.games, len(latencies), elapsed, len(latencies) / elapsed))
+    print('move latency p50 %.2fms p99 %.2fms max %.2fms'
+          %(percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.99) * 1e3, percentile(latencies, 1.0) * 1e3))
+    if errors:
+        print('%d errors, the first: %s' %(len(errors), errors[0]))
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Serve dots and boxes games against the AI over JSON lines')
+    commands = parser.add_subparsers(dest = 'command')
+    for name, help in (('serve', 'run the server'), ('load', 'load test a running server')):
+        command = commands.add_parser(name, help = help)
+        command.add_argument('--host', default = '127.0.0.1')
+        command.add_argument('--port', type = int, default = 7878)
+        command.add_argument('--unix', help = 'unix socket path instead of TCP')
+    command = commands.choices['serve']
+    command.add_argument('--workers', type = int, help = 'AI processes, the number of cores by default')
+    command.add_argument('--max-jobs', type = int, help = 'AI turns queued for the workers at most')
+    command.add_argument('--max-pending', type = int, default = 16, help = 'requests in flight per connection')
+    command.add_argument('--max-games', type = int, default = 100000)
+    command.add_argument('--tablebase', action = 'append', help = 'table file of the tablebase AI, can be repeated')
+    command = commands.choices['load']
+    command.add_argument('--connections', type = int, default = 100)
+    command.add_argument('--games', type = int, default = 5, help = 'games per connection')
+    command.add_argument('--size', default = '3x3', help = 'board size in boxes')
+    command.add_argument('--ai', default = 'greedy')
+    command.add_argument('--ai-options', default = '{}', help = 'JSON options for the AI')
+    command.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        try:
+            asyncio.run(serve(args))
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'load':
+        asyncio.run(load(args))
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+#instrumentation of the hot paths, off by default.
+#the code being measured tests enabled before anything else so that it
+#costs a global lookup when off:
+#  if dotstats.enabled:
+#      start = dotstats.clock()
+#  ...
+#  if dotstats.enabled:
+#      dotstats.record('make_move', start)
+#latencies go to log linear histograms of nanoseconds that keep about 1%
+#precision from 1ns to hours in about 30 kilobytes, like HdrHistogram, next
+#to counters of events, rates of one counter over another and gauges of
+#the last value of something.
+#all of it can be dumped as JSON or scraped over http on localhost.
+#./dotstats.py stats.json
+import sys
+import json
+import time
+import threading
+from array import array
+from dotgraph import *
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+enabled = False
+
+#nanoseconds of a monotonic clock
+clock_ns = getattr(time, 'perf_counter_ns', None)
+if clock_ns is None:
+    timer = getattr(time, 'perf_counter', time.time)
+    def clock_ns():
+        return int(timer() * 1e9)
+clock = clock_ns
+
+#each power of 2 is split in SUB_BUCKETS / 2 linear buckets
+SUB_BITS = 7
+SUB_BUCKETS = 1 << SUB_BITS
+HALF_BITS = SUB_BITS - 1
+#values of up to 64 bits
+NUM_BUCKETS = (64 - SUB_BITS + 2) << HALF_BITS
+PERCENTILES = (50, 90, 99, 99.9)
+
+def bucket_index(value):
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BITS
+    return (shift << HALF_BITS) + (value >> shift)
+
+#the smallest value of the bucket
+def bucket_value(index):
+    if index < SUB_BUCKETS:
+        return index
+    shift = (index >> HALF_BITS) - 1
+    return (index - (shift << HALF_BITS)) << shift
+
+class Histogram(object):
+
+    def __init__(self):
+        self.counts = array('d', [0]) * NUM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value):
+        if value < 0:
+            value = 0
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    #the value below which p percent of the values fall, to the precision
+    #of the buckets
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        rank = self.count * p / 100.0
+        seen = 0
+        for index in xrange(NUM_BUCKETS):
+            seen += self.counts[index]
+            if seen >= rank and self.counts[index]:
+                return min(bucket_value(index), self.max)
+        return self.max
+
+    def mean(self):
+        return float(self.total) / self.count if self.count else 0.0
+
+    def reset(self):
+        self.__init__()
+
+    def to_dict(self):
+        result = { 'count' : self.count, 'min' : self.min or 0, 'max' : self.max, 'mean' : self.mean() }
+        for p in PERCENTILES:
+            result['p%s' %('%g' %p).replace('.', '')] = self.percentile(p)
+        #the buckets in use as [smallest value, count]
+        result['buckets'] = [ [ bucket_value(index), int(self.counts[index]) ]
+                              for index in xrange(NUM_BUCKETS) if self.counts[index] ]
+        return result
+
+histogram_map = {}
+counter_map = {}
+gauge_map = {}
+#name to the numerator and denominator counters and the scale of a rate
+rate_map = {}
+#records can come from the AI thread next to the game loop
+lock = threading.Lock()
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def histogram_get(name):
+    histogram = histogram_map.get(name)
+    if histogram is None:
+        histogram = histogram_map[name] = Histogram()
+    return histogram
+
+#record the nanoseconds since start, a clock() value, in the histogram
+def record(name, start):
+    elapsed = clock() - start
+    with lock:
+        histogram_get(name).record(elapsed)
+
+def record_value(name, value):
+    with lock:
+        histogram_get(name).record(int(value))
+
+def count(name, n = 1):
+    with lock:
+        counter_map[name] = counter_map.get(name, 0) + n
+
+def gauge(name, value):
+    with lock:
+        gauge_map[name] = value
+
+#a rate worked out from the counters for the snapshots
+def rate(name, numerator, denominator, scale = 1):
+    rate_map[name] = (numerator, denominator, scale)
+
+def rates():
+    result = {}
+    for name, (numerator, denominator, scale) in rate_map.items():
+        if counter_map.get(denominator):
+            result[name] = float(counter_map.get(numerator, 0)) * scale / counter_map[denominator]
+    return result
+
+def reset():
+    with lock:
+        histogram_map.clear()
+        counter_map.clear()
+        gauge_map.clear()
+
+def snapshot():
+    with lock:
+        return { 'unit' : 'ns',
+                 'histograms' : dict( (name, histogram.to_dict()) for name, histogram in histogram_map.items() ),
+                 'counters' : dict(counter_map),
+                 'rates' : rates(),
+                 'gauges' : dict(gauge_map) }
+
+def dump(path = None):
+    text = json.dumps(snapshot(), indent = 1, sort_keys = True)
+    if path is None:
+        return text
+    with open(path, 'w') as f:
+        f.write(text + '\n')
+    return text
+
+class StatsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = dump().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+#serve the snapshot as JSON on localhost from a daemon thread, returns the server
+def serve(port = 9464, host = '127.0.0.1'):
+    server = HTTPServer((host, port), StatsHandler)
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+#a summary of a dump, the latencies in microseconds
+def summarize(stats):
+    lines = []
+    for name, histogram in sorted(stats['histograms'].items()):
+        lines.append('%-28s %8d  mean %10.1fus  p50 %10.1fus  p99 %10.1fus  max %10.1fus'
+                     %(name, histogram['count'], histogram['mean'] / 1e3, histogram['p50'] / 1e3,
+                       histogram['p99'] / 1e3, histogram['max'] / 1e3))
+    for name, value in sorted(stats['counters'].items()):
+        lines.append('%-28s %8d' %(name, value))
+    for name, value in sorted(list(stats['rates'].items()) + list(stats['gauges'].items())):
+        lines.append('%-28s %12.3f' %(name, value))
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.stderr.write('usage: %s stats.json\n' %sys.argv[0])
+        sys.exit(1)
+    with open(sys.argv[1], 'r') as f:
+        print(summarize(json.load(f)))
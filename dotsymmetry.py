@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+#symmetries of the board for the searches.
+#a board of rows x cols dots has 4 symmetries, the identity, the 2 mirrors
+#and the half turn, and a square board 4 more, the 2 diagonal mirrors and
+#the quarter turns. each one is kept as a permutation of the edge indices so
+#a position and its mirror images can be hashed to the same canonical key.
+import sys
+from array import array
+from collections import OrderedDict
+from dotgraph import *
+
+class BoardSymmetry(object):
+
+    #only the identity when symmetric is not set
+    def __init__(self, geometry, symmetric = True):
+        self.geometry = geometry
+        rows, cols = geometry.rows, geometry.cols
+        last_r, last_c = rows - 1, cols - 1
+        transforms = [ lambda r, c: (r, c) ]
+        if symmetric:
+            transforms += [ lambda r, c: (last_r - r, c),
+                            lambda r, c: (r, last_c - c),
+                            lambda r, c: (last_r - r, last_c - c) ]
+            if rows == cols:
+                transforms += [ lambda r, c: (c, r),
+                                lambda r, c: (last_c - c, last_r - r),
+                                lambda r, c: (c, last_r - r),
+                                lambda r, c: (last_c - c, r) ]
+        self.count = len(transforms)
+        #perms[t][edge] is the image of the edge, inverses[t] maps it back
+        self.perms = []
+        self.inverses = []
+        for transform in transforms:
+            perm = array('i', [0]) * geometry.num_edges
+            inverse = array('i', [0]) * geometry.num_edges
+            for edge in xrange(geometry.num_edges):
+                r1, c1, r2, c2 = geometry.edge_coords(edge)
+                r1, c1 = transform(r1, c1)
+                r2, c2 = transform(r2, c2)
+                image = geometry.edge_index(r1, c1, r2, c2)
+                perm[edge] = image
+                inverse[image] = edge
+            self.perms.append(perm)
+            self.inverses.append(inverse)
+        self.keys = None
+        self.transformed = None
+
+    #the zobrist keys of every symmetry, the key of an edge under a symmetry
+    #being the key of its image. cached for the last keys used
+    def transformed_keys(self, keys):
+        if self.keys is not keys:
+            self.keys = keys
+            self.transformed = [ array(keys.typecode, [ keys[image] for image in perm ]) for perm in self.perms ]
+        return self.transformed
+
+    #the hash of the position under every symmetry
+    def hashes(self, keys, position):
+        result = []
+        for transformed in self.transformed_keys(keys):
+            key = 0
+            for edge in xrange(self.geometry.num_edges):
+                if position.drawn[edge]:
+                    key ^= transformed[edge]
+            result.append(key)
+        return result
+
+    #the hashes after drawing the edge
+    def update(self, keys, hashes, edge):
+        return [ key ^ transformed[edge] for key, transformed in zip(hashes, self.transformed_keys(keys)) ]
+
+    #the canonical key is the smallest of the hashes. returns it with the
+    #symmetry taking the position to the canonical one
+    def canonical(self, hashes):
+        key = min(hashes)
+        return key, hashes.index(key)
+
+    def to_canonical(self, transform, edge):
+        return self.perms[transform][edge]
+
+    def from_canonical(self, transform, edge):
+        return self.inverses[transform][edge]
+
+symmetry_map = OrderedDict()
+
+def symmetry_get(geometry, symmetric = True):
+    return cache_get(symmetry_map, (geometry.rows, geometry.cols, symmetric),
+                     lambda: BoardSymmetry(geometry, symmetric))
+
+#bounded cache of evaluated positions keyed by the canonical key, the moves
+#kept in the canonical frame. the least recently used entry is evicted when
+#full and an entry is not replaced by one searched less deep
+class EvaluationCache(object):
+
+    def __init__(self, max_entries = 1 << 16):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    #returns (value, depth, move) or None
+    def get(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries[key] = entry
+        self.hits += 1
+        return entry
+
+    def put(self, key, value, depth, move):
+        entry = self.entries.pop(key, None)
+        if entry is not None and entry[1] > depth:
+            self.entries[key] = entry
+            return
+        self.entries[key] = (value, depth, move)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last = False)
+            self.evictions += 1
+
+#one cache per board size shared by all the strategies of the process, the
+#sizes bounded like the geometries
+cache_map = OrderedDict()
+
+def evaluation_cache(geometry, max_entries = 1 << 16):
+    return cache_get(cache_map, (geometry.rows, geometry.cols), lambda: EvaluationCache(max_entries))
+
+#the cache of the board if a strategy has made one, for the lookups that
+#should not make it
+def evaluation_cache_find(geometry):
+    return cache_map.get((geometry.rows, geometry.cols))
+
+#forget every position, for games that have to come out the same however
+#the games before them went
+def evaluation_cache_clear():
+    cache_map.clear()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+#endgame tablebase of solved positions in a memory mapped file.
+#positions are solved offline, either all of them from the empty board for
+#small boards or the late game of sampled games for the bigger ones, and
+#written to an open addressed hash table keyed by the canonical zobrist
+#key of the position. the games memory map the file read only so the
+#processes on a host share its pages.
+#./dottablebase.py generate 2x3.dtb --size 2x3 --full
+#./dottablebase.py generate 4x4.dtb --size 4x4 --games 200 --max-edges 14
+#./dottablebase.py info 4x4.dtb
+import os
+import mmap
+import time
+import random
+import struct
+import argparse
+from dotgraph import *
+from dotengine import GameEngine, Position, GreedyStrategy
+from dotsearch import zobrist_keys
+from dotsymmetry import symmetry_get
+import dotstats
+
+MAGIC = b'DOTB'
+VERSION = 1
+#magic, version, rows and cols in dots, number of slots and of entries
+HEADER = struct.Struct('<4sB3xIIQQ')
+#canonical key, value for the side to move and the best move in the canonical frame
+ENTRY = struct.Struct('<QhH')
+EMPTY = 0xffff
+
+timer = getattr(time, 'perf_counter', time.time)
+
+#exact negamax of every position below the one given, memoized by the
+#canonical key. a capture no box with 2 sides is next to is always taken
+class Solver(object):
+
+    def __init__(self, geometry):
+        self.geometry = geometry
+        self.symmetry = symmetry_get(geometry)
+        self.keys = zobrist_keys(geometry)
+        self.transformed = self.symmetry.transformed_keys(self.keys)
+        #canonical key to (value, canonical move)
+        self.solved = {}
+
+    def solve(self, position):
+        return self.search(position, self.symmetry.hashes(self.keys, position))
+
+    def search(self, position, hashes):
+        if position.edges_left == 0:
+            return 0
+        key = min(hashes)
+        entry = self.solved.get(key)
+        if entry is not None:
+            return entry[0]
+        moves = position.moves()
+        for edge in moves:
+            if position.captures(edge) and position.forced_capture(edge):
+                moves = [ edge ]
+                break
+        best, best_move = None, -1
+        transformed = self.transformed
+        for edge in moves:
+            gained = position.play(edge)
+            child_hashes = [ child_key ^ keys[edge] for child_key, keys in zip(hashes, transformed) ]
+            if gained:
+                value = gained + self.search(position, child_hashes)
+            else:
+                value = -self.search(position, child_hashes)
+            position.undo(edge)
+            if best is None or value > best:
+                best, best_move = value, edge
+        transform = hashes.index(key)
+        self.solved[key] = (best, self.symmetry.perms[transform][best_move])
+        return best
+
+def write_table(path, geometry, solved):
+    slots = 1
+    #at most half full so the probes stay short
+    while slots < len(solved) * 2:
+        slots *= 2
+    mask = slots - 1
+    buf = bytearray(HEADER.size + slots * ENTRY.size)
+    HEADER.pack_into(buf, 0, MAGIC, VERSION, geometry.rows, geometry.cols, slots, len(solved))
+    for slot in xrange(slots):
+        ENTRY.pack_into(buf, HEADER.size + slot * ENTRY.size, 0, 0, EMPTY)
+    for key, (value, move) in solved.items():
+        slot = key & mask
+        while ENTRY.unpack_from(buf, HEADER.size + slot * ENTRY.size)[2] != EMPTY:
+            slot = (slot + 1) & mask
+        ENTRY.pack_into(buf, HEADER.size + slot * ENTRY.size, key, value, move)
+    with open(path, 'wb') as f:
+        f.write(buf)
+
+class Tablebase(object):
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < HEADER.size:
+            self.file.close()
+            raise ValueError('%s is not a tablebase' %path)
+        self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, rows, cols, slots, entries = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION or size != HEADER.size + slots * ENTRY.size:
+            self.close()
+            raise ValueError('%s is not a version %d tablebase' %(path, VERSION))
+        self.rows, self.cols = rows, cols
+        self.slots, self.entries = slots, entries
+        self.mask = slots - 1
+        self.geometry = geometry_get(rows, cols)
+        self.symmetry = symmetry_get(self.geometry)
+        self.keys = zobrist_keys(self.geometry)
+        self.hits = 0
+        self.misses = 0
+
+    #returns (value, canonical move) or None
+    def probe_key(self, key):
+        slot = key & self.mask
+        while True:
+            entry_key, value, move = ENTRY.unpack_from(self.map, HEADER.size + slot * ENTRY.size)
+            if move == EMPTY:
+                return None
+            if entry_key == key:
+                return value, move
+            slot = (slot + 1) & self.mask
+
+    #returns (value, edge) of the position or None when it is not in the table
+    def probe(self, position):
+        geometry = position.geometry
+        if geometry.rows != self.rows or geometry.cols != self.cols:
+            return None
+        key, transform = self.symmetry.canonical(self.symmetry.hashes(self.keys, position))
+        entry = self.probe_key(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        value, move = entry
+        return value, self.symmetry.from_canonical(transform, move)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+#plays the tablebase move when the position is in one of the tables and
+#asks the fallback strategy otherwise
+class TablebaseStrategy(object):
+
+    def __init__(self, paths, fallback):
+        if not isinstance(paths, (list, tuple)):
+            paths = [ paths ]
+        self.tablebases = [ Tablebase(path) for path in paths ]
+        self.fallback = fallback
+
+    #the worker stops the strategy it runs, which is the fallback
+    @property
+    def stopped(self):
+        return getattr(self.fallback, 'stopped', False)
+
+    @stopped.setter
+    def stopped(self, value):
+        self.fallback.stopped = value
+
+    def ponder(self, engine):
+        ponder = getattr(self.fallback, 'ponder', None)
+        if ponder is not None:
+            ponder(engine)
+
+    def make_move(self, engine, last_move = None):
+        if engine.edges_left > 0:
+            position = engine.position()
+            for tablebase in self.tablebases:
+                found = tablebase.probe(position)
+                if found is not None:
+                    if dotstats.enabled:
+                        dotstats.count('tablebase.hits')
+                    return engine.geometry.edge_coords(found[1])
+            if dotstats.enabled:
+                dotstats.count('tablebase.misses')
+        return self.fallback.make_move(engine, last_move = last_move)
+
+#solve the late game of greedy games opened with random safe moves
+def generate_sampled(solver, rows, cols, games, max_edges, seed, opening):
+    rand = random.Random(seed)
+    strategy = GreedyStrategy()
+    for i in xrange(games):
+        engine = GameEngine(rows, cols)
+        player = engine.PLAYER1
+        grid = None
+        moves = 0
+        while engine.edges_left > max_edges:
+            safe = engine.buckets[engine.SAFE]
+            if moves < opening and safe:
+                grid = engine.geometry.edge_coords(safe.members[rand.randrange(len(safe))])
+            else:
+                grid = strategy.make_move(engine, last_move = grid)
+            moves += 1
+            if not engine.play_move(player, grid):
+                player ^= 1
+        solver.solve(engine.position())
+
+def parse_size(size):
+    rows, cols = size.lower().split('x')
+    return int(rows), int(cols)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Generate and inspect dots and boxes endgame tablebases')
+    commands = parser.add_subparsers(dest = 'command')
+    command = commands.add_parser('generate', help = 'solve positions and write the table')
+    command.add_argument('table')
+    command.add_argument('--size', default = '2x2', help = 'board size in boxes')
+    command.add_argument('--full', action = 'store_true', help = 'solve every position from the empty board')
+    command.add_argument('--games', type = int, default = 100, help = 'sampled games without --full')
+    command.add_argument('--max-edges', type = int, default = 14, help = 'undrawn edges of the sampled positions')
+    command.add_argument('--seed', type = int, default = 0)
+    command.add_argument('--opening', type = int, default = 4, help = 'random safe moves opening each game')
+    command = commands.add_parser('info', help = 'describe the table')
+    command.add_argument('table')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        rows, cols = parse_size(args.size)
+        geometry = geometry_get(rows+1, cols+1)
+        solver = Solver(geometry)
+        start = timer()
+        if args.full:
+            value = solver.solve(Position(geometry))
+            print('The first player makes %+d boxes' %value)
+        else:
+            generate_sampled(solver, rows+1, cols+1, args.games, args.max_edges, args.seed, args.opening)
+        write_table(args.table, geometry, solver.solved)
+        print('%d positions solved in %.1fs, %d bytes' %(len(solver.solved), timer() - start, os.path.getsize(args.table)))
+    elif args.command == 'info':
+        tablebase = Tablebase(args.table)
+        print('%dx%d boxes, %d positions in %d slots, %d bytes' %(tablebase.rows-1, tablebase.cols-1, tablebase.entries,
+                                                                tablebase.slots, HEADER.size + tablebase.slots * ENTRY.size))
+        tablebase.close()
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
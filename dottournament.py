@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+#play AI strategies against each other on a pool of worker processes.
+#./dottournament.py greedy chains --games 100 --sizes 3x3,5x5 --output results.jsonl
+import json
+import math
+import time
+import random
+import inspect
+import argparse
+import multiprocessing
+from dotgraph import *
+from dotengine import GameEngine
+from dotsymmetry import evaluation_cache_clear
+from dotai import strategies, strategy_get
+
+timer = getattr(time, 'perf_counter', time.time)
+
+getargspec = getattr(inspect, 'getfullargspec', None) or inspect.getargspec
+
+#whether the strategy takes the option. the classes take their options in
+#__init__, the factories directly
+def accepts(make, option):
+    init = getattr(make, '__init__', None) if isinstance(make, type) else make
+    try:
+        return option in getargspec(init).args
+    except TypeError:
+        #object.__init__ of the strategies without a constructor
+        return False
+
+#the strategies search to an iteration or depth limit unless their options
+#give them a time budget. timed games depend on the load of the machine
+#and the number of workers, so they are not reproducible from the seed
+reproducible_options = {
+    'alphabeta' : { 'time_budget' : None, 'max_depth' : 4 },
+    'mcts' : { 'time_budget' : None },
+}
+
+#unless shared_cache is set the strategies of a game keep the positions
+#they solve to themselves, so that one does not play the moves the other
+#searched
+def tournament_options(name, options, shared_cache = False):
+    if 'time_budget' not in options:
+        options = dict(reproducible_options.get(name, {}), **options)
+    if not shared_cache and accepts(strategies[name], 'shared_cache'):
+        options = dict({ 'shared_cache' : False }, **options)
+    return options
+
+def strategy_make(name, options, seed):
+    options = dict(options)
+    #strategies with randomness get a seed of their own from the game seed
+    if accepts(strategies[name], 'seed'):
+        options.setdefault('seed', seed)
+    return strategy_get(name, **options)
+
+#play one game. the first opening moves are random safe edges picked with
+#the game seed so that games between deterministic strategies differ.
+#the shared cache starts empty so the game does not depend on the games
+#played before it on the worker
+def play_game(job):
+    index, rows, cols, seed, a_first, names, options, opening = job
+    evaluation_cache_clear()
+    rand = random.Random(seed)
+    engine = GameEngine(rows+1, cols+1)
+    strategy_a = strategy_make(names[0], options[0], rand.getrandbits(32))
+    strategy_b = strategy_make(names[1], options[1], rand.getrandbits(32))
+    players = [ strategy_a, strategy_b ] if a_first else [ strategy_b, strategy_a ]
+    start = timer()
+    player = engine.PLAYER1
+    grid = None
+    moves = 0
+    while engine.game_finished() == False:
+        safe = engine.buckets[engine.SAFE]
+        if moves < opening and safe:
+            grid = engine.geometry.edge_coords(safe.members[rand.randrange(len(safe))])
+        else:
+            grid = players[player].make_move(engine, last_move = grid)
+        if grid is None:
+            break
+        moves += 1
+        if not engine.play_move(player, grid):
+            player ^= 1
+    first, second = engine.scores
+    score_a, score_b = (first, second) if a_first else (second, first)
+    if score_a > score_b:
+        winner = 'a'
+    elif score_b > score_a:
+        winner = 'b'
+    else:
+        winner = 'draw'
+    return { 'game' : index, 'rows' : rows, 'cols' : cols, 'seed' : seed,
+             'first' : 'a' if a_first else 'b', 'a' : names[0], 'b' : names[1],
+             'score_a' : score_a, 'score_b' : score_b, 'winner' : winner,
+             'moves' : moves, 'seconds' : round(timer() - start, 6) }
+
+#wilson score interval of the proportion
+def wilson(successes, n, z = 1.96):
+    if n == 0:
+        return (0.0, 0.0)
+    p = float(successes) / n
+    denominator = 1 + z*z/n
+    centre = (p + z*z/(2*n)) / denominator
+    margin = z * math.sqrt(p*(1-p)/n + z*z/(4*n*n)) / denominator
+    return (max(0.0, centre - margin), min(1.0, centre + margin))
+
+def parse_sizes(sizes):
+    result = []
+    for size in sizes.split(','):
+        rows, cols = size.lower().split('x')
+        result.append( (int(rows), int(cols)) )
+    return result
+
+def summarize(results, names):
+    def line(label, games):
+        n = len(games)
+        wins = len([ g for g in games if g['winner'] == 'a' ])
+        draws = len([ g for g in games if g['winner'] == 'draw' ])
+        #a draw counts as half a win
+        score = wins + draws / 2.0
+        low, high = wilson(score, n)
+        rate = score / n if n else 0.0
+        return '%-8s %5d games  %s wins %d, draws %d, losses %d  score %.3f [%.3f, %.3f]' \
+            %(label, n, names[0], wins, draws, n - wins - draws, rate, low, high)
+    sizes = sorted(set( (g['rows'], g['cols']) for g in results ))
+    lines = [ line('%dx%d' %size, [ g for g in results if (g['rows'], g['cols']) == size ]) for size in sizes ]
+    lines.append(line('total', results))
+    return '\n'.join(lines)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Play two dots and boxes AI strategies against each other')
+    parser.add_argument('a', choices = sorted(strategies.keys()))
+    parser.add_argument('b', choices = sorted(strategies.keys()))
+    parser.add_argument('--games', type = int, default = 100, help = 'games per board size')
+    parser.add_argument('--sizes', default = '3x3,5x5', help = 'comma separated board sizes in boxes')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--opening', type = int, default = 2, help = 'random safe moves opening each game')
+    parser.add_argument('--workers', type = int, default = multiprocessing.cpu_count())
+    parser.add_argument('--options-a', default = '{}', help = 'JSON options for strategy a')
+    parser.add_argument('--options-b', default = '{}', help = 'JSON options for strategy b')
+    parser.add_argument('--output', help = 'JSONL file the results are streamed to')
+    parser.add_argument('--shared-cache', action = 'store_true',
+                        help = 'let the strategies of a game play the positions either one has solved')
+    args = parser.parse_args(argv)
+
+    names = (args.a, args.b)
+    options = (tournament_options(args.a, json.loads(args.options_a), args.shared_cache),
+               tournament_options(args.b, json.loads(args.options_b), args.shared_cache))
+    rand = random.Random(args.seed)
+    jobs = []
+    for rows, cols in parse_sizes(args.sizes):
+        for i in xrange(args.games):
+            #a and b take turns to play first
+            jobs.append( (len(jobs), rows, cols, rand.getrandbits(32), i % 2 == 0, names, options, args.opening) )
+
+    output = open(args.output, 'w') if args.output else None
+    results = []
+    start = timer()
+    pool = None
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers)
+        #batch the small games so the workers are not waiting on the queue
+        chunksize = max(1, len(jobs) // (args.workers * 16))
+        games = pool.imap_unordered(play_game, jobs, chunksize)
+    else:
+        games = (play_game(job) for job in jobs)
+    try:
+        for result in games:
+            results.append(result)
+            if output:
+                output.write(json.dumps(result, sort_keys = True) + '\n')
+                output.flush()
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        if output:
+            output.close()
+    results.sort(key = lambda g: g['game'])
+    elapsed = timer() - start
+    print(summarize(results, names))
+    print('%d games in %.1fs on %d workers' %(len(results), elapsed, args.workers))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#runs an AI strategy on a background thread so the game loop never blocks on it.
+#the worker keeps a mirror engine of its own that the moves are sent to, so
+#the strategy never touches the engine the game loop is using.
+import sys
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from dotgraph import *
+from dotengine import GameEngine
+import dotstats
+
+class AIWorker(object):
+
+    #notify is called from the worker thread when a move is ready
+    def __init__(self, strategy, rows, cols, notify = None):
+        self.strategy = strategy
+        self.engine = GameEngine(rows, cols)
+        self.notify = notify
+        self.requests = queue.Queue()
+        self.responses = queue.Queue()
+        self.lock = threading.Lock()
+        #requests with an older generation were cancelled
+        self.generation = 0
+        #the generation to be played without thinking further
+        self.hurried = -1
+        self.busy = False
+        self.pondering = False
+        #strategies that can be interrupted look at stopped
+        strategy.stopped = False
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    #queue a message, stopping a ponder so the worker gets to it
+    def send(self, message):
+        with self.lock:
+            self.requests.put(message)
+            if self.pondering:
+                self.strategy.stopped = True
+
+    #a move made on the game engine by either player
+    def play(self, player, edge):
+        self.send(('play', player, edge))
+
+    #a move taken back or made again on the game engine
+    def undo(self):
+        self.send(('undo',))
+
+    def redo(self):
+        self.send(('redo',))
+
+    def request_move(self, last_move = None):
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+        self.send(('move', generation, last_move))
+
+    #think on the opponents time until the next message
+    def ponder(self):
+        if getattr(self.strategy, 'ponder', None) is not None:
+            self.send(('ponder',))
+
+    #drop the requested move
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+            if self.busy:
+                self.strategy.stopped = True
+
+    #return the best move found so far, or as soon as possible if the
+    #worker has not started on it yet
+    def hurry(self):
+        with self.lock:
+            self.hurried = self.generation
+            if self.busy:
+                self.strategy.stopped = True
+
+    #returns the requested move when it is ready, possibly None for no
+    #moves left, and False while it is not
+    def poll(self):
+        while True:
+            try:
+                generation, grid = self.responses.get_nowait()
+            except queue.Empty:
+                return False
+            if generation == self.generation:
+                return grid
+
+    def stop(self, timeout = 1.0):
+        self.cancel()
+        self.send(('stop',))
+        self.thread.join(timeout)
+
+    def play_edge(self, player, edge):
+        if self.engine.mark_edge(edge, player):
+            for grid in self.engine.mark_edge_move(edge):
+                self.engine.take_grid(player)
+
+    def run(self):
+        strategy = self.strategy
+        while True:
+            message = self.requests.get()
+            kind = message[0]
+            if kind == 'stop':
+                return
+            if kind == 'play':
+                self.play_edge(message[1], message[2])
+            elif kind == 'undo':
+                self.engine.undo()
+            elif kind == 'redo':
+                self.engine.redo()
+            elif kind == 'move':
+                generation, last_move = message[1], message[2]
+                with self.lock:
+                    if generation != self.generation:
+                        continue
+                    self.busy = True
+                    strategy.stopped = generation == self.hurried
+                if dotstats.enabled:
+                    start = dotstats.clock()
+                grid = strategy.make_move(self.engine, last_move = last_move)
+                if dotstats.enabled:
+                    dotstats.record('ai.move', start)
+                with self.lock:
+                    self.busy = False
+                    self.responses.put((generation, grid))
+                if self.notify is not None:
+                    self.notify()
+            elif kind == 'ponder':
+                with self.lock:
+                    #something newer is already waiting
+                    if not self.requests.empty() or self.engine.game_finished():
+                        continue
+                    self.pondering = True
+                    strategy.stopped = False
+                strategy.ponder(self.engine)
+                with self.lock:
+                    self.pondering = False